@@ -0,0 +1,231 @@
+from __future__ import annotations
+
+import time
+from datetime import datetime
+from typing import Any
+
+import numpy as np
+from sqlalchemy import and_, select
+from sqlalchemy.orm import Session
+
+from .models import StripSocket
+from .tsstore import telemetry_store
+
+BIN_SECONDS = 60
+SPIKE_WINDOW_BINS = 60
+SPIKE_Z = 4.0
+SPIKE_MIN_DELTA_W = 30.0
+STANDBY_MIN_W = 0.5
+STANDBY_MAX_W = 15.0
+STANDBY_NIGHT_END_HOUR = 6
+STANDBY_MIN_FRACTION = 0.8
+STANDBY_MIN_NIGHT_BINS = 60
+SHIFT_MIN_RATIO = 0.5
+SHIFT_MIN_DELTA_W = 10.0
+SHIFT_MIN_DAY_BINS = 20 * 60
+SOCKET_OUTLIER_Z = 3.5
+SOCKET_OUTLIER_MIN_W = 50.0
+MAX_EVENTS_PER_KIND = 3
+
+
+def _local_offset() -> int:
+    return time.localtime().tm_gmtoff
+
+
+def _fmt_ts(ts: int) -> str:
+    return datetime.fromtimestamp(int(ts)).strftime("%m-%d %H:%M")
+
+
+def resample(ts: Any, power: Any, bin_seconds: int = BIN_SECONDS) -> tuple[np.ndarray, np.ndarray]:
+    # Mean power per fixed-width bin; empty bins are dropped. Memory after this
+    # step depends on the time span only, not on the sample rate.
+    ts_arr = np.asarray(ts, dtype=np.int64)
+    power_arr = np.asarray(power, dtype=np.float64)
+    if ts_arr.size == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+    start = int(ts_arr.min()) // bin_seconds * bin_seconds
+    idx = (ts_arr - start) // bin_seconds
+    sums = np.bincount(idx, weights=power_arr)
+    counts = np.bincount(idx)
+    filled = counts > 0
+    bin_ts = start + np.flatnonzero(filled) * bin_seconds
+    return bin_ts, sums[filled] / counts[filled]
+
+
+def _group_runs(indices: np.ndarray) -> list[np.ndarray]:
+    if indices.size == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(indices) > 1) + 1
+    return np.split(indices, breaks)
+
+
+def detect_spikes(ts: np.ndarray, power: np.ndarray, window: int = SPIKE_WINDOW_BINS) -> list[dict[str, Any]]:
+    if power.size <= 2 * window:
+        return []
+    c1 = np.concatenate(([0.0], np.cumsum(power)))
+    c2 = np.concatenate(([0.0], np.cumsum(power * power)))
+    i = np.arange(window, power.size - window)
+    mean = (c1[i] - c1[i - window]) / window
+    var = (c2[i] - c2[i - window]) / window - mean * mean
+    std = np.sqrt(np.maximum(var, 0.0))
+    delta = power[i] - mean
+    # Floor the deviation at 1W so a perfectly flat window does not turn noise into spikes.
+    z = delta / np.maximum(std, 1.0)
+    # A spike must also stand out from the following window, otherwise it is a
+    # step change (e.g. lights on in the morning) and not a transient.
+    after = (c1[i + window + 1] - c1[i + 1]) / window
+    hits = i[(z > SPIKE_Z) & (delta > SPIKE_MIN_DELTA_W) & (power[i] - after > SPIKE_MIN_DELTA_W)]
+
+    events: list[dict[str, Any]] = []
+    for run in _group_runs(hits):
+        top = run[np.argmax(power[run])]
+        events.append(
+            {
+                "kind": "spike",
+                "ts": int(ts[top]),
+                "power_w": float(power[top]),
+                "delta_w": float(power[top] - mean[top - window]),
+            }
+        )
+    events.sort(key=lambda e: e["delta_w"], reverse=True)
+    return events
+
+
+def detect_standby_drain(ts: np.ndarray, power: np.ndarray, bin_seconds: int = BIN_SECONDS) -> dict[str, Any] | None:
+    if power.size == 0:
+        return None
+    local = ts + _local_offset()
+    night = (local // 3600) % 24 < STANDBY_NIGHT_END_HOUR
+    if not night.any():
+        return None
+    day = local[night] // 86400
+    day -= day.min()
+    p = power[night]
+    low = (p > STANDBY_MIN_W) & (p <= STANDBY_MAX_W)
+    night_bins = np.bincount(day)
+    low_bins = np.bincount(day, weights=low.astype(np.float64), minlength=night_bins.size)
+    low_power = np.bincount(day, weights=np.where(low, p, 0.0), minlength=night_bins.size)
+    drained = (night_bins >= STANDBY_MIN_NIGHT_BINS) & (low_bins >= STANDBY_MIN_FRACTION * night_bins)
+    nights = int(drained.sum())
+    if nights == 0:
+        return None
+    wh = float(low_power[drained].sum()) * bin_seconds / 3600.0
+    return {
+        "kind": "standby_drain",
+        "nights": nights,
+        "avg_power_w": float(low_power[drained].sum() / low_bins[drained].sum()),
+        "energy_kwh": wh / 1000.0,
+    }
+
+
+def detect_baseline_shifts(ts: np.ndarray, power: np.ndarray) -> list[dict[str, Any]]:
+    if power.size == 0:
+        return []
+    # Baseline is the p10 of each local day, computed for all days in one sort.
+    day = (ts + _local_offset()) // 86400
+    order = np.lexsort((power, day))
+    sorted_day = day[order]
+    sorted_power = power[order]
+    starts = np.flatnonzero(np.r_[True, sorted_day[1:] != sorted_day[:-1]])
+    counts = np.diff(np.r_[starts, sorted_day.size])
+    baseline = sorted_power[starts + ((counts - 1) * 0.1).astype(np.int64)]
+    keep = counts >= SHIFT_MIN_DAY_BINS
+    baseline = baseline[keep]
+    day_ts = sorted_day[starts][keep] * 86400 - _local_offset()
+    if baseline.size < 2:
+        return []
+    prev, cur = baseline[:-1], baseline[1:]
+    change = np.abs(cur - prev)
+    shifted = np.flatnonzero((change > SHIFT_MIN_DELTA_W) & (change > SHIFT_MIN_RATIO * np.maximum(prev, 1.0)))
+    return [
+        {
+            "kind": "baseline_shift",
+            "ts": int(day_ts[k + 1]),
+            "from_w": float(prev[k]),
+            "to_w": float(cur[k]),
+        }
+        for k in shifted
+    ]
+
+
+def detect_socket_outliers(sockets: list[tuple[str, int, str, float]]) -> list[dict[str, Any]]:
+    if len(sockets) < 3:
+        return []
+    power = np.array([s[3] for s in sockets], dtype=np.float64)
+    median = np.median(power)
+    mad = np.median(np.abs(power - median)) * 1.4826
+    z = (power - median) / max(float(mad), 1.0)
+    hits = np.flatnonzero((z > SOCKET_OUTLIER_Z) & (power > SOCKET_OUTLIER_MIN_W))
+    return [
+        {
+            "kind": "socket_outlier",
+            "device_id": sockets[k][0],
+            "socket": sockets[k][1],
+            "label": sockets[k][2],
+            "power_w": float(power[k]),
+            "median_w": float(median),
+        }
+        for k in hits
+    ]
+
+
+def analyze_device(device_id: str, ts: Any, power: Any, bin_seconds: int = BIN_SECONDS) -> list[dict[str, Any]]:
+    bin_ts, values = resample(ts, power, bin_seconds)
+    events: list[dict[str, Any]] = []
+    for event in detect_spikes(bin_ts, values)[:MAX_EVENTS_PER_KIND]:
+        event["device_id"] = device_id
+        event["message"] = (
+            f"{device_id}: spike to {event['power_w']:.1f}W "
+            f"(+{event['delta_w']:.1f}W over the last hour) at {_fmt_ts(event['ts'])}."
+        )
+        events.append(event)
+    drain = detect_standby_drain(bin_ts, values, bin_seconds)
+    if drain is not None:
+        drain["device_id"] = device_id
+        drain["message"] = (
+            f"{device_id}: standby drain of about {drain['avg_power_w']:.1f}W on {drain['nights']} nights "
+            f"({drain['energy_kwh']:.2f} kWh)."
+        )
+        events.append(drain)
+    for event in detect_baseline_shifts(bin_ts, values)[-MAX_EVENTS_PER_KIND:]:
+        event["device_id"] = device_id
+        event["message"] = (
+            f"{device_id}: baseline shifted from {event['from_w']:.1f}W to {event['to_w']:.1f}W "
+            f"on {_fmt_ts(event['ts'])[:5]}."
+        )
+        events.append(event)
+    return events
+
+
+def load_device_series(
+    session: Session,
+    device_id: str,
+    start_ts: int,
+    bin_seconds: int = BIN_SECONDS,
+) -> tuple[np.ndarray, np.ndarray]:
+    # The store collapses raw samples to one mean per bin, so a month of 1 Hz
+    # telemetry arrives as ~43k values per device instead of ~2.6M.
+    return telemetry_store.binned_means(session, device_id, start_ts, bin_seconds)
+
+
+def load_room_sockets(session: Session, device_ids: list[str]) -> list[tuple[str, int, str, float]]:
+    rows = session.execute(
+        select(StripSocket.device_id, StripSocket.socket_id, StripSocket.device, StripSocket.power_w).where(
+            and_(StripSocket.device_id.in_(device_ids), StripSocket.on.is_(True))
+        )
+    ).all()
+    return [(device_id, sid, label, float(power)) for device_id, sid, label, power in rows]
+
+
+def analyze_room(session: Session, device_ids: list[str], start_ts: int) -> list[dict[str, Any]]:
+    events: list[dict[str, Any]] = []
+    for device_id in device_ids:
+        ts, power = load_device_series(session, device_id, start_ts)
+        events.extend(analyze_device(device_id, ts, power))
+    for event in detect_socket_outliers(load_room_sockets(session, device_ids)):
+        event["message"] = (
+            f"{event['device_id']} socket {event['socket']} ({event['label'] or 'unknown'}) draws "
+            f"{event['power_w']:.1f}W, far above the room median of {event['median_w']:.1f}W."
+        )
+        events.append(event)
+    return events
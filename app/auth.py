@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import hmac
+import multiprocessing
+import secrets
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable
+
+from sqlalchemy import delete
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .models import AuthToken
+
+PBKDF2_ITERATIONS = 160_000
+MAX_THROTTLE_KEYS = 10_000
+TOKEN_DIGEST_BYTES = 16
+
+
+def _hash_secret(secret: str, salt: str, iterations: int = PBKDF2_ITERATIONS) -> str:
+    digest = hashlib.pbkdf2_hmac("sha256", secret.encode("utf-8"), salt.encode("utf-8"), iterations)
+    return digest.hex()
+
+
+def hash_password(password: str) -> str:
+    iterations = PBKDF2_ITERATIONS
+    salt = secrets.token_hex(16)
+    digest = _hash_secret(password, salt, iterations)
+    return f"pbkdf2_sha256${iterations}${salt}${digest}"
+
+
+def verify_password(password: str, encoded: str) -> bool:
+    try:
+        algo, iterations_str, salt, digest = encoded.split("$", 3)
+        if algo != "pbkdf2_sha256":
+            return False
+        calc = _hash_secret(password, salt, int(iterations_str))
+        return hmac.compare_digest(calc, digest)
+    except Exception:
+        return False
+
+
+class AuthBusy(Exception):
+    pass
+
+
+# PBKDF2 runs in a small process pool so a burst of logins burns those cores and
+# not the request threadpool or the event loop. Calls beyond AUTH_MAX_PENDING are
+# refused instead of queued.
+class PasswordHasher:
+    def __init__(self) -> None:
+        self._pool: ProcessPoolExecutor | None = None
+        self._pending = 0
+
+    async def verify(self, password: str, encoded: str) -> bool:
+        return await self._run(verify_password, password, encoded)
+
+    async def hash(self, password: str) -> str:
+        return await self._run(hash_password, password)
+
+    async def _run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        if self._pending >= settings.auth_max_pending:
+            raise AuthBusy()
+        if self._pool is None:
+            # forkserver: forking this process would copy locks held by the MQTT,
+            # threadpool and background threads into the child.
+            self._pool = ProcessPoolExecutor(
+                max_workers=settings.auth_hash_workers, mp_context=multiprocessing.get_context("forkserver")
+            )
+        self._pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._pool, fn, *args)
+        finally:
+            self._pending -= 1
+
+    def stop(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+# Failed attempts per account and per client IP in a fixed window. Keys are
+# bounded like the topic caches: the oldest window is dropped when full.
+class LoginThrottle:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._failures: dict[str, tuple[int, int]] = {}
+
+    def retry_after(self, account: str, ip: str) -> int:
+        now = int(time.time())
+        wait = 0
+        for key, limit in self._keys(account, ip):
+            with self._lock:
+                entry = self._failures.get(key)
+            if entry is None:
+                continue
+            start, count = entry
+            end = start + settings.auth_failure_window_seconds
+            if count >= limit and now < end:
+                wait = max(wait, end - now)
+        return wait
+
+    def record_failure(self, account: str, ip: str) -> None:
+        now = int(time.time())
+        with self._lock:
+            for key, _limit in self._keys(account, ip):
+                start, count = self._failures.pop(key, (now, 0))
+                if now - start >= settings.auth_failure_window_seconds:
+                    start, count = now, 0
+                if len(self._failures) >= MAX_THROTTLE_KEYS:
+                    del self._failures[next(iter(self._failures))]
+                self._failures[key] = (start, count + 1)
+
+    def reset(self, account: str) -> None:
+        with self._lock:
+            self._failures.pop(f"a:{account.strip().lower()}", None)
+
+    def _keys(self, account: str, ip: str) -> list[tuple[str, int]]:
+        keys = [(f"a:{account.strip().lower()}", settings.auth_max_failures_per_account)]
+        if ip:
+            keys.append((f"i:{ip}", settings.auth_max_failures_per_ip))
+        return keys
+
+
+# Tokens are stored as 16-byte digests, never in clear. Validation is a dict hit;
+# a miss (token issued by another worker or before a restart) reads auth_tokens once.
+class TokenStore:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._tokens: dict[bytes, tuple[str, int]] = {}
+
+    def issue(self, session: Session, username: str) -> str:
+        token = secrets.token_urlsafe(24)
+        now = int(time.time())
+        expires_at = now + settings.auth_token_ttl_seconds
+        digest = self._digest(token)
+        session.add(AuthToken(token_hash=digest, username=username, expires_at=expires_at))
+        session.execute(delete(AuthToken).where(AuthToken.expires_at < now))
+        self._remember(digest, (username, expires_at))
+        return token
+
+    def validate(self, session: Session, token: str) -> str | None:
+        if not token:
+            return None
+        digest = self._digest(token)
+        entry = self._tokens.get(digest)
+        if entry is None:
+            row = session.get(AuthToken, digest)
+            if row is None:
+                return None
+            entry = (row.username, row.expires_at)
+            self._remember(digest, entry)
+        if entry[1] < int(time.time()):
+            self._forget(digest)
+            return None
+        return entry[0]
+
+    # Other workers keep a revoked token cached until it expires or is evicted.
+    def revoke(self, session: Session, token: str) -> None:
+        digest = self._digest(token)
+        self._forget(digest)
+        session.execute(delete(AuthToken).where(AuthToken.token_hash == digest))
+
+    def _remember(self, digest: bytes, entry: tuple[str, int]) -> None:
+        with self._lock:
+            if digest not in self._tokens and len(self._tokens) >= settings.auth_token_cache_size:
+                del self._tokens[next(iter(self._tokens))]
+            self._tokens[digest] = entry
+
+    def _forget(self, digest: bytes) -> None:
+        with self._lock:
+            self._tokens.pop(digest, None)
+
+    @staticmethod
+    def _digest(token: str) -> bytes:
+        return hashlib.blake2b(token.encode("utf-8"), digest_size=TOKEN_DIGEST_BYTES).digest()
+
+
+password_hasher = PasswordHasher()
+login_throttle = LoginThrottle()
+token_store = TokenStore()
@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import logging
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+from sqlalchemy import inspect
+
+from .db import Base, engine, get_session
+from .models import AppMeta
+from .services import ensure_default_admin, ensure_seed_data, migrate_legacy_sockets
+
+logger = logging.getLogger("bootstrap")
+
+# Bump whenever tables, indexes or seed data change so existing databases re-run
+# bootstrap once; otherwise startup skips it. create_all only adds missing tables,
+# so indexes on existing tables are created by ensure_indexes; column changes to
+# existing tables need their own migration step.
+BOOTSTRAP_VERSION = "3"
+BOOTSTRAP_KEY = "bootstrap_version"
+
+
+class StartupReport:
+    def __init__(self) -> None:
+        self._phases: dict[str, float] = {}
+        self.bootstrap = "pending"
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._phases[name] = round((time.perf_counter() - started) * 1000.0, 2)
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "bootstrap": self.bootstrap,
+            "total_ms": round(sum(self._phases.values()), 2),
+            "phases_ms": dict(self._phases),
+        }
+
+    def log(self) -> None:
+        info = self.as_dict()
+        phases = " ".join(f"{name}={ms}ms" for name, ms in info["phases_ms"].items())
+        logger.info("startup finished in %sms (bootstrap=%s) %s", info["total_ms"], self.bootstrap, phases)
+
+
+startup_report = StartupReport()
+
+
+def stored_bootstrap_version() -> str | None:
+    if not inspect(engine).has_table(AppMeta.__tablename__):
+        return None
+    with get_session() as session:
+        row = session.get(AppMeta, BOOTSTRAP_KEY)
+        return row.value if row is not None else None
+
+
+def run_bootstrap() -> bool:
+    # Returns False when the database is already at BOOTSTRAP_VERSION and nothing ran.
+    if stored_bootstrap_version() == BOOTSTRAP_VERSION:
+        return False
+    Base.metadata.create_all(bind=engine)
+    ensure_indexes()
+    with get_session() as session:
+        ensure_seed_data(session)
+        migrate_legacy_sockets(session)
+        ensure_default_admin(session)
+        session.merge(AppMeta(key=BOOTSTRAP_KEY, value=BOOTSTRAP_VERSION))
+    return True
+
+
+def ensure_indexes() -> None:
+    # Indexes added to a table that already existed, e.g. ix_telemetry_device_ts
+    # on databases created before the SQL-aggregate reports.
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+
+def reconcile_admin() -> None:
+    # Applies ADMIN_* changes on an already bootstrapped database. The password
+    # check costs a full PBKDF2 run, so this runs after the app starts serving.
+    started = time.perf_counter()
+    with get_session() as session:
+        ensure_default_admin(session)
+    logger.info("admin account reconciled in %.0fms", (time.perf_counter() - started) * 1000.0)
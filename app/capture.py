@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import logging
+import os
+import struct
+import threading
+import time
+from typing import BinaryIO, Iterator
+
+from .config import settings
+
+logger = logging.getLogger("mqtt-capture")
+
+MAGIC = b"MQTTCAP1"
+# receive time (unix seconds), topic length, payload length; topic and payload bytes follow.
+RECORD = struct.Struct("<dHI")
+FLUSH_SECONDS = 1.0
+WRITE_BUFFER_BYTES = 1 << 20
+
+
+# Appends every message the bridge receives to MQTT_CAPTURE_PATH, before routing,
+# so tools/replay_mqtt.py can feed the exact byte stream back. Capture stops once
+# the file reaches MQTT_CAPTURE_MAX_MB. Only the ingest worker opens the file;
+# records are buffered, so concurrent writers would interleave them.
+class MQTTCapture:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._file: BinaryIO | None = None
+        self._size = 0
+        self._max_bytes = int(settings.mqtt_capture_max_mb * 1024 * 1024)
+        self._flushed_at = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self._file is not None
+
+    def start(self, path: str = settings.mqtt_capture_path) -> None:
+        if not path or self._file is not None:
+            return
+        try:
+            # Only the process that creates the file writes the header, unbuffered.
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            pass
+        else:
+            with os.fdopen(fd, "wb", buffering=0) as header:
+                header.write(MAGIC)
+        f = open(path, "ab", buffering=WRITE_BUFFER_BYTES)
+        self._size = f.tell()
+        self._file = f
+        self._flushed_at = time.monotonic()
+        logger.info("capturing MQTT traffic to %s", path)
+
+    def stop(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def record(self, topic: str, payload: bytes) -> None:
+        topic_bytes = topic.encode("utf-8")
+        data = RECORD.pack(time.time(), len(topic_bytes), len(payload)) + topic_bytes + payload
+        with self._lock:
+            if self._file is None:
+                return
+            if self._size + len(data) > self._max_bytes:
+                logger.warning("capture file reached %s bytes, capture stopped", self._size)
+                self._file.close()
+                self._file = None
+                return
+            self._file.write(data)
+            self._size += len(data)
+            now = time.monotonic()
+            if now - self._flushed_at >= FLUSH_SECONDS:
+                self._file.flush()
+                self._flushed_at = now
+
+
+def read_capture(path: str) -> Iterator[tuple[float, str, bytes]]:
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not an MQTT capture file")
+        while True:
+            head = f.read(RECORD.size)
+            if len(head) < RECORD.size:
+                return
+            ts, topic_len, payload_len = RECORD.unpack(head)
+            topic = f.read(topic_len)
+            payload = f.read(payload_len)
+            if len(payload) < payload_len:
+                # Truncated tail left by a process that died mid-write.
+                return
+            yield ts, topic.decode("utf-8", errors="replace"), payload
+
+
+mqtt_capture = MQTTCapture()
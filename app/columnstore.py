@@ -0,0 +1,265 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import shutil
+import threading
+import time
+from typing import Any
+
+import numpy as np
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .tsstore import TelemetryStore
+
+logger = logging.getLogger("columnstore")
+
+PARTITION_SECONDS = 86400
+# File suffix and dtype per column. ts is written last, so its length bounds the
+# rows every other column already holds.
+COLUMNS = (("ca", "<f4"), ("vv", "<f4"), ("pw", "<f8"), ("ts", "<i8"))
+TS_ITEMSIZE = 8
+# session.info key for samples waiting on the caller's commit.
+STAGED_KEY = "columnar_telemetry"
+
+
+# Append-only column files per device and UTC day:
+#   <root>/<hex device id>/<day>.{ts,pw,vv,ca}
+# Scans read only the ts and pw columns of the days in range and aggregate them
+# with numpy. Samples are buffered in memory and appended every
+# TELEMETRY_FLUSH_SECONDS by the ingest worker's flush task; reads in that worker
+# include the buffer, other workers see samples once flushed.
+#
+# Writes are not part of the SQL transaction. append() stages samples on the
+# session and buffers them only after it commits, so a rolled-back ingest adds
+# nothing; but a commit is not durable here until the next flush, and extend()
+# and delete_devices() act on disk immediately whatever the session does.
+class ColumnarTelemetryStore(TelemetryStore):
+    name = "columnar"
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+        self._task: asyncio.Task[None] | None = None
+        self._lock = threading.Lock()
+        self._pending: dict[str, list[tuple[int, float, float, float]]] = {}
+        # Bumped whenever buffered rows move to disk, so a reader that copied the
+        # buffer before the move can tell it may have missed them.
+        self._generation = 0
+        self._last_flush = time.monotonic()
+        self._checked: set[str] = set()
+
+    def append(self, session: Session, device_id: str, ts: int, power_w: float, voltage_v: float, current_a: float) -> None:
+        staged = session.info.get(STAGED_KEY)
+        if staged is None:
+            staged = session.info[STAGED_KEY] = []
+
+            def committed(session: Session) -> None:
+                self._buffer(session.info.pop(STAGED_KEY, []))
+
+            def rolled_back(session: Session) -> None:
+                session.info.pop(STAGED_KEY, None)
+
+            event.listen(session, "after_commit", committed, once=True)
+            event.listen(session, "after_rollback", rolled_back, once=True)
+        staged.append((device_id, (ts, power_w, voltage_v, current_a)))
+
+    def _buffer(self, staged: list[tuple[str, tuple[int, float, float, float]]]) -> None:
+        with self._lock:
+            for device_id, row in staged:
+                self._pending.setdefault(device_id, []).append(row)
+            due = time.monotonic() - self._last_flush >= settings.telemetry_flush_seconds
+        if due:
+            self.flush()
+
+    def extend(self, session: Session, rows: list[dict[str, Any]]) -> None:
+        grouped: dict[str, list[tuple[int, float, float, float]]] = {}
+        for r in rows:
+            grouped.setdefault(r["device_id"], []).append(
+                (r["ts"], r.get("power_w", 0.0), r.get("voltage_v", 220.0), r.get("current_a", 0.0))
+            )
+        with self._lock:
+            for device_id, device_rows in grouped.items():
+                self._write(device_id, device_rows)
+            self._generation += 1
+
+    def delete_devices(self, session: Session, device_ids: list[str]) -> None:
+        with self._lock:
+            for device_id in device_ids:
+                self._pending.pop(device_id, None)
+                path = self._device_dir(device_id)
+                self._checked = {p for p in self._checked if not p.startswith(path + os.sep)}
+                shutil.rmtree(path, ignore_errors=True)
+            self._generation += 1
+
+    def flush(self, session: Session | None = None) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+            for device_id, rows in pending.items():
+                self._write(device_id, rows)
+            if pending:
+                self._generation += 1
+
+    def start(self, loop: asyncio.AbstractEventLoop) -> None:
+        if self._task is None:
+            self._task = loop.create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self) -> None:
+        # Flushes the tail of idle devices, which no later append would push out.
+        while True:
+            await asyncio.sleep(settings.telemetry_flush_seconds)
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception:
+                logger.exception("telemetry flush failed")
+
+    def points(self, session: Session, device_id: str, start_ts: int, end_ts: int) -> list[tuple[int, float]]:
+        ts, power = self._load(device_id, start_ts, end_ts)
+        return list(zip(ts.tolist(), power.tolist()))
+
+    def last_before(self, session: Session, device_id: str, ts: int) -> float | None:
+        days = [d for d in self._days(device_id) if d <= ts // PARTITION_SECONDS]
+        with self._lock:
+            pending = [(t, p) for t, p, _v, _c in self._pending.get(device_id, ()) if t < ts]
+        best = max(pending) if pending else None
+        for day in sorted(days, reverse=True):
+            if best is not None and best[0] >= (day + 1) * PARTITION_SECONDS:
+                break
+            day_ts, day_power = self._read_day(device_id, day)
+            before = np.flatnonzero(day_ts < ts)
+            if before.size:
+                i = before[np.argmax(day_ts[before])]
+                if best is None or int(day_ts[i]) > best[0]:
+                    best = (int(day_ts[i]), float(day_power[i]))
+                break
+        return best[1] if best is not None else None
+
+    def hourly_stats(self, session: Session, device_ids: list[str], start_ts: int) -> list[tuple[str, int, float, float]]:
+        out: list[tuple[str, int, float, float]] = []
+        for device_id in device_ids:
+            ts, power = self._load(device_id, start_ts, None)
+            if ts.size == 0:
+                continue
+            hours, inverse = np.unique(ts // 3600, return_inverse=True)
+            means = np.bincount(inverse, weights=power) / np.bincount(inverse)
+            peaks = np.full(hours.size, -np.inf)
+            np.maximum.at(peaks, inverse, power)
+            out.extend(zip([device_id] * hours.size, hours.tolist(), means.tolist(), peaks.tolist()))
+        return out
+
+    def binned_means(self, session: Session, device_id: str, start_ts: int, bin_seconds: int) -> tuple[np.ndarray, np.ndarray]:
+        ts, power = self._load(device_id, start_ts, None)
+        if ts.size == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        bins, inverse = np.unique(ts // bin_seconds, return_inverse=True)
+        return bins * bin_seconds, np.bincount(inverse, weights=power) / np.bincount(inverse)
+
+    def count(self, session: Session) -> int:
+        total = 0
+        if os.path.isdir(self.root):
+            for device_dir in os.scandir(self.root):
+                if device_dir.is_dir():
+                    for entry in os.scandir(device_dir.path):
+                        if entry.name.endswith(".ts"):
+                            total += entry.stat().st_size // TS_ITEMSIZE
+        with self._lock:
+            return total + sum(len(rows) for rows in self._pending.values())
+
+    def _device_dir(self, device_id: str) -> str:
+        # Device ids may contain spaces and slashes.
+        return os.path.join(self.root, device_id.encode("utf-8").hex())
+
+    def _days(self, device_id: str) -> list[int]:
+        try:
+            names = os.listdir(self._device_dir(device_id))
+        except FileNotFoundError:
+            return []
+        return [int(name[:-3]) for name in names if name.endswith(".ts")]
+
+    def _read_day(self, device_id: str, day: int) -> tuple[np.ndarray, np.ndarray]:
+        base = os.path.join(self._device_dir(device_id), str(day))
+        try:
+            rows = os.path.getsize(base + ".ts") // TS_ITEMSIZE
+            ts = np.fromfile(base + ".ts", dtype="<i8", count=rows)
+            power = np.fromfile(base + ".pw", dtype="<f8", count=ts.size)
+        except FileNotFoundError:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        # .pw is appended before .ts, so it is never shorter unless a write was torn.
+        n = min(ts.size, power.size)
+        return ts[:n], power[:n]
+
+    def _load(self, device_id: str, start_ts: int, end_ts: int | None) -> tuple[np.ndarray, np.ndarray]:
+        first = start_ts // PARTITION_SECONDS
+        last = end_ts // PARTITION_SECONDS if end_ts is not None else None
+        while True:
+            with self._lock:
+                generation = self._generation
+                pending = list(self._pending.get(device_id, ()))
+            days = sorted(d for d in self._days(device_id) if d >= first and (last is None or d <= last))
+            parts = [self._read_day(device_id, day) for day in days]
+            with self._lock:
+                if generation == self._generation:
+                    break
+        if pending:
+            parts.append(
+                (
+                    np.fromiter((r[0] for r in pending), dtype=np.int64, count=len(pending)),
+                    np.fromiter((r[1] for r in pending), dtype=np.float64, count=len(pending)),
+                )
+            )
+        if not parts:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        ts = np.concatenate([p[0] for p in parts])
+        power = np.concatenate([p[1] for p in parts])
+        keep = ts >= start_ts
+        if end_ts is not None:
+            keep &= ts <= end_ts
+        ts, power = ts[keep], power[keep]
+        if ts.size > 1 and not (ts[1:] >= ts[:-1]).all():
+            order = np.argsort(ts, kind="stable")
+            ts, power = ts[order], power[order]
+        return ts, power
+
+    def _write(self, device_id: str, rows: list[tuple[int, float, float, float]]) -> None:
+        # Caller holds self._lock.
+        directory = self._device_dir(device_id)
+        os.makedirs(directory, exist_ok=True)
+        ts = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+        days = ts // PARTITION_SECONDS
+        columns = {
+            "ca": np.fromiter((r[3] for r in rows), dtype="<f4", count=len(rows)),
+            "vv": np.fromiter((r[2] for r in rows), dtype="<f4", count=len(rows)),
+            "pw": np.fromiter((r[1] for r in rows), dtype="<f8", count=len(rows)),
+            "ts": ts.astype("<i8"),
+        }
+        for day in np.unique(days).tolist():
+            mask = days == day
+            base = os.path.join(directory, str(day))
+            self._repair(base)
+            for suffix, _dtype in COLUMNS:
+                with open(f"{base}.{suffix}", "ab") as f:
+                    f.write(columns[suffix][mask].tobytes())
+
+    def _repair(self, base: str) -> None:
+        # A crash between column writes leaves the other columns longer than ts;
+        # cut them back once per partition before appending again.
+        if base in self._checked:
+            return
+        self._checked.add(base)
+        try:
+            rows = os.path.getsize(base + ".ts") // TS_ITEMSIZE
+        except FileNotFoundError:
+            rows = 0
+        for suffix, dtype in COLUMNS:
+            path = f"{base}.{suffix}"
+            size = rows * np.dtype(dtype).itemsize
+            if os.path.exists(path) and os.path.getsize(path) != size:
+                os.truncate(path, size)
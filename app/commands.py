@@ -0,0 +1,63 @@
+from __future__ import annotations
+
+import time
+
+from .db import get_session
+from .fanout import event_fanout
+from .metrics import track_cmd
+from .models import CommandRecord
+from .mqtt_bridge import mqtt_bridge
+from .registry import device_registry
+from .schemas import CmdRequest
+from .services import create_cmd_record, has_pending_conflict, update_cmd_state
+
+
+class CmdRejected(Exception):
+    def __init__(self, status: int, code: str, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+        self.code = code
+        self.message = message
+
+
+# Shared by POST /api/strips/{id}/cmd and the command scheduler: record the
+# command, then publish it. Returns the record and whether MQTT accepted it; an
+# unpublished command is already marked failed.
+def submit_cmd(device_id: str, req: CmdRequest, source: str) -> tuple[CommandRecord, bool]:
+    with get_session() as session:
+        if not device_registry.exists(session, device_id):
+            raise CmdRejected(404, "NOT_FOUND", "device not found")
+        if has_pending_conflict(session, device_id, req.socket):
+            raise CmdRejected(409, "CMD_CONFLICT", "pending command exists for target")
+        cmd = create_cmd_record(session, device_id, req)
+    track_cmd(cmd.cmd_id)
+
+    cmd_payload = {
+        "cmdId": cmd.cmd_id,
+        "ts": int(time.time()),
+        "type": req.action.upper(),
+        "socketId": req.socket,
+        "payload": req.payload,
+        "mode": req.mode,
+        "duration": req.duration,
+        "source": source,
+    }
+    published = mqtt_bridge.publish_cmd(device_id, cmd_payload)
+    if not published:
+        with get_session() as session:
+            update_cmd_state(session, cmd.cmd_id, "failed", message="mqtt unavailable")
+    return cmd, published
+
+
+async def announce_unpublished(cmd_id: str) -> None:
+    now = int(time.time())
+    await event_fanout.publish(
+        {
+            "type": "CMD_ACK",
+            "cmdId": cmd_id,
+            "state": "failed",
+            "ts": now,
+            "updatedAt": now,
+            "message": "mqtt unavailable",
+        }
+    )
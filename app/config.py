@@ -25,11 +25,74 @@ class Settings:
     mqtt_username: str = os.getenv("MQTT_USERNAME", "")
     mqtt_password: str = os.getenv("MQTT_PASSWORD", "")
     mqtt_topic_prefix: str = os.getenv("MQTT_TOPIC_PREFIX", "dorm").strip("/") or "dorm"
+    mqtt_client_id: str = os.getenv("MQTT_CLIENT_ID", "dorm-power-backend").strip() or "dorm-power-backend"
+    # Horizontal ingest: replicas join a $share group, or split devices by hash.
+    mqtt_shared_group: str = os.getenv("MQTT_SHARED_GROUP", "").strip().strip("/")
+    mqtt_instance_id: str = os.getenv("MQTT_INSTANCE_ID", "").strip()
+    mqtt_partition_count: int = max(int(os.getenv("MQTT_PARTITION_COUNT", "1")), 1)
+    mqtt_partition_index: int = int(os.getenv("MQTT_PARTITION_INDEX", "0"))
+    # Parsed topic -> route entries kept by the MQTT topic router.
+    route_cache_size: int = int(os.getenv("ROUTE_CACHE_SIZE", "65536"))
+    # Raw MQTT capture for tools/replay_mqtt.py; empty disables it.
+    mqtt_capture_path: str = os.getenv("MQTT_CAPTURE_PATH", "").strip()
+    mqtt_capture_max_mb: float = float(os.getenv("MQTT_CAPTURE_MAX_MB", "1024"))
     admin_username: str = os.getenv("ADMIN_USERNAME", "admin")
     admin_email: str = os.getenv("ADMIN_EMAIL", "admin@dorm.local")
     admin_password: str = os.getenv("ADMIN_PASSWORD", "admin123")
+    auth_hash_workers: int = max(int(os.getenv("AUTH_HASH_WORKERS", "2")), 1)
+    auth_max_pending: int = max(int(os.getenv("AUTH_MAX_PENDING", "8")), 1)
+    auth_max_failures_per_account: int = int(os.getenv("AUTH_MAX_FAILURES_PER_ACCOUNT", "5"))
+    auth_max_failures_per_ip: int = int(os.getenv("AUTH_MAX_FAILURES_PER_IP", "20"))
+    auth_failure_window_seconds: int = int(os.getenv("AUTH_FAILURE_WINDOW_SECONDS", "300"))
+    auth_token_ttl_seconds: int = int(os.getenv("AUTH_TOKEN_TTL_SECONDS", str(7 * 86400)))
+    auth_token_cache_size: int = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "10000"))
+    # Per-client token buckets by route class (rate 0 disables a class), opt-in
+    # because clients behind one NAT or proxy share a bucket; the in-flight caps
+    # always apply and shed reads first at API_MAX_INFLIGHT_READS.
+    rate_limit_enabled: bool = _to_bool(os.getenv("RATE_LIMIT_ENABLED"), False)
+    rate_limit_trust_forwarded: bool = _to_bool(os.getenv("RATE_LIMIT_TRUST_FORWARDED"), False)
+    rate_limit_telemetry_per_second: float = float(os.getenv("RATE_LIMIT_TELEMETRY_PER_SECOND", "2"))
+    rate_limit_telemetry_burst: float = float(os.getenv("RATE_LIMIT_TELEMETRY_BURST", "20"))
+    rate_limit_status_per_second: float = float(os.getenv("RATE_LIMIT_STATUS_PER_SECOND", "5"))
+    rate_limit_status_burst: float = float(os.getenv("RATE_LIMIT_STATUS_BURST", "30"))
+    rate_limit_command_per_second: float = float(os.getenv("RATE_LIMIT_COMMAND_PER_SECOND", "2"))
+    rate_limit_command_burst: float = float(os.getenv("RATE_LIMIT_COMMAND_BURST", "10"))
+    rate_limit_login_per_second: float = float(os.getenv("RATE_LIMIT_LOGIN_PER_SECOND", "0.5"))
+    rate_limit_login_burst: float = float(os.getenv("RATE_LIMIT_LOGIN_BURST", "5"))
+    api_max_inflight: int = int(os.getenv("API_MAX_INFLIGHT", "40"))
+    api_max_inflight_reads: int = int(os.getenv("API_MAX_INFLIGHT_READS", "32"))
     cmd_timeout_seconds: int = int(os.getenv("CMD_TIMEOUT_SECONDS", "30"))
     online_timeout_seconds: int = int(os.getenv("ONLINE_TIMEOUT_SECONDS", "60"))
+    registry_flush_seconds: float = float(os.getenv("REGISTRY_FLUSH_SECONDS", "2"))
+    energy_max_gap_seconds: int = int(os.getenv("ENERGY_MAX_GAP_SECONDS", "300"))
+    energy_flush_seconds: float = float(os.getenv("ENERGY_FLUSH_SECONDS", "10"))
+    # Telemetry sample history: "sql" (telemetry table) or "columnar" (numpy
+    # column files under TELEMETRY_STORE_DIR, written every TELEMETRY_FLUSH_SECONDS).
+    telemetry_store: str = os.getenv("TELEMETRY_STORE", "sql").strip().lower() or "sql"
+    telemetry_store_dir: str = os.getenv("TELEMETRY_STORE_DIR", "./tsdata")
+    telemetry_flush_seconds: float = float(os.getenv("TELEMETRY_FLUSH_SECONDS", "1"))
+    # Bucket-aligned 24h/7d/30d series per (mode, device, range), extended in place.
+    telemetry_series_cache_size: int = int(os.getenv("TELEMETRY_SERIES_CACHE_SIZE", "2048"))
+    # Encoded /api/telemetry responses, keyed by device, range, mode and step bucket.
+    telemetry_cache_size: int = int(os.getenv("TELEMETRY_CACHE_SIZE", "1024"))
+    telemetry_cache_ttl_seconds: float = float(os.getenv("TELEMETRY_CACHE_TTL_SECONDS", "5"))
+    # Command scheduler: merge interval for schedules written by other workers, and
+    # how late an occurrence may still fire (e.g. after a restart) before it is skipped.
+    scheduler_sync_seconds: float = float(os.getenv("SCHEDULER_SYNC_SECONDS", "5"))
+    schedule_misfire_grace_seconds: int = int(os.getenv("SCHEDULE_MISFIRE_GRACE_SECONDS", "300"))
+    report_cache_ttl_seconds: int = int(os.getenv("REPORT_CACHE_TTL_SECONDS", "300"))
+    report_cache_max_stale_seconds: int = int(os.getenv("REPORT_CACHE_MAX_STALE_SECONDS", "3600"))
+    # Multi-worker mode: workers share events through unix sockets in this dir.
+    fanout_dir: str = os.getenv("FANOUT_DIR", "").strip()
+    fanout_elect_interval_seconds: float = float(os.getenv("FANOUT_ELECT_INTERVAL_SECONDS", "5"))
+    # Opt-in profiling: Server-Timing headers, slow-query log and stack sampling.
+    server_timing: bool = _to_bool(os.getenv("SERVER_TIMING"), False)
+    slow_query_ms: float = float(os.getenv("SLOW_QUERY_MS", "0"))
+    profile_routes: tuple[str, ...] = tuple(
+        p.strip() for p in os.getenv("PROFILE_ROUTES", "").split(",") if p.strip()
+    )
+    profile_interval_ms: float = max(float(os.getenv("PROFILE_INTERVAL_MS", "5")), 0.5)
+    profile_dir: str = os.getenv("PROFILE_DIR", "./profiles")
 
 
 settings = Settings()
@@ -1,12 +1,20 @@
 from __future__ import annotations
 
+import logging
+import time
 from contextlib import contextmanager
-from typing import Generator
+from typing import Any, Generator
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import Session, declarative_base, sessionmaker
 
 from .config import settings
+from .metrics import db_commit_seconds, db_session_seconds
+from .profiling import record_query
+
+slow_query_logger = logging.getLogger("slow-query")
+
+MAX_LOGGED_PARAMS_CHARS = 500
 
 connect_args = {"check_same_thread": False} if settings.database_url.startswith("sqlite") else {}
 engine = create_engine(settings.database_url, connect_args=connect_args, future=True)
@@ -20,14 +28,45 @@ SessionLocal = sessionmaker(
 Base = declarative_base()
 
 
+def _before_cursor_execute(conn: Any, cursor: Any, statement: str, parameters: Any, context: Any, executemany: bool) -> None:
+    conn.info["query_started"] = time.perf_counter()
+
+
+def _after_cursor_execute(conn: Any, cursor: Any, statement: str, parameters: Any, context: Any, executemany: bool) -> None:
+    elapsed = time.perf_counter() - conn.info.pop("query_started", time.perf_counter())
+    record_query(elapsed)
+    if settings.slow_query_ms and elapsed * 1000.0 >= settings.slow_query_ms:
+        if executemany:
+            params = f"{len(parameters)} sets, first={parameters[0]!r}" if parameters else "[]"
+        else:
+            params = repr(parameters)
+        # DB-API rowcount: rows written, or -1 for a SELECT on drivers that stream (SQLite).
+        slow_query_logger.warning(
+            "%.1fms rows=%s %s params=%s",
+            elapsed * 1000.0,
+            cursor.rowcount,
+            " ".join(statement.split()),
+            params[:MAX_LOGGED_PARAMS_CHARS],
+        )
+
+
+# The hooks cost a few microseconds per statement, so they are only attached when used.
+if settings.server_timing or settings.slow_query_ms > 0:
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
 @contextmanager
 def get_session() -> Generator[Session, None, None]:
+    started = time.perf_counter()
     session = SessionLocal()
     try:
         yield session
-        session.commit()
+        with db_commit_seconds.time():
+            session.commit()
     except Exception:
         session.rollback()
         raise
     finally:
         session.close()
+        db_session_seconds.observe(time.perf_counter() - started)
@@ -0,0 +1,202 @@
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any
+
+from sqlalchemy import and_, event, select
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .models import EnergyCounter, EnergyCursor
+from .registry import device_registry
+
+# Socket id used for the strip-level total reported in telemetry.
+STRIP_TOTAL = 0
+HOUR = 3600
+DAY = 86400
+
+ENERGY_PERIODS = {
+    "24h": ("h", 24),
+    "7d": ("d", 7),
+    "30d": ("d", 30),
+}
+
+
+def local_day_start(ts: int) -> int:
+    offset = time.localtime(ts).tm_gmtoff
+    return (ts + offset) // DAY * DAY - offset
+
+
+def split_trapezoid(t0: int, p0: float, t1: int, p1: float) -> list[tuple[int, float]]:
+    # Trapezoidal Wh between two samples, split at hour boundaries with the power
+    # linearly interpolated at each boundary.
+    out: list[tuple[int, float]] = []
+    slope = (p1 - p0) / (t1 - t0)
+    t = t0
+    while t < t1:
+        end = min((t // HOUR + 1) * HOUR, t1)
+        pa = p0 + slope * (t - t0)
+        pb = p0 + slope * (end - t0)
+        out.append((t // HOUR * HOUR, (pa + pb) / 2.0 * (end - t) / 3600.0))
+        t = end
+    return out
+
+
+# Integrates power into hourly and daily Wh counters as samples arrive. Deltas are
+# kept in memory and written by the ingest session every ENERGY_FLUSH_SECONDS, so a
+# sample costs a dict update instead of several row lookups.
+class EnergyMeter:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._cursors: dict[tuple[str, int], tuple[int, float] | None] = {}
+        self._dirty: set[tuple[str, int]] = set()
+        self._pending: dict[tuple[str, int, str, int], float] = {}
+        self._last_flush = time.monotonic()
+
+    def record(self, session: Session, device_id: str, socket: int, ts: int, power_w: float) -> None:
+        key = (device_id, socket)
+        with self._lock:
+            if key not in self._cursors:
+                row = session.get(EnergyCursor, {"device_id": device_id, "socket": socket})
+                self._cursors[key] = (row.ts, row.power_w) if row is not None else None
+            cursor = self._cursors[key]
+            if cursor is not None and ts < cursor[0]:
+                return
+            self._cursors[key] = (ts, power_w)
+            self._dirty.add(key)
+            if cursor is not None and 0 < ts - cursor[0] <= settings.energy_max_gap_seconds:
+                for hour, wh in split_trapezoid(cursor[0], cursor[1], ts, power_w):
+                    hour_key = (device_id, socket, "h", hour)
+                    day_key = (device_id, socket, "d", local_day_start(hour))
+                    self._pending[hour_key] = self._pending.get(hour_key, 0.0) + wh
+                    self._pending[day_key] = self._pending.get(day_key, 0.0) + wh
+            due = time.monotonic() - self._last_flush >= settings.energy_flush_seconds
+        if due:
+            self.flush(session)
+
+    def flush(self, session: Session) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            dirty, self._dirty = self._dirty, set()
+            cursors = {key: self._cursors.get(key) for key in dirty}
+            self._last_flush = time.monotonic()
+
+        for (device_id, socket, granularity, bucket_ts), wh in pending.items():
+            pk = {"device_id": device_id, "socket": socket, "granularity": granularity, "bucket_ts": bucket_ts}
+            counter = session.get(EnergyCounter, pk)
+            if counter is None:
+                session.add(EnergyCounter(**pk, energy_wh=wh))
+            else:
+                counter.energy_wh += wh
+        for (device_id, socket), cursor in cursors.items():
+            if cursor is None:
+                continue
+            row = session.get(EnergyCursor, {"device_id": device_id, "socket": socket})
+            if row is None:
+                session.add(EnergyCursor(device_id=device_id, socket=socket, ts=cursor[0], power_w=cursor[1]))
+            else:
+                row.ts, row.power_w = cursor
+
+        def requeue(_session: Session) -> None:
+            # The flushed deltas never reached the database; merge them back so
+            # the next flush retries them. Cursors already advanced in memory.
+            with self._lock:
+                for key, wh in pending.items():
+                    self._pending[key] = self._pending.get(key, 0.0) + wh
+                self._dirty.update(dirty)
+
+        event.listen(session, "after_rollback", requeue, once=True)
+
+    def pending(self, device_ids: set[str], granularity: str, since: int) -> dict[tuple[str, int, int], float]:
+        with self._lock:
+            return {
+                (device_id, socket, bucket_ts): wh
+                for (device_id, socket, g, bucket_ts), wh in self._pending.items()
+                if g == granularity and bucket_ts >= since and device_id in device_ids
+            }
+
+
+energy_meter = EnergyMeter()
+
+
+def _period_window(period: str) -> tuple[str, int]:
+    spec = ENERGY_PERIODS.get(period)
+    if spec is None:
+        raise ValueError("period is invalid")
+    granularity, count = spec
+    now = int(time.time())
+    if granularity == "h":
+        return granularity, now // HOUR * HOUR - (count - 1) * HOUR
+    return granularity, local_day_start(now) - (count - 1) * DAY
+
+
+def _energy_rows(session: Session, device_ids: list[str], period: str) -> dict[tuple[str, int, int], float]:
+    granularity, since = _period_window(period)
+    rows = session.execute(
+        select(EnergyCounter.device_id, EnergyCounter.socket, EnergyCounter.bucket_ts, EnergyCounter.energy_wh).where(
+            and_(
+                EnergyCounter.device_id.in_(device_ids),
+                EnergyCounter.granularity == granularity,
+                EnergyCounter.bucket_ts >= since,
+            )
+        )
+    ).all()
+    totals: dict[tuple[str, int, int], float] = {}
+    for device_id, socket, bucket_ts, wh in rows:
+        totals[(device_id, socket, bucket_ts)] = float(wh)
+    for key, wh in energy_meter.pending(set(device_ids), granularity, since).items():
+        totals[key] = totals.get(key, 0.0) + wh
+    return totals
+
+
+def _kwh(wh: float) -> float:
+    return round(wh / 1000.0, 4)
+
+
+def _series(totals: dict[tuple[str, int, int], float]) -> list[dict[str, Any]]:
+    by_bucket: dict[int, float] = {}
+    for (_device_id, socket, bucket_ts), wh in totals.items():
+        if socket == STRIP_TOTAL:
+            by_bucket[bucket_ts] = by_bucket.get(bucket_ts, 0.0) + wh
+    return [{"ts": ts, "energy_kwh": _kwh(by_bucket[ts])} for ts in sorted(by_bucket)]
+
+
+def device_energy(session: Session, device_id: str, period: str) -> dict[str, Any]:
+    totals = _energy_rows(session, [device_id], period)
+    sockets: dict[int, float] = {}
+    for (_device_id, socket, _bucket_ts), wh in totals.items():
+        sockets[socket] = sockets.get(socket, 0.0) + wh
+    return {
+        "device_id": device_id,
+        "period": period,
+        "energy_kwh": _kwh(sockets.get(STRIP_TOTAL, 0.0)),
+        "sockets": [{"socket": s, "energy_kwh": _kwh(sockets[s])} for s in sorted(sockets) if s != STRIP_TOTAL],
+        "series": _series(totals),
+    }
+
+
+def room_energy(session: Session, room_id: str, device_ids: list[str], period: str) -> dict[str, Any]:
+    totals = _energy_rows(session, device_ids, period)
+    devices: dict[str, float] = {device_id: 0.0 for device_id in device_ids}
+    for (device_id, socket, _bucket_ts), wh in totals.items():
+        if socket == STRIP_TOTAL:
+            devices[device_id] += wh
+    return {
+        "room_id": room_id,
+        "period": period,
+        "energy_kwh": _kwh(sum(devices.values())),
+        "devices": [{"device_id": d, "energy_kwh": _kwh(wh)} for d, wh in sorted(devices.items())],
+        "series": _series(totals),
+    }
+
+
+def room_energy_ranking(session: Session, period: str) -> list[dict[str, Any]]:
+    rooms = device_registry.rooms()
+    totals = _energy_rows(session, list(rooms), period)
+    by_room: dict[str, float] = {room: 0.0 for room in rooms.values()}
+    for (device_id, socket, _bucket_ts), wh in totals.items():
+        if socket == STRIP_TOTAL:
+            by_room[rooms[device_id]] += wh
+    ranked = sorted(by_room.items(), key=lambda x: x[1], reverse=True)
+    return [{"room_id": room, "energy_kwh": _kwh(wh)} for room, wh in ranked]
@@ -0,0 +1,190 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import socket
+import time
+from typing import Any, Callable
+
+import msgspec
+
+from .config import settings
+from .metrics import ws_broadcast_seconds
+from .ws import ws_manager
+
+logger = logging.getLogger("fanout")
+
+SOCKET_SUFFIX = ".sock"
+LOCK_NAME = "ingest.lock"
+PEER_REFRESH_SECONDS = 2.0
+MAX_DATAGRAM_BYTES = 64 * 1024
+
+
+class _EventHead(msgspec.Struct):
+    type: str = ""
+    deviceId: str = ""
+    payload: msgspec.Raw = msgspec.Raw()
+
+
+_head_decoder = msgspec.json.Decoder(_EventHead)
+
+
+# Each worker binds a unix datagram socket in FANOUT_DIR and events are sent to
+# every socket found there. An flock on ingest.lock elects the single worker that
+# subscribes to MQTT; the others keep retrying so one takes over if the owner exits.
+class EventFanout:
+    def __init__(self) -> None:
+        self._dir = settings.fanout_dir
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._sock: socket.socket | None = None
+        self._path = ""
+        self._peers: list[str] = []
+        self._peers_at = 0.0
+        self._lock_fd: int | None = None
+        self._elect_task: asyncio.Task[None] | None = None
+        self._on_ingest_acquired: Callable[[], None] | None = None
+        self._on_peer_event: Callable[[str, str, bytes], None] | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self._dir)
+
+    @property
+    def is_ingest_owner(self) -> bool:
+        return not self.enabled or self._lock_fd is not None
+
+    def start(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        on_ingest_acquired: Callable[[], None] | None = None,
+        on_peer_event: Callable[[str, str, bytes], None] | None = None,
+    ) -> None:
+        if not self.enabled:
+            return
+        self._loop = loop
+        self._on_ingest_acquired = on_ingest_acquired
+        self._on_peer_event = on_peer_event
+        os.makedirs(self._dir, exist_ok=True)
+        self._path = os.path.join(self._dir, f"worker-{os.getpid()}{SOCKET_SUFFIX}")
+        if os.path.exists(self._path):
+            os.unlink(self._path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.bind(self._path)
+        sock.setblocking(False)
+        self._sock = sock
+        loop.add_reader(sock.fileno(), self._on_readable)
+        if not self._try_acquire_ingest():
+            self._elect_task = loop.create_task(self._elect_loop())
+        logger.info("fanout started path=%s ingest_owner=%s", self._path, self.is_ingest_owner)
+
+    def stop(self) -> None:
+        if not self.enabled:
+            return
+        if self._elect_task is not None:
+            self._elect_task.cancel()
+            self._elect_task = None
+        if self._sock is not None:
+            if self._loop is not None:
+                self._loop.remove_reader(self._sock.fileno())
+            self._sock.close()
+            self._sock = None
+            try:
+                os.unlink(self._path)
+            except OSError:
+                pass
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    async def publish(self, payload: dict[str, Any]) -> None:
+        # msgspec rather than json so events can embed pre-validated msgspec.Raw payloads.
+        started = time.perf_counter()
+        try:
+            await self._publish(msgspec.json.encode(payload))
+        finally:
+            ws_broadcast_seconds.observe(time.perf_counter() - started)
+
+    async def _publish(self, data: bytes) -> None:
+        await ws_manager.broadcast_text(data.decode("utf-8"))
+        if self._sock is None:
+            return
+        if len(data) > MAX_DATAGRAM_BYTES:
+            logger.warning("fanout event too large (%s bytes), peers skipped", len(data))
+            return
+        for peer in self._peer_paths():
+            try:
+                self._sock.sendto(data, peer)
+            except BlockingIOError:
+                logger.warning("fanout peer %s is backlogged, event dropped", peer)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Socket file left behind by a worker that died without cleanup.
+                self._drop_peer(peer)
+            except OSError:
+                logger.exception("fanout send to %s failed", peer)
+
+    def _peer_paths(self) -> list[str]:
+        now = time.monotonic()
+        if now - self._peers_at >= PEER_REFRESH_SECONDS:
+            try:
+                names = os.listdir(self._dir)
+            except OSError:
+                names = []
+            self._peers = [
+                os.path.join(self._dir, name)
+                for name in names
+                if name.endswith(SOCKET_SUFFIX) and os.path.join(self._dir, name) != self._path
+            ]
+            self._peers_at = now
+        return self._peers
+
+    def _drop_peer(self, peer: str) -> None:
+        self._peers = [p for p in self._peers if p != peer]
+        try:
+            os.unlink(peer)
+        except OSError:
+            pass
+
+    def _on_readable(self) -> None:
+        if self._sock is None:
+            return
+        while True:
+            try:
+                data = self._sock.recv(MAX_DATAGRAM_BYTES)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                logger.exception("fanout receive failed")
+                return
+            if self._on_peer_event is not None:
+                try:
+                    head = _head_decoder.decode(data)
+                except msgspec.DecodeError:
+                    head = None
+                if head is not None and head.deviceId:
+                    self._on_peer_event(head.type, head.deviceId, bytes(head.payload))
+            asyncio.ensure_future(ws_manager.broadcast_text(data.decode("utf-8", errors="ignore")))
+
+    def _try_acquire_ingest(self) -> bool:
+        import fcntl
+
+        fd = os.open(os.path.join(self._dir, LOCK_NAME), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode("ascii"))
+        self._lock_fd = fd
+        return True
+
+    async def _elect_loop(self) -> None:
+        while not self._try_acquire_ingest():
+            await asyncio.sleep(settings.fanout_elect_interval_seconds)
+        logger.info("worker pid=%s took over MQTT ingest", os.getpid())
+        if self._on_ingest_acquired is not None:
+            self._on_ingest_acquired()
+
+
+event_fanout = EventFanout()
@@ -1,36 +1,57 @@
 from __future__ import annotations
 
 import asyncio
-import json
+import hashlib
 import logging
-import secrets
 import time
 from contextlib import asynccontextmanager
 from typing import Any
 
-from fastapi import FastAPI, Query, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, Header, Query, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
-from sqlalchemy import select
+import msgspec
 
+from .auth import AuthBusy, login_throttle, password_hasher, token_store
+from .bootstrap import reconcile_admin, run_bootstrap, startup_report
+from .commands import CmdRejected, announce_unpublished, submit_cmd
 from .config import settings
-from .db import Base, engine, get_session
-from .models import Device, StripStatus
+from .db import get_session
+from .energy import device_energy, energy_meter, room_energy, room_energy_ranking
+from .fanout import event_fanout
+from .metrics import Gauge, MetricsMiddleware, metrics
+from .models import CommandSchedule, StripStatus, UserAccount
 from .mqtt_bridge import mqtt_bridge
-from .schemas import AIReportOut, CmdRequest, CmdStateOut, CmdSubmitOut, DeviceOut, StripStatusOut
+from .payloads import decode_offline_reason
+from .presence import TIMEOUT_REASON, presence_monitor
+from .profiling import ProfiledRoute, ServerTimingMiddleware, profiling_enabled
+from .ratelimit import AdmissionMiddleware
+from .responses import EncodedBody, encoded_response, json_response, telemetry_responses
+from .schemas import (
+    AIReportOut,
+    CmdRequest,
+    CmdStateOut,
+    CmdSubmitOut,
+    DeviceEnergyOut,
+    DeviceOut,
+    RoomEnergyOut,
+    RoomEnergyRankOut,
+    ScheduleOut,
+    ScheduleRequest,
+    StripStatusOut,
+)
+from .registry import DeviceMeta, device_registry
+from .reports import report_cache
+from .scheduler import command_scheduler, create_schedule, list_schedules, schedule_out
 from .services import (
-    ai_report,
+    RANGE_CONFIG,
+    build_socket_telemetry_series,
     build_telemetry_series,
-    create_cmd_record,
-    ensure_default_admin,
-    ensure_seed_data,
+    find_login_user,
     get_cmd_state,
-    has_pending_conflict,
-    login_user,
-    mark_timeouts,
-    refresh_online_state,
-    update_cmd_state,
+    get_socket_states,
+    is_online,
     utc_iso,
 )
 from .schemas import (
@@ -38,13 +59,20 @@ from .schemas import (
     AuthLoginRequest,
     AuthUserOut,
 )
+from .tsstore import telemetry_store
 from .ws import ws_manager
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("dorm-backend")
 
 
-def error_response(status: int, code: str, message: str, details: dict[str, Any] | None = None) -> JSONResponse:
+def error_response(
+    status: int,
+    code: str,
+    message: str,
+    details: dict[str, Any] | None = None,
+    headers: dict[str, str] | None = None,
+) -> JSONResponse:
     return JSONResponse(
         status_code=status,
         content={
@@ -53,26 +81,88 @@ def error_response(status: int, code: str, message: str, details: dict[str, Any]
             "message": message,
             "details": details or {},
         },
+        headers=headers,
     )
 
 
+def on_peer_event(event_type: str, device_id: str, payload: bytes) -> None:
+    # Keep this worker's registry current with presence changes seen by the ingest worker.
+    if event_type in {"DEVICE_STATUS", "TELEMETRY"}:
+        device_registry.seen(device_id, int(time.time()))
+    elif event_type == "DEVICE_OFFLINE":
+        device_registry.set_offline(device_id, decode_offline_reason(payload))
+
+
+def presence_seed() -> list[DeviceMeta]:
+    # Replicas only time out devices they ingest; the others belong to another
+    # instance's monitor and must not be flipped offline from here.
+    return [meta for meta in device_registry.snapshot() if mqtt_bridge.tracks_presence(meta.id)]
+
+
+def on_ingest_acquired() -> None:
+    mqtt_bridge.set_ingest(True)
+    presence_monitor.start(asyncio.get_running_loop(), presence_seed())
+    command_scheduler.start(asyncio.get_running_loop())
+    telemetry_store.start(asyncio.get_running_loop())
+
+
+def log_background_failure(task: asyncio.Future[Any]) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("background startup task failed", exc_info=task.exception())
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    Base.metadata.create_all(bind=engine)
-    with get_session() as session:
-        ensure_seed_data(session)
-        ensure_default_admin(session)
-        mark_timeouts(session)
-
-    mqtt_bridge.set_loop(asyncio.get_running_loop())
-    mqtt_bridge.start()
+    with startup_report.phase("bootstrap"):
+        # Expired pending commands are marked lazily by has_pending_conflict/get_cmd_state.
+        full = run_bootstrap()
+    startup_report.bootstrap = "full" if full else "skipped"
+    with startup_report.phase("registry"):
+        with get_session() as session:
+            device_registry.load(session)
+
+    loop = asyncio.get_running_loop()
+    with startup_report.phase("fanout"):
+        event_fanout.start(
+            loop,
+            on_ingest_acquired=on_ingest_acquired,
+            on_peer_event=on_peer_event,
+        )
+    mqtt_bridge.set_ingest(event_fanout.is_ingest_owner)
+    if event_fanout.is_ingest_owner:
+        presence_monitor.start(loop, presence_seed())
+        command_scheduler.start(loop)
+        telemetry_store.start(loop)
+        if not full:
+            asyncio.ensure_future(asyncio.to_thread(reconcile_admin)).add_done_callback(log_background_failure)
+    mqtt_bridge.set_loop(loop)
+    with startup_report.phase("mqtt"):
+        mqtt_bridge.start()
+    startup_report.log()
     try:
         yield
     finally:
         mqtt_bridge.stop()
+        presence_monitor.stop()
+        command_scheduler.stop()
+        telemetry_store.stop()
+        with get_session() as session:
+            device_registry.flush(session)
+            energy_meter.flush(session)
+            telemetry_store.flush(session)
+        event_fanout.stop()
+        report_cache.stop()
+        password_hasher.stop()
 
 
 app = FastAPI(title="Dorm Power Backend", version="1.0.0", lifespan=lifespan)
+if profiling_enabled():
+    # Must be set before the routes below are declared.
+    app.router.route_class = ProfiledRoute
+app.add_middleware(MetricsMiddleware)
+if settings.server_timing:
+    app.add_middleware(ServerTimingMiddleware)
+app.add_middleware(AdmissionMiddleware, reject=error_response)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -86,23 +176,66 @@ async def validation_exception_handler(_request, exc: RequestValidationError):
     return error_response(400, "BAD_REQUEST", "request validation failed", {"errors": exc.errors()})
 
 
+metrics.add(Gauge("ws_clients", "Connected WebSocket clients in this worker.", lambda: ws_manager.client_count))
+
+
+@app.get("/metrics", include_in_schema=False)
+def get_metrics() -> Response:
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/health")
 def health() -> dict[str, Any]:
     return {
         "ok": True,
         "mqtt_enabled": mqtt_bridge.enabled,
         "mqtt_connected": mqtt_bridge.connected,
+        "mqtt_ingest": mqtt_bridge.ingest,
+        "mqtt_rejects": mqtt_bridge.reject_counts(),
+        "fanout_enabled": event_fanout.enabled,
+        "scheduler_running": command_scheduler.running,
+        "scheduled_commands": command_scheduler.scheduled,
         "database_url": settings.database_url,
+        "startup": startup_report.as_dict(),
     }
 
 
+def bearer_token(authorization: str | None) -> str:
+    scheme, _, token = (authorization or "").partition(" ")
+    return token.strip() if scheme.lower() == "bearer" else ""
+
+
 @app.post("/api/auth/login", response_model=AuthLoginOut)
-def auth_login(req: AuthLoginRequest) -> Any:
+async def auth_login(req: AuthLoginRequest, request: Request) -> Any:
+    ip = request.client.host if request.client else ""
+    retry_after = login_throttle.retry_after(req.account, ip)
+    if retry_after:
+        return error_response(
+            429, "TOO_MANY_ATTEMPTS", "too many failed login attempts", headers={"Retry-After": str(retry_after)}
+        )
+    user = await asyncio.to_thread(_find_login_user, req.account)
+    try:
+        ok = user is not None and await password_hasher.verify(req.password, user.password_hash)
+    except AuthBusy:
+        return error_response(503, "AUTH_BUSY", "login is busy, retry shortly", headers={"Retry-After": "1"})
+    if not ok:
+        login_throttle.record_failure(req.account, ip)
+        return error_response(401, "UNAUTHORIZED", "invalid account or password")
+    login_throttle.reset(req.account)
+    return await asyncio.to_thread(_issue_login_token, user)
+
+
+# The async login route keeps its DB work off the event loop.
+def _find_login_user(account: str) -> UserAccount | None:
     with get_session() as session:
-        user = login_user(session, req.account, req.password)
-        if user is None:
-            return error_response(401, "UNAUTHORIZED", "invalid account or password")
-        token = secrets.token_urlsafe(24)
+        return find_login_user(session, account)
+
+
+def _issue_login_token(user: UserAccount) -> AuthLoginOut:
+    with get_session() as session:
+        user = session.merge(user)
+        user.updated_at = int(time.time())
+        token = token_store.issue(session, user.username)
         return AuthLoginOut(
             ok=True,
             token=token,
@@ -110,45 +243,104 @@ def auth_login(req: AuthLoginRequest) -> Any:
         )
 
 
-@app.get("/api/devices", response_model=list[DeviceOut])
-def get_devices() -> list[DeviceOut]:
+@app.get("/api/auth/me", response_model=AuthUserOut)
+def auth_me(authorization: str | None = Header(None)) -> Any:
     with get_session() as session:
-        items = session.scalars(select(Device).order_by(Device.id.asc())).all()
-        output: list[DeviceOut] = []
-        for d in items:
-            refresh_online_state(session, d)
-            output.append(
-                DeviceOut(
-                    id=d.id,
-                    name=d.name,
-                    room=d.room,
-                    online=d.online,
-                    lastSeen=utc_iso(d.last_seen_ts),
-                )
-            )
-        return output
+        username = token_store.validate(session, bearer_token(authorization))
+        user = session.get(UserAccount, username) if username else None
+        if user is None:
+            return error_response(401, "UNAUTHORIZED", "token is invalid or expired")
+        return AuthUserOut(username=user.username, email=user.email, role="admin")
+
+
+@app.post("/api/auth/logout")
+def auth_logout(authorization: str | None = Header(None)) -> dict[str, bool]:
+    token = bearer_token(authorization)
+    if token:
+        with get_session() as session:
+            token_store.revoke(session, token)
+    return {"ok": True}
+
+
+# (registry version, expires_at, body) of the last rendered device list.
+_device_list: tuple[int, int, EncodedBody] | None = None
+
+
+def render_device_list() -> EncodedBody:
+    global _device_list
+    now = int(time.time())
+    version = device_registry.version
+    cached = _device_list
+    if cached is not None and cached[0] == version and now < cached[1]:
+        return cached[2]
+
+    devices = device_registry.snapshot()
+    items = []
+    # The list is only stale once an online device crosses its timeout.
+    expires_at = now + settings.online_timeout_seconds + 1
+    for d in devices:
+        online = d.online and is_online(d.last_seen_ts, now)
+        if online:
+            expires_at = min(expires_at, d.last_seen_ts + settings.online_timeout_seconds + 1)
+        items.append(
+            {
+                "id": d.id,
+                "name": d.name,
+                "room": d.room,
+                "online": online,
+                "lastSeen": utc_iso(d.last_seen_ts),
+                "offlineReason": None if online else d.offline_reason or TIMEOUT_REASON,
+            }
+        )
+    raw = msgspec.json.encode(items)
+    body = EncodedBody(raw, '"' + hashlib.blake2b(raw, digest_size=12).hexdigest() + '"')
+    _device_list = (version, expires_at, body)
+    return body
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+@app.get("/api/devices", response_model=list[DeviceOut])
+def get_devices(
+    if_none_match: str | None = Header(None),
+    accept_encoding: str | None = Header(None),
+) -> Response:
+    if device_registry.needs_reload or device_registry.refresh_due:
+        with get_session() as session:
+            if device_registry.needs_reload:
+                device_registry.load(session)
+            device_registry.refresh(session)
+    body = render_device_list()
+    if etag_matches(if_none_match, body.etag):
+        return Response(status_code=304, headers={"ETag": body.etag, "Cache-Control": "no-cache"})
+    return encoded_response(body, accept_encoding, {"Cache-Control": "no-cache"})
 
 
 @app.get("/api/devices/{device_id}/status", response_model=StripStatusOut)
 def get_device_status(device_id: str) -> Any:
     with get_session() as session:
-        d = session.get(Device, device_id)
+        device_registry.refresh(session)
+        d = device_registry.get(session, device_id)
         s = session.get(StripStatus, device_id)
         if d is None or s is None:
             return error_response(404, "NOT_FOUND", "device not found")
 
-        refresh_online_state(session, d)
-        try:
-            sockets = json.loads(s.sockets_json)
-        except Exception:
-            sockets = []
-        return StripStatusOut(
-            ts=s.ts,
-            online=d.online and s.online,
-            total_power_w=s.total_power_w,
-            voltage_v=s.voltage_v,
-            current_a=s.current_a,
-            sockets=sockets,
+        sockets = get_socket_states(session, device_id)
+        # Same shape as StripStatusOut, encoded directly.
+        return json_response(
+            {
+                "ts": s.ts,
+                "online": d.online and is_online(d.last_seen_ts, int(time.time())) and s.online,
+                "total_power_w": s.total_power_w,
+                "voltage_v": s.voltage_v,
+                "current_a": s.current_a,
+                "sockets": sockets,
+            }
         )
 
 
@@ -156,51 +348,72 @@ def get_device_status(device_id: str) -> Any:
 def get_telemetry(
     device: str = Query(..., min_length=1),
     range: str = Query(..., pattern="^(60s|24h|7d|30d)$"),
+    mode: str = Query("total", pattern="^(total|sockets)$"),
+    accept_encoding: str | None = Header(None),
 ) -> Any:
     with get_session() as session:
-        if session.get(Device, device) is None:
+        if not device_registry.exists(session, device):
             return error_response(404, "NOT_FOUND", "device not found")
-        try:
-            return build_telemetry_series(session, device, range)
-        except ValueError:
-            return error_response(400, "BAD_REQUEST", "range is invalid")
+
+    def build() -> bytes:
+        with get_session() as session:
+            if mode == "sockets":
+                return msgspec.json.encode(build_socket_telemetry_series(session, device, range))
+            return msgspec.json.encode(build_telemetry_series(session, device, range))
+
+    # Identical chart requests within one step bucket share one computation and
+    # one encoding, for at most TELEMETRY_CACHE_TTL_SECONDS.
+    bucket = int(time.time()) // RANGE_CONFIG[range]["step"]
+    try:
+        body = telemetry_responses.get_or_build((device, range, mode, bucket), build)
+    except ValueError:
+        return error_response(400, "BAD_REQUEST", "range is invalid")
+    return encoded_response(body, accept_encoding)
 
 
 @app.post("/api/strips/{device_id}/cmd", response_model=CmdSubmitOut)
 async def post_cmd(device_id: str, req: CmdRequest) -> Any:
+    try:
+        cmd, published = await asyncio.to_thread(submit_cmd, device_id, req, "web")
+    except CmdRejected as exc:
+        return error_response(exc.status, exc.code, exc.message)
+    if not published:
+        await announce_unpublished(cmd.cmd_id)
+    return CmdSubmitOut(ok=True, cmdId=cmd.cmd_id, stripId=device_id, acceptedAt=int(time.time()))
+
+
+@app.post("/api/strips/{device_id}/schedules", response_model=ScheduleOut)
+def post_schedule(device_id: str, req: ScheduleRequest) -> Any:
     with get_session() as session:
-        if session.get(Device, device_id) is None:
+        if not device_registry.exists(session, device_id):
             return error_response(404, "NOT_FOUND", "device not found")
-        if has_pending_conflict(session, device_id, req.socket):
-            return error_response(409, "CMD_CONFLICT", "pending command exists for target")
-        cmd = create_cmd_record(session, device_id, req)
-
-    cmd_payload = {
-        "cmdId": cmd.cmd_id,
-        "ts": int(time.time()),
-        "type": req.action.upper(),
-        "socketId": req.socket,
-        "payload": req.payload,
-        "mode": req.mode,
-        "duration": req.duration,
-        "source": "web",
-    }
-    published = mqtt_bridge.publish_cmd(device_id, cmd_payload)
-    if not published:
-        with get_session() as session:
-            update_cmd_state(session, cmd.cmd_id, "failed", message="mqtt unavailable")
-        await ws_manager.broadcast(
-            {
-                "type": "CMD_ACK",
-                "cmdId": cmd.cmd_id,
-                "state": "failed",
-                "ts": int(time.time()),
-                "updatedAt": int(time.time()),
-                "message": "mqtt unavailable",
-            }
-        )
+        try:
+            row = create_schedule(session, device_id, req)
+        except ValueError as exc:
+            return error_response(400, "BAD_REQUEST", str(exc))
+        out = ScheduleOut(**schedule_out(row))
+    # After commit, so the scheduler never sees a row that is not stored yet.
+    command_scheduler.add(row.id, row.next_run_at)
+    return out
 
-    return CmdSubmitOut(ok=True, cmdId=cmd.cmd_id, stripId=device_id, acceptedAt=int(time.time()))
+
+@app.get("/api/strips/{device_id}/schedules", response_model=list[ScheduleOut])
+def get_schedules(device_id: str) -> Any:
+    with get_session() as session:
+        if not device_registry.exists(session, device_id):
+            return error_response(404, "NOT_FOUND", "device not found")
+        return [ScheduleOut(**schedule_out(row)) for row in list_schedules(session, device_id)]
+
+
+@app.delete("/api/schedules/{schedule_id}")
+def delete_schedule(schedule_id: str) -> Any:
+    with get_session() as session:
+        row = session.get(CommandSchedule, schedule_id)
+        if row is None:
+            return error_response(404, "NOT_FOUND", "schedule not found")
+        session.delete(row)
+    command_scheduler.discard(schedule_id)
+    return {"ok": True}
 
 
 @app.get("/api/cmd/{cmd_id}", response_model=CmdStateOut)
@@ -217,11 +430,32 @@ def get_ai_report(room_id: str, period: str = Query("7d")) -> Any:
     if period not in {"7d", "30d"}:
         return error_response(400, "BAD_REQUEST", "period is invalid")
     with get_session() as session:
-        exists = session.scalar(select(Device.id).where(Device.room == room_id).limit(1))
-        if exists is None:
+        if not device_registry.room_devices(session, room_id):
+            return error_response(404, "NOT_FOUND", "room not found")
+    return AIReportOut(**report_cache.get(room_id, period))
+
+
+@app.get("/api/devices/{device_id}/energy", response_model=DeviceEnergyOut)
+def get_device_energy(device_id: str, period: str = Query("24h", pattern="^(24h|7d|30d)$")) -> Any:
+    with get_session() as session:
+        if not device_registry.exists(session, device_id):
+            return error_response(404, "NOT_FOUND", "device not found")
+        return DeviceEnergyOut(**device_energy(session, device_id, period))
+
+
+@app.get("/api/rooms/energy_ranking", response_model=list[RoomEnergyRankOut])
+def get_room_energy_ranking(period: str = Query("7d", pattern="^(24h|7d|30d)$")) -> Any:
+    with get_session() as session:
+        return [RoomEnergyRankOut(**x) for x in room_energy_ranking(session, period)]
+
+
+@app.get("/api/rooms/{room_id}/energy", response_model=RoomEnergyOut)
+def get_room_energy(room_id: str, period: str = Query("7d", pattern="^(24h|7d|30d)$")) -> Any:
+    with get_session() as session:
+        device_ids = device_registry.room_devices(session, room_id)
+        if not device_ids:
             return error_response(404, "NOT_FOUND", "room not found")
-        result = ai_report(session, room_id, period)
-        return AIReportOut(**result)
+        return RoomEnergyOut(**room_energy(session, room_id, device_ids, period))
 
 
 @app.websocket("/ws")
@@ -0,0 +1,212 @@
+from __future__ import annotations
+
+import bisect
+import threading
+import time
+from typing import Any, Callable
+
+# Small in-process Prometheus text-format metrics. Each update is a dict lookup
+# and a few additions under an uncontended lock, cheap enough for the MQTT path.
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+RTT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+MAX_TRACKED_CMDS = 10_000
+
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _num(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help = help_text
+        self.label_names = labels
+        self._lock = threading.Lock()
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels: str) -> float:
+        with self._lock:
+            return self._values.get(labels, 0.0)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{_labels(self.label_names, labels)} {_num(value)}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name: str, help_text: str, read: Callable[[], float]) -> None:
+        self.name = name
+        self.help = help_text
+        self._read = read
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {_num(self._read())}"]
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ) -> None:
+        self.name = name
+        self.help = help_text
+        self.label_names = labels
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # labels -> [per-bucket counts..., +Inf count, sum]
+        self._series: dict[tuple[str, ...], list[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0.0] * (len(self.buckets) + 2)
+            series[idx] += 1
+            series[-1] += value
+
+    def time(self, *labels: str) -> _Timer:
+        return _Timer(self, labels)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((labels, list(series)) for labels, series in self._series.items())
+        for labels, series in items:
+            cumulative = 0.0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = _labels(self.label_names, labels, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{le} {_num(cumulative)}")
+            cumulative += series[len(self.buckets)]
+            inf = _labels(self.label_names, labels, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{inf} {_num(cumulative)}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {_num(series[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {_num(cumulative)}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("_hist", "_labels", "_started")
+
+    def __init__(self, hist: Histogram, labels: tuple[str, ...]) -> None:
+        self._hist = hist
+        self._labels = labels
+        self._started = 0.0
+
+    def __enter__(self) -> None:
+        self._started = time.perf_counter()
+
+    def __exit__(self, *exc: Any) -> None:
+        self._hist.observe(time.perf_counter() - self._started, *self._labels)
+
+
+class MetricSet:
+    def __init__(self) -> None:
+        self._metrics: list[Counter | Gauge | Histogram] = []
+
+    def add(self, metric: Any) -> Any:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricSet()
+
+mqtt_messages = metrics.add(Counter("mqtt_messages_total", "MQTT messages received by type.", ("type",)))
+mqtt_rejected = metrics.add(Counter("mqtt_rejected_total", "MQTT payloads rejected by the decoder.", ("type",)))
+mqtt_message_seconds = metrics.add(
+    Histogram("mqtt_message_seconds", "Time spent handling one MQTT message.", ("type",))
+)
+db_session_seconds = metrics.add(Histogram("db_session_seconds", "Lifetime of a get_session() block."))
+db_commit_seconds = metrics.add(Histogram("db_commit_seconds", "Time spent in session.commit()."))
+cmd_device_seconds = metrics.add(
+    Histogram("cmd_device_seconds", "Command execution time reported by the device (costMs).", buckets=RTT_BUCKETS)
+)
+cmd_roundtrip_seconds = metrics.add(
+    Histogram("cmd_roundtrip_seconds", "Command submit to ACK time seen by the backend.", ("state",), RTT_BUCKETS)
+)
+ws_broadcast_seconds = metrics.add(
+    Histogram("ws_broadcast_seconds", "Time to fan an event out to WS clients and peer workers.")
+)
+http_request_seconds = metrics.add(
+    Histogram("http_request_seconds", "HTTP request latency by route.", ("method", "route", "status"))
+)
+http_rejected = metrics.add(
+    Counter("http_rejected_total", "Requests refused by admission control.", ("reason", "route_class"))
+)
+
+_cmd_lock = threading.Lock()
+_cmd_started: dict[str, float] = {}
+
+
+def track_cmd(cmd_id: str) -> None:
+    with _cmd_lock:
+        if len(_cmd_started) >= MAX_TRACKED_CMDS:
+            del _cmd_started[next(iter(_cmd_started))]
+        _cmd_started[cmd_id] = time.time()
+
+
+def observe_cmd_ack(cmd_id: str, state: str, created_at: int, duration_ms: int | None) -> None:
+    # Commands submitted through another worker (or before a restart) fall back to
+    # the second-resolution created_at column.
+    with _cmd_lock:
+        started = _cmd_started.pop(cmd_id, None)
+    cmd_roundtrip_seconds.observe(max(time.time() - (started or created_at), 0.0), state)
+    if duration_ms is not None:
+        cmd_device_seconds.observe(duration_ms / 1000.0)
+
+
+# Pure ASGI middleware: BaseHTTPMiddleware would add a task and a stream copy per request.
+class MetricsMiddleware:
+    def __init__(self, app: Any) -> None:
+        self.app = app
+
+    async def __call__(self, scope: dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message: dict[str, Any]) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            # Route templates keep label cardinality bounded; unmatched paths share one label.
+            path = getattr(route, "path", None) or "<unmatched>"
+            http_request_seconds.observe(time.perf_counter() - started, scope["method"], path, str(status))
@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from sqlalchemy import BigInteger, Boolean, Float, Integer, String, Text
+from sqlalchemy import BigInteger, Boolean, Float, Index, Integer, LargeBinary, String, Text
 from sqlalchemy.orm import Mapped, mapped_column
 
 from .db import Base
@@ -25,11 +25,23 @@ class StripStatus(Base):
     total_power_w: Mapped[float] = mapped_column(Float, default=0.0, nullable=False)
     voltage_v: Mapped[float] = mapped_column(Float, default=220.0, nullable=False)
     current_a: Mapped[float] = mapped_column(Float, default=0.0, nullable=False)
+    # Legacy JSON copy of the socket list; socket state now lives in strip_sockets.
     sockets_json: Mapped[str] = mapped_column(Text, default="[]", nullable=False)
 
 
+class StripSocket(Base):
+    __tablename__ = "strip_sockets"
+
+    device_id: Mapped[str] = mapped_column(String(64), primary_key=True)
+    socket_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    on: Mapped[bool] = mapped_column(Boolean, default=False, nullable=False)
+    power_w: Mapped[float] = mapped_column(Float, default=0.0, nullable=False)
+    device: Mapped[str] = mapped_column(String(128), default="Unknown", nullable=False)
+
+
 class Telemetry(Base):
     __tablename__ = "telemetry"
+    __table_args__ = (Index("ix_telemetry_device_ts", "device_id", "ts"),)
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     device_id: Mapped[str] = mapped_column(String(64), index=True, nullable=False)
@@ -39,6 +51,38 @@ class Telemetry(Base):
     current_a: Mapped[float] = mapped_column(Float, default=0.0, nullable=False)
 
 
+class SocketTelemetry(Base):
+    __tablename__ = "socket_telemetry"
+    __table_args__ = (Index("ix_socket_telemetry_device_ts", "device_id", "ts"),)
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    device_id: Mapped[str] = mapped_column(String(64), nullable=False)
+    ts: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    # Little-endian float32 per socket, position = socket id - 1 (NaN if absent).
+    powers: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+    # Bit (socket id - 1) is set when that socket is on.
+    on_mask: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+
+
+class EnergyCursor(Base):
+    __tablename__ = "energy_cursors"
+
+    device_id: Mapped[str] = mapped_column(String(64), primary_key=True)
+    socket: Mapped[int] = mapped_column(Integer, primary_key=True)
+    ts: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    power_w: Mapped[float] = mapped_column(Float, default=0.0, nullable=False)
+
+
+class EnergyCounter(Base):
+    __tablename__ = "energy_counters"
+
+    device_id: Mapped[str] = mapped_column(String(64), primary_key=True)
+    socket: Mapped[int] = mapped_column(Integer, primary_key=True)
+    granularity: Mapped[str] = mapped_column(String(1), primary_key=True)
+    bucket_ts: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    energy_wh: Mapped[float] = mapped_column(Float, default=0.0, nullable=False)
+
+
 class CommandRecord(Base):
     __tablename__ = "cmd_records"
 
@@ -55,6 +99,29 @@ class CommandRecord(Base):
     duration_ms: Mapped[int | None] = mapped_column(Integer, nullable=True)
 
 
+class CommandSchedule(Base):
+    __tablename__ = "cmd_schedules"
+
+    id: Mapped[str] = mapped_column(String(64), primary_key=True)
+    device_id: Mapped[str] = mapped_column(String(64), index=True, nullable=False)
+    socket: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    action: Mapped[str] = mapped_column(String(64), nullable=False)
+    # The CmdRequest fields, same shape as CommandRecord.payload_json.
+    payload_json: Mapped[str] = mapped_column(Text, default="{}", nullable=False)
+    # "once", "daily" (time_of_day, server local time) or "interval".
+    repeat: Mapped[str] = mapped_column(String(16), nullable=False)
+    time_of_day: Mapped[str] = mapped_column(String(5), default="", nullable=False)
+    interval_seconds: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    enabled: Mapped[bool] = mapped_column(Boolean, default=True, nullable=False)
+    # NULL once a one-shot schedule has fired.
+    next_run_at: Mapped[int | None] = mapped_column(BigInteger, nullable=True)
+    last_run_at: Mapped[int | None] = mapped_column(BigInteger, nullable=True)
+    last_cmd_id: Mapped[str] = mapped_column(String(64), default="", nullable=False)
+    last_result: Mapped[str] = mapped_column(String(32), default="", nullable=False)
+    created_at: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    updated_at: Mapped[int] = mapped_column(BigInteger, index=True, nullable=False)
+
+
 class UserAccount(Base):
     __tablename__ = "user_accounts"
 
@@ -66,3 +133,19 @@ class UserAccount(Base):
     reset_expires_at: Mapped[int] = mapped_column(BigInteger, default=0, nullable=False)
     created_at: Mapped[int] = mapped_column(BigInteger, nullable=False)
     updated_at: Mapped[int] = mapped_column(BigInteger, nullable=False)
+
+
+class AuthToken(Base):
+    __tablename__ = "auth_tokens"
+
+    # blake2b digest of the issued token; the token itself is never stored.
+    token_hash: Mapped[bytes] = mapped_column(LargeBinary(16), primary_key=True)
+    username: Mapped[str] = mapped_column(String(64), nullable=False)
+    expires_at: Mapped[int] = mapped_column(BigInteger, index=True, nullable=False)
+
+
+class AppMeta(Base):
+    __tablename__ = "app_meta"
+
+    key: Mapped[str] = mapped_column(String(64), primary_key=True)
+    value: Mapped[str] = mapped_column(String(255), nullable=False)
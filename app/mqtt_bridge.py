@@ -3,13 +3,24 @@ from __future__ import annotations
 import asyncio
 import json
 import logging
+import os
+import socket
+import threading
 import time
-from typing import Any
+import zlib
+from collections import Counter
+from typing import TYPE_CHECKING, Any
 
-import paho.mqtt.client as mqtt
+import msgspec
 
+from .capture import mqtt_capture
 from .config import settings
 from .db import get_session
+from .fanout import event_fanout
+from .metrics import mqtt_message_seconds, mqtt_messages, mqtt_rejected, observe_cmd_ack
+from .payloads import decode_offline_reason, decode_payload
+from .presence import presence_monitor
+from .routing import OFFLINE_TYPES, TOPIC_TYPES, Route, topic_router
 from .services import (
     apply_command_effect_to_status,
     save_telemetry_point,
@@ -17,22 +28,60 @@ from .services import (
     update_cmd_state,
     update_status_from_payload,
 )
-from .ws import ws_manager
+
+if TYPE_CHECKING:
+    import paho.mqtt.client as mqtt
 
 logger = logging.getLogger("mqtt-bridge")
 
+# Distinct device ids tracked for reject counts; the rest share one bucket so a
+# flood of bogus topics cannot grow the counter without bound.
+MAX_REJECT_KEYS = 1024
+REJECT_OVERFLOW_KEY = "<other>"
+
+
+def device_partition(device_id: str, count: int) -> int:
+    # crc32 is stable across processes and releases, unlike hash() on str.
+    return zlib.crc32(device_id.encode("utf-8")) % count if count > 1 else 0
+
+
+def build_client_id() -> str:
+    parts = [settings.mqtt_client_id]
+    if settings.mqtt_shared_group or settings.mqtt_partition_count > 1:
+        parts.append(settings.mqtt_instance_id or socket.gethostname())
+    # In multi-worker mode every worker keeps its own publishing connection,
+    # so client ids must not collide or the broker kicks the older session.
+    if event_fanout.enabled:
+        parts.append(str(os.getpid()))
+    return "-".join(parts)
+
+
+def build_subscriptions(base: str) -> list[str]:
+    filters = [f"{base}/+/{t}" for t in TOPIC_TYPES] + [f"{base}/+/+/{t}" for t in TOPIC_TYPES]
+    group = settings.mqtt_shared_group
+    if not group:
+        return filters
+    # One group for all replicas; the broker's hash_clientid strategy keeps a
+    # device's messages on one member.
+    return [f"$share/{group}/{f}" for f in filters]
+
 
 class MQTTBridge:
     def __init__(self) -> None:
         self._enabled = settings.mqtt_enabled
         self._connected = False
         self._loop: asyncio.AbstractEventLoop | None = None
-        self._client = mqtt.Client(client_id="dorm-power-backend")
-        if settings.mqtt_username:
-            self._client.username_pw_set(settings.mqtt_username, settings.mqtt_password)
-        self._client.on_connect = self._on_connect
-        self._client.on_message = self._on_message
-        self._client.on_disconnect = self._on_disconnect
+        self._ingest = True
+        self._rejects: Counter[str] = Counter()
+        self._rejects_lock = threading.Lock()
+        # Two ways to split ingest, never combined: a shared group lets the broker
+        # pick a replica per device; partitioning has every replica subscribe to
+        # everything and keep crc32(device_id) % N == index.
+        if settings.mqtt_shared_group and settings.mqtt_partition_count > 1:
+            raise ValueError("MQTT_SHARED_GROUP and MQTT_PARTITION_COUNT > 1 cannot be combined")
+        self._partition_count = settings.mqtt_partition_count
+        self._partition_index = settings.mqtt_partition_index % self._partition_count
+        self._client: mqtt.Client | None = None
 
     @property
     def enabled(self) -> bool:
@@ -42,13 +91,40 @@ class MQTTBridge:
     def connected(self) -> bool:
         return self._connected
 
+    @property
+    def ingest(self) -> bool:
+        return self._ingest
+
     def set_loop(self, loop: asyncio.AbstractEventLoop) -> None:
         self._loop = loop
 
+    def set_ingest(self, enabled: bool) -> None:
+        self._ingest = enabled
+        if enabled and self._client is not None:
+            mqtt_capture.start()
+            if self._connected:
+                self._subscribe(self._client)
+
     def start(self) -> None:
         if not self._enabled:
             logger.info("MQTT disabled via MQTT_ENABLED=0")
             return
+        # paho is imported here so processes running with MQTT disabled never load it.
+        import paho.mqtt.client as mqtt
+
+        protocol = mqtt.MQTTv5 if settings.mqtt_shared_group else mqtt.MQTTv311
+        self._client = mqtt.Client(
+            mqtt.CallbackAPIVersion.VERSION2,
+            client_id=build_client_id(),
+            protocol=protocol,
+        )
+        if settings.mqtt_username:
+            self._client.username_pw_set(settings.mqtt_username, settings.mqtt_password)
+        self._client.on_connect = self._on_connect
+        self._client.on_message = self._on_message
+        self._client.on_disconnect = self._on_disconnect
+        if self._ingest:
+            mqtt_capture.start()
         try:
             self._client.connect(settings.mqtt_host, settings.mqtt_port, keepalive=60)
             self._client.loop_start()
@@ -57,78 +133,110 @@ class MQTTBridge:
             logger.exception("MQTT connect failed: %s", exc)
 
     def stop(self) -> None:
-        if not self._enabled:
+        if self._client is None:
             return
         try:
             self._client.loop_stop()
             self._client.disconnect()
         except Exception:
             logger.exception("MQTT stop failed")
+        mqtt_capture.stop()
 
     def publish_cmd(self, device_id: str, payload: dict[str, Any]) -> bool:
-        if not (self._enabled and self._connected):
+        if self._client is None or not self._connected:
             return False
-        topics: list[str] = [f"{settings.mqtt_topic_prefix}/{device_id}/cmd"]
-        chunks = [x for x in device_id.split(" ", 1) if x]
-        if len(chunks) == 2:
-            topics.append(f"{settings.mqtt_topic_prefix}/{chunks[0]}/{chunks[1]}/cmd")
+        from paho.mqtt.client import MQTT_ERR_SUCCESS
 
         payload_text = json.dumps(payload, ensure_ascii=False)
         ok = False
-        for topic in dict.fromkeys(topics):
+        for topic in topic_router.cmd_topics(device_id):
             result = self._client.publish(topic, payload_text, qos=1)
-            ok = ok or result.rc == mqtt.MQTT_ERR_SUCCESS
+            ok = ok or result.rc == MQTT_ERR_SUCCESS
         return ok
 
     def _on_connect(self, client: mqtt.Client, userdata: Any, flags: Any, reason_code: Any, properties: Any = None) -> None:
         self._connected = reason_code == 0
         logger.info("MQTT connected rc=%s", reason_code)
-        if not self._connected:
+        if not self._connected or not self._ingest:
             return
-        base = settings.mqtt_topic_prefix
-        for topic in (f"{base}/+/status", f"{base}/+/telemetry", f"{base}/+/ack", f"{base}/+/event"):
-            client.subscribe(topic, qos=1)
-        for topic in (f"{base}/+/+/status", f"{base}/+/+/telemetry", f"{base}/+/+/ack", f"{base}/+/+/event"):
+        self._subscribe(client)
+
+    def _subscribe(self, client: mqtt.Client) -> None:
+        for topic in build_subscriptions(topic_router.prefix):
             client.subscribe(topic, qos=1)
 
+    def owns_device(self, device_id: str) -> bool:
+        return device_partition(device_id, self._partition_count) == self._partition_index
+
+    def tracks_presence(self, device_id: str) -> bool:
+        # Whether this instance is sure to receive the device's heartbeats, so the
+        # presence monitor may time it out from the database state at startup. A
+        # shared group leaves the choice to the broker; there a device is tracked
+        # from its first local heartbeat only.
+        return not settings.mqtt_shared_group and self.owns_device(device_id)
+
     def _on_disconnect(self, client: mqtt.Client, userdata: Any, disconnect_flags: Any, reason_code: Any, properties: Any = None) -> None:
         self._connected = False
         logger.warning("MQTT disconnected rc=%s", reason_code)
 
     def _on_message(self, client: mqtt.Client, userdata: Any, msg: mqtt.MQTTMessage) -> None:
-        try:
-            payload = json.loads(msg.payload.decode("utf-8", errors="ignore"))
-        except Exception:
-            logger.warning("Invalid JSON payload on topic=%s", msg.topic)
+        if mqtt_capture.enabled:
+            mqtt_capture.record(msg.topic, msg.payload)
+        route = topic_router.route(msg.topic)
+        if route is None:
+            return
+        if not self.owns_device(route.device_id):
             return
+        mqtt_messages.inc(route.msg_type)
+        with mqtt_message_seconds.time(route.msg_type):
+            self._handle(route, msg)
 
-        parsed = self._parse_topic(msg.topic)
-        if parsed is None:
+    def _handle(self, route: Route, msg: mqtt.MQTTMessage) -> None:
+        device_id, msg_type = route.device_id, route.msg_type
+        if msg_type in OFFLINE_TYPES:
+            presence_monitor.force_offline(device_id, decode_offline_reason(msg.payload))
             return
-        device_id, msg_type = parsed
 
+        try:
+            payload = decode_payload(msg_type, msg.payload)
+        except msgspec.DecodeError as exc:
+            self._count_reject(device_id)
+            mqtt_rejected.inc(msg_type)
+            logger.warning("Rejected payload on topic=%s: %s", msg.topic, exc)
+            return
+        if msg_type == "event":
+            return
+
+        try:
+            self._ingest_message(device_id, msg_type, payload, msg.payload)
+        except Exception:
+            # Runs on paho's network thread; one bad message must not stop the loop.
+            logger.exception("Failed to handle message on topic=%s", msg.topic)
+
+    def _ingest_message(self, device_id: str, msg_type: str, payload: Any, data: bytes) -> None:
+        # The device JSON was validated above, so it is forwarded to WS as-is.
+        raw = msgspec.Raw(data)
         with get_session() as session:
             if msg_type == "status":
                 update_status_from_payload(session, device_id, payload)
                 # Keep history chart usable even when device only uploads status.
                 save_telemetry_point(session, device_id, payload)
-                self._broadcast_safe({"type": "DEVICE_STATUS", "deviceId": device_id, "payload": payload})
+                self._broadcast_safe({"type": "DEVICE_STATUS", "deviceId": device_id, "payload": raw})
             elif msg_type == "telemetry":
                 save_telemetry_point(session, device_id, payload)
                 sync_status_metrics_from_telemetry(session, device_id, payload)
-                self._broadcast_safe({"type": "TELEMETRY", "deviceId": device_id, "payload": payload})
+                self._broadcast_safe({"type": "TELEMETRY", "deviceId": device_id, "payload": raw})
             elif msg_type == "ack":
-                cmd_id = str(payload.get("cmdId", ""))
-                status = str(payload.get("status", "success"))
-                cost_ms = payload.get("costMs")
+                cost_ms = payload.costMs
                 cmd = update_cmd_state(
                     session,
-                    cmd_id,
-                    "success" if status == "success" else "failed",
-                    message=str(payload.get("errorMsg", "")),
-                    duration_ms=int(cost_ms) if isinstance(cost_ms, (int, float)) else None,
+                    str(payload.cmdId),
+                    "success" if payload.status == "success" else "failed",
+                    message=payload.errorMsg or "",
+                    duration_ms=int(cost_ms) if cost_ms is not None else None,
                 )
                 if cmd:
+                    observe_cmd_ack(cmd.cmd_id, cmd.state, cmd.created_at, cmd.duration_ms)
                     if cmd.state == "success":
                         apply_command_effect_to_status(session, cmd)
                     event = {
@@ -142,40 +250,20 @@ class MQTTBridge:
                     }
                     self._broadcast_safe(event)
 
+    def _count_reject(self, device_id: str) -> None:
+        with self._rejects_lock:
+            if device_id not in self._rejects and len(self._rejects) >= MAX_REJECT_KEYS:
+                device_id = REJECT_OVERFLOW_KEY
+            self._rejects[device_id] += 1
+
+    def reject_counts(self) -> dict[str, int]:
+        with self._rejects_lock:
+            return dict(self._rejects)
+
     def _broadcast_safe(self, payload: dict[str, Any]) -> None:
         if self._loop is None:
             return
-        asyncio.run_coroutine_threadsafe(ws_manager.broadcast(payload), self._loop)
-
-    def _parse_topic(self, topic: str) -> tuple[str, str] | None:
-        topic_parts = [p for p in topic.strip("/").split("/") if p]
-        prefix_parts = [p for p in settings.mqtt_topic_prefix.strip("/").split("/") if p]
-        if len(topic_parts) < len(prefix_parts) + 2:
-            return None
-        if topic_parts[: len(prefix_parts)] != prefix_parts:
-            return None
-
-        tail = topic_parts[len(prefix_parts) :]
-        msg_type = tail[-1]
-        if msg_type not in {"status", "telemetry", "ack", "event"}:
-            return None
-
-        device_parts = [p.strip() for p in tail[:-1] if p.strip()]
-        if not device_parts:
-            return None
-
-        if len(device_parts) == 1:
-            token = " ".join(device_parts[0].split())
-            return token, msg_type
-
-        if len(device_parts) == 2:
-            room = " ".join(device_parts[0].split())
-            dev = " ".join(device_parts[1].split())
-            if room and dev:
-                return f"{room} {dev}", msg_type
-            return " ".join([x for x in (room, dev) if x]), msg_type
-
-        return " ".join(device_parts), msg_type
+        asyncio.run_coroutine_threadsafe(event_fanout.publish(payload), self._loop)
 
 
 mqtt_bridge = MQTTBridge()
@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+from typing import Any
+
+import msgspec
+
+
+class SocketPayload(msgspec.Struct):
+    id: int
+    on: bool
+    power_w: float = 0.0
+    device: str = "Unknown"
+
+
+class TelemetryPayload(msgspec.Struct):
+    online: bool | None = None
+    power_w: float | None = None
+    total_power_w: float | None = None
+    voltage_v: float | None = None
+    current_a: float | None = None
+
+    @property
+    def power(self) -> float:
+        if self.power_w is not None:
+            return self.power_w
+        return self.total_power_w if self.total_power_w is not None else 0.0
+
+
+class StatusPayload(TelemetryPayload):
+    sockets: list[SocketPayload] = []
+
+
+class _StatusWire(TelemetryPayload):
+    # Sockets are decoded one by one so a malformed entry drops only itself,
+    # not the whole status (and the heartbeat it carries).
+    sockets: msgspec.Raw = msgspec.Raw(b"[]")
+
+
+class AckPayload(msgspec.Struct):
+    cmdId: str | int = ""
+    status: str = "success"
+    costMs: int | float | None = None
+    errorMsg: str | None = None
+
+
+class EventPayload(msgspec.Struct):
+    type: str = ""
+
+
+class OfflinePayload(msgspec.Struct):
+    reason: str = ""
+
+
+# Decoders are built once and parse straight from the MQTT payload bytes.
+# strict=False keeps the lax coercions the old pydantic path allowed ("1" -> 1).
+DECODERS: dict[str, msgspec.json.Decoder[Any]] = {
+    "status": msgspec.json.Decoder(_StatusWire, strict=False),
+    "telemetry": msgspec.json.Decoder(TelemetryPayload, strict=False),
+    "ack": msgspec.json.Decoder(AckPayload, strict=False),
+    "event": msgspec.json.Decoder(EventPayload, strict=False),
+}
+
+
+_socket_list_decoder = msgspec.json.Decoder(list[msgspec.Raw])
+_socket_decoder = msgspec.json.Decoder(SocketPayload, strict=False)
+
+
+def _decode_sockets(data: msgspec.Raw) -> list[SocketPayload]:
+    try:
+        items = _socket_list_decoder.decode(data)
+    except msgspec.DecodeError:
+        return []
+    sockets: list[SocketPayload] = []
+    for item in items:
+        try:
+            sockets.append(_socket_decoder.decode(item))
+        except msgspec.DecodeError:
+            continue
+    return sockets
+
+
+def decode_payload(msg_type: str, data: bytes) -> Any:
+    payload = DECODERS[msg_type].decode(data)
+    if msg_type == "status":
+        return StatusPayload(
+            online=payload.online,
+            power_w=payload.power_w,
+            total_power_w=payload.total_power_w,
+            voltage_v=payload.voltage_v,
+            current_a=payload.current_a,
+            sockets=_decode_sockets(payload.sockets),
+        )
+    return payload
+
+
+_offline_decoder = msgspec.json.Decoder(OfflinePayload, strict=False)
+
+
+def decode_offline_reason(data: bytes) -> str:
+    try:
+        reason = _offline_decoder.decode(data).reason
+    except msgspec.DecodeError:
+        reason = data.decode("utf-8", errors="ignore").strip()
+    return reason[:128] or "offline"
+
+
+def status_from_dict(payload: dict[str, Any]) -> StatusPayload:
+    return decode_payload("status", msgspec.json.encode(payload))
+
+
+def telemetry_from_dict(payload: dict[str, Any]) -> TelemetryPayload:
+    return msgspec.convert(payload, TelemetryPayload, strict=False)
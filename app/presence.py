@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import logging
+import threading
+import time
+
+from sqlalchemy import update
+
+from .config import settings
+from .db import get_session
+from .fanout import event_fanout
+from .models import Device
+from .registry import DeviceMeta, device_registry
+
+logger = logging.getLogger("presence")
+
+MAX_SLEEP_SECONDS = 1.0
+TIMEOUT_REASON = "timeout"
+
+
+# Flags devices offline when their heartbeat deadline (last_seen_ts + timeout)
+# passes, or right away on an LWT/will/offline message. The heap holds at most
+# one entry per online device; a heartbeat only moves the deadline in a dict and
+# the stale heap entry is re-pushed when it surfaces, so a sweep costs
+# O(expired log n) rather than a scan of the fleet. Runs in the ingest worker.
+class PresenceMonitor:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._heap: list[tuple[int, str]] = []
+        self._queued: set[str] = set()
+        self._deadlines: dict[str, int] = {}
+        self._offline: set[str] = set()
+        self._forced: dict[str, str] = {}
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._wake: asyncio.Event | None = None
+        self._task: asyncio.Task[None] | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def start(self, loop: asyncio.AbstractEventLoop, devices: list[DeviceMeta]) -> None:
+        if self._task is not None:
+            return
+        with self._lock:
+            for meta in devices:
+                if meta.online:
+                    self._schedule(meta.id, meta.last_seen_ts)
+                else:
+                    self._offline.add(meta.id)
+        self._loop = loop
+        self._wake = asyncio.Event()
+        self._task = loop.create_task(self._run())
+        logger.info("presence monitor started devices=%s", len(devices))
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def beat(self, device_id: str, last_seen_ts: int) -> None:
+        with self._lock:
+            self._schedule(device_id, last_seen_ts)
+            self._forced.pop(device_id, None)
+            if device_id not in self._offline:
+                return
+            self._offline.discard(device_id)
+        self._publish({"type": "DEVICE_ONLINE", "deviceId": device_id, "payload": {"ts": int(time.time())}})
+
+    def force_offline(self, device_id: str, reason: str) -> None:
+        with self._lock:
+            self._forced[device_id] = reason
+        if self._loop is not None and self._wake is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    def _schedule(self, device_id: str, last_seen_ts: int) -> None:
+        deadline = last_seen_ts + settings.online_timeout_seconds + 1
+        if deadline <= self._deadlines.get(device_id, 0):
+            return
+        self._deadlines[device_id] = deadline
+        if device_id not in self._queued:
+            self._queued.add(device_id)
+            heapq.heappush(self._heap, (deadline, device_id))
+
+    def _collect(self, now: int) -> dict[str, str]:
+        changed: dict[str, str] = {}
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                deadline, device_id = heapq.heappop(self._heap)
+                self._queued.discard(device_id)
+                current = self._deadlines.get(device_id)
+                if current is None:
+                    continue
+                if current > deadline:
+                    self._queued.add(device_id)
+                    heapq.heappush(self._heap, (current, device_id))
+                    continue
+                del self._deadlines[device_id]
+                if device_id not in self._offline:
+                    self._offline.add(device_id)
+                    changed[device_id] = TIMEOUT_REASON
+            forced, self._forced = self._forced, {}
+            for device_id, reason in forced.items():
+                # Unknown ids have no deadline and are ignored. The stale heap entry is
+                # skipped (or re-pushed after a new heartbeat) when it surfaces.
+                if self._deadlines.pop(device_id, None) is not None:
+                    self._offline.add(device_id)
+                    changed[device_id] = reason
+        return changed
+
+    def _sleep_seconds(self, now: float) -> float:
+        with self._lock:
+            if not self._heap:
+                return MAX_SLEEP_SECONDS
+            return min(max(self._heap[0][0] - now, 0.0), MAX_SLEEP_SECONDS)
+
+    async def _run(self) -> None:
+        assert self._wake is not None
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self._sleep_seconds(time.time()))
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            changed = self._collect(int(time.time()))
+            if not changed:
+                continue
+            try:
+                await asyncio.to_thread(self._persist, list(changed))
+            except Exception:
+                logger.exception("failed to persist offline state for %s devices", len(changed))
+            now = int(time.time())
+            for device_id, reason in changed.items():
+                device_registry.set_offline(device_id, reason)
+                await event_fanout.publish(
+                    {"type": "DEVICE_OFFLINE", "deviceId": device_id, "payload": {"reason": reason, "ts": now}}
+                )
+            logger.info("marked %s devices offline", len(changed))
+
+    def _persist(self, device_ids: list[str]) -> None:
+        with get_session() as session:
+            session.execute(update(Device).where(Device.id.in_(device_ids)).values(online=False))
+
+    def _publish(self, payload: dict) -> None:
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(event_fanout.publish(payload), self._loop)
+
+
+presence_monitor = PresenceMonitor()
@@ -0,0 +1,214 @@
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable
+
+from fastapi.routing import APIRoute
+from starlette.routing import request_response
+
+from .config import settings
+
+logger = logging.getLogger("profiling")
+
+MAX_STACK_DEPTH = 128
+
+
+class RequestTiming:
+    __slots__ = ("db_seconds", "queries", "handler_seconds", "handler_ended")
+
+    def __init__(self) -> None:
+        self.db_seconds = 0.0
+        self.queries = 0
+        self.handler_seconds = 0.0
+        self.handler_ended = 0.0
+
+    def header(self, total_seconds: float, now: float) -> str:
+        parts = [f'db;dur={self.db_seconds * 1000.0:.2f};desc="{self.queries} queries"']
+        if self.handler_ended:
+            parts.append(f"handler;dur={self.handler_seconds * 1000.0:.2f}")
+            # Response model validation, encoding and rendering after the handler returned.
+            parts.append(f"serialize;dur={(now - self.handler_ended) * 1000.0:.2f}")
+        parts.append(f"total;dur={total_seconds * 1000.0:.2f}")
+        return ", ".join(parts)
+
+
+# Starlette copies the context into the threadpool, so sync handlers and the DB
+# hooks they trigger update the same RequestTiming.
+_timing: contextvars.ContextVar[RequestTiming | None] = contextvars.ContextVar("request_timing", default=None)
+
+
+def record_query(seconds: float) -> None:
+    timing = _timing.get()
+    if timing is not None:
+        timing.db_seconds += seconds
+        timing.queries += 1
+
+
+class ServerTimingMiddleware:
+    def __init__(self, app: Any) -> None:
+        self.app = app
+
+    async def __call__(self, scope: dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        timing = RequestTiming()
+        token = _timing.set(timing)
+        started = time.perf_counter()
+
+        async def send_wrapper(message: dict[str, Any]) -> None:
+            if message["type"] == "http.response.start":
+                now = time.perf_counter()
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", timing.header(now - started, now).encode("latin-1")))
+                # CORS is open, so let browser devtools on other origins read the header.
+                headers.append((b"timing-allow-origin", b"*"))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _timing.reset(token)
+
+
+# Samples the Python stack of threads running selected handlers and appends the
+# result to PROFILE_DIR in folded format ("frame;frame;frame count"), which
+# flamegraph.pl and speedscope read directly. Async handlers share the event loop
+# thread, so their samples include whatever else the loop ran meanwhile.
+class StackSampler:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._active: dict[int, list[Counter[str]]] = {}
+        self._thread: threading.Thread | None = None
+        self._write_lock = threading.Lock()
+
+    def begin(self) -> Counter[str]:
+        stacks: Counter[str] = Counter()
+        with self._lock:
+            self._active.setdefault(threading.get_ident(), []).append(stacks)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+                self._thread.start()
+        return stacks
+
+    def end(self, stacks: Counter[str], label: str) -> None:
+        ident = threading.get_ident()
+        with self._lock:
+            # Identity, not ==: two empty Counters compare equal.
+            active = [c for c in self._active.get(ident, []) if c is not stacks]
+            if active:
+                self._active[ident] = active
+            else:
+                self._active.pop(ident, None)
+        if stacks:
+            self._write(label, stacks)
+
+    def _run(self) -> None:
+        interval = settings.profile_interval_ms / 1000.0
+        own = threading.get_ident()
+        while True:
+            with self._lock:
+                if not self._active:
+                    self._thread = None
+                    return
+                idents = list(self._active)
+            frames = sys._current_frames()
+            folded = {ident: _fold(frames[ident]) for ident in idents if ident in frames and ident != own}
+            # Counters are only touched under the lock, so end() never sees one change.
+            with self._lock:
+                for ident, stack in folded.items():
+                    for stacks in self._active.get(ident, ()):
+                        stacks[stack] += 1
+            time.sleep(interval)
+
+    def _write(self, label: str, stacks: Counter[str]) -> None:
+        path = os.path.join(settings.profile_dir, f"{label}.folded")
+        lines = "".join(f"{stack} {count}\n" for stack, count in stacks.items())
+        try:
+            with self._write_lock:
+                os.makedirs(settings.profile_dir, exist_ok=True)
+                with open(path, "a", encoding="utf-8") as f:
+                    f.write(lines)
+        except OSError:
+            logger.exception("failed to write profile %s", path)
+
+
+def _fold(frame: Any) -> str:
+    names: list[str] = []
+    while frame is not None and len(names) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        names.append(f"{code.co_qualname}@{os.path.basename(code.co_filename)}:{code.co_firstlineno}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def _route_label(method: str, path: str) -> str:
+    return method + "_" + (re.sub(r"[^A-Za-z0-9]+", "_", path).strip("_") or "root")
+
+
+def _instrument(call: Callable[..., Any], label: str | None) -> Callable[..., Any]:
+    if asyncio.iscoroutinefunction(call):
+
+        @functools.wraps(call)
+        async def async_wrapper(**kwargs: Any) -> Any:
+            timing = _timing.get()
+            stacks = stack_sampler.begin() if label else None
+            started = time.perf_counter()
+            try:
+                return await call(**kwargs)
+            finally:
+                ended = time.perf_counter()
+                if stacks is not None:
+                    stack_sampler.end(stacks, label)
+                if timing is not None:
+                    timing.handler_seconds = ended - started
+                    timing.handler_ended = ended
+
+        return async_wrapper
+
+    @functools.wraps(call)
+    def sync_wrapper(**kwargs: Any) -> Any:
+        timing = _timing.get()
+        stacks = stack_sampler.begin() if label else None
+        started = time.perf_counter()
+        try:
+            return call(**kwargs)
+        finally:
+            ended = time.perf_counter()
+            if stacks is not None:
+                stack_sampler.end(stacks, label)
+            if timing is not None:
+                timing.handler_seconds = ended - started
+                timing.handler_ended = ended
+
+    return sync_wrapper
+
+
+# Route class used while profiling is on. The endpoint is wrapped after FastAPI
+# has read its signature, so parameters and string annotations resolve as usual.
+class ProfiledRoute(APIRoute):
+    def __init__(self, path: str, endpoint: Callable[..., Any], **kwargs: Any) -> None:
+        super().__init__(path, endpoint, **kwargs)
+        label = None
+        if self.path_format in settings.profile_routes:
+            label = _route_label("_".join(sorted(self.methods or ())), self.path_format)
+        if self.dependant.call is not None:
+            self.dependant.call = _instrument(self.dependant.call, label)
+            self.app = request_response(self.get_route_handler())
+
+
+def profiling_enabled() -> bool:
+    return settings.server_timing or bool(settings.profile_routes)
+
+
+stack_sampler = StackSampler()
@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import math
+import re
+import time
+from typing import Any, Callable
+
+from .config import settings
+from .metrics import http_rejected
+
+MAX_BUCKETS = 10_000
+SHED_RETRY_AFTER_SECONDS = 1
+
+# (method, path pattern, route class). Unlisted /api paths are only subject to
+# the concurrency limit.
+ROUTE_CLASSES = (
+    ("POST", re.compile(r"^/api/strips/[^/]+/(cmd|schedules)$"), "command"),
+    ("POST", re.compile(r"^/api/auth/login$"), "login"),
+    ("GET", re.compile(r"^/api/(telemetry|devices/[^/]+/energy|rooms/.+)$"), "telemetry"),
+    ("GET", re.compile(r"^/api/(devices|devices/[^/]+/status|cmd/[^/]+|strips/[^/]+/schedules|auth/me)$"), "status"),
+)
+
+
+def route_class(method: str, path: str) -> str:
+    for m, pattern, name in ROUTE_CLASSES:
+        if m == method and pattern.match(path):
+            return name
+    return ""
+
+
+def bucket_limits() -> dict[str, tuple[float, float]]:
+    # route class -> (tokens per second, burst); a rate of 0 disables that class.
+    limits = {
+        "telemetry": (settings.rate_limit_telemetry_per_second, settings.rate_limit_telemetry_burst),
+        "status": (settings.rate_limit_status_per_second, settings.rate_limit_status_burst),
+        "command": (settings.rate_limit_command_per_second, settings.rate_limit_command_burst),
+        "login": (settings.rate_limit_login_per_second, settings.rate_limit_login_burst),
+    }
+    return {name: (rate, max(burst, 1.0)) for name, (rate, burst) in limits.items() if rate > 0}
+
+
+# Token buckets per (route class, client address). Only touched from the event
+# loop, so no lock; keys are bounded like the login throttle.
+class RateLimiter:
+    def __init__(self, limits: dict[str, tuple[float, float]]) -> None:
+        self._limits = limits
+        self._buckets: dict[tuple[str, str], tuple[float, float]] = {}
+
+    def retry_after(self, cls: str, client: str, now: float) -> int:
+        limit = self._limits.get(cls)
+        if limit is None:
+            return 0
+        rate, burst = limit
+        key = (cls, client)
+        tokens, updated = self._buckets.pop(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        if len(self._buckets) >= MAX_BUCKETS:
+            del self._buckets[next(iter(self._buckets))]
+        if tokens >= 1.0:
+            self._buckets[key] = (tokens - 1.0, now)
+            return 0
+        self._buckets[key] = (tokens, now)
+        return max(math.ceil((1.0 - tokens) / rate), 1)
+
+
+# Per-client token buckets, then a global in-flight limit. Reads are shed once
+# API_MAX_INFLIGHT_READS requests are running; writes (commands, login, logout)
+# are admitted up to API_MAX_INFLIGHT, so polling dashboards cannot starve them.
+class AdmissionMiddleware:
+    def __init__(self, app: Any, reject: Callable[..., Any]) -> None:
+        self.app = app
+        self.reject = reject
+        self.limiter = RateLimiter(bucket_limits()) if settings.rate_limit_enabled else None
+        self.inflight = 0
+
+    async def __call__(self, scope: dict[str, Any], receive: Any, send: Any) -> None:
+        path = scope.get("path", "")
+        if scope["type"] != "http" or not path.startswith("/api/") or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+        method = scope["method"]
+        cls = route_class(method, path)
+        if self.limiter is not None and cls:
+            retry_after = self.limiter.retry_after(cls, self._client(scope), time.monotonic())
+            if retry_after:
+                http_rejected.inc("rate_limit", cls)
+                await self._reject(scope, receive, send, "RATE_LIMITED", "too many requests", retry_after)
+                return
+        limit = settings.api_max_inflight_reads if method in ("GET", "HEAD") else settings.api_max_inflight
+        if limit and self.inflight >= limit:
+            http_rejected.inc("overload", cls or "other")
+            await self._reject(scope, receive, send, "OVERLOADED", "server is busy", SHED_RETRY_AFTER_SECONDS)
+            return
+        self.inflight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.inflight -= 1
+
+    async def _reject(self, scope: dict[str, Any], receive: Any, send: Any, code: str, message: str, retry_after: int) -> None:
+        response = self.reject(
+            429, code, message, {"retryAfter": retry_after}, {"Retry-After": str(retry_after)}
+        )
+        await response(scope, receive, send)
+
+    @staticmethod
+    def _client(scope: dict[str, Any]) -> str:
+        if settings.rate_limit_trust_forwarded:
+            for name, value in scope.get("headers", ()):
+                if name == b"x-forwarded-for":
+                    return value.decode("latin-1").split(",")[0].strip()
+        client = scope.get("client")
+        return client[0] if client else ""
@@ -0,0 +1,238 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from dataclasses import dataclass
+
+from sqlalchemy import event, select, update
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .models import Device
+from .routing import topic_router
+
+logger = logging.getLogger("registry")
+
+DEFAULT_ROOM = "A-302"
+
+
+@dataclass(slots=True)
+class DeviceMeta:
+    id: str
+    name: str
+    room: str
+    last_seen_ts: int
+    online: bool = True
+    offline_reason: str | None = None
+
+
+# Process-wide id -> DeviceMeta map with a room -> ids index. Ingest updates it in
+# memory; new devices and heartbeat timestamps reach the database in batches via
+# flush(). Misses fall back to the database so workers that do not ingest (see
+# fanout) still find devices registered elsewhere. With several replicas, devices
+# ingested by another instance are only visible through the database, so
+# refresh() re-reads their last_seen/online state.
+class DeviceRegistry:
+    def __init__(self) -> None:
+        self._lock = threading.RLock()
+        self._devices: dict[str, DeviceMeta] = {}
+        self._rooms: dict[str, set[str]] = {}
+        self._new: set[str] = set()
+        self._dirty: set[str] = set()
+        self._last_flush = time.monotonic()
+        self._version = 0
+        self._reload = False
+        # Devices heartbeating through this process's own ingest.
+        self._local: set[str] = set()
+        self._replicated = bool(settings.mqtt_shared_group) or settings.mqtt_partition_count > 1
+        self._last_refresh = 0.0
+
+    @property
+    def version(self) -> int:
+        # Bumped on every change visible in the device list; used to version cached responses.
+        return self._version
+
+    @property
+    def needs_reload(self) -> bool:
+        return self._reload
+
+    def load(self, session: Session) -> None:
+        rows = session.scalars(select(Device)).all()
+        with self._lock:
+            self._devices.clear()
+            self._rooms.clear()
+            for row in rows:
+                self._index(DeviceMeta(row.id, row.name, row.room, row.last_seen_ts, row.online))
+            self._reload = False
+        topic_router.invalidate()
+        logger.info("device registry loaded %s devices", len(rows))
+
+    def get(self, session: Session, device_id: str) -> DeviceMeta | None:
+        meta = self._devices.get(device_id)
+        if meta is not None:
+            return meta
+        row = session.get(Device, device_id)
+        if row is None:
+            return None
+        with self._lock:
+            meta = self._devices.get(device_id)
+            if meta is None:
+                meta = DeviceMeta(row.id, row.name, row.room, row.last_seen_ts, row.online)
+                self._index(meta)
+        return meta
+
+    def exists(self, session: Session, device_id: str) -> bool:
+        return self.get(session, device_id) is not None
+
+    def room_devices(self, session: Session, room: str) -> list[str]:
+        # The MQTT thread adds to these sets; copy under the lock before sorting.
+        with self._lock:
+            ids = list(self._rooms.get(room, ()))
+        if ids:
+            return sorted(ids)
+        found = session.scalars(select(Device.id).where(Device.room == room)).all()
+        for device_id in found:
+            self.get(session, device_id)
+        return sorted(found)
+
+    @property
+    def refresh_due(self) -> bool:
+        return self._replicated and time.monotonic() - self._last_refresh >= settings.registry_flush_seconds
+
+    def refresh(self, session: Session) -> None:
+        # Replicas only, at most once per REGISTRY_FLUSH_SECONDS (the owners' write
+        # cadence). A DB row wins when it is at least as recent as memory, so an
+        # offline flip written by the owner's presence monitor is picked up too.
+        with self._lock:
+            if not self.refresh_due:
+                return
+            self._last_refresh = time.monotonic()
+        rows = session.execute(select(Device.id, Device.last_seen_ts, Device.online)).all()
+        missing: list[str] = []
+        with self._lock:
+            changed = False
+            for device_id, last_seen_ts, online in rows:
+                if device_id in self._local:
+                    continue
+                meta = self._devices.get(device_id)
+                if meta is None:
+                    missing.append(device_id)
+                    continue
+                if last_seen_ts < meta.last_seen_ts or (last_seen_ts == meta.last_seen_ts and online == meta.online):
+                    continue
+                meta.last_seen_ts = last_seen_ts
+                meta.online = online
+                meta.offline_reason = None
+                changed = True
+            if changed:
+                self._version += 1
+        for device_id in missing:
+            self.get(session, device_id)
+
+    def snapshot(self) -> list[DeviceMeta]:
+        with self._lock:
+            return [
+                DeviceMeta(m.id, m.name, m.room, m.last_seen_ts, m.online, m.offline_reason)
+                for _, m in sorted(self._devices.items())
+            ]
+
+    def seen(self, device_id: str, seen_ts: int) -> None:
+        # Heartbeat relayed from the ingesting worker; memory only, the owner persists it.
+        with self._lock:
+            meta = self._devices.get(device_id)
+            if meta is None:
+                self._reload = True
+            else:
+                meta.last_seen_ts = max(meta.last_seen_ts, seen_ts)
+                meta.online = True
+                meta.offline_reason = None
+            self._version += 1
+
+    def set_offline(self, device_id: str, reason: str) -> None:
+        with self._lock:
+            meta = self._devices.get(device_id)
+            if meta is None:
+                return
+            meta.online = False
+            meta.offline_reason = reason
+            self._version += 1
+
+    def rooms(self) -> dict[str, str]:
+        with self._lock:
+            return {device_id: meta.room for device_id, meta in self._devices.items()}
+
+    def touch(self, session: Session, device_id: str, seen_ts: int) -> DeviceMeta:
+        meta = self._devices.get(device_id)
+        if meta is None:
+            meta = self.get(session, device_id)
+        room, display_name = topic_router.device_meta(device_id)
+        with self._lock:
+            self._local.add(device_id)
+            if meta is None:
+                meta = DeviceMeta(device_id, display_name, room, seen_ts, True)
+                self._index(meta)
+                self._new.add(device_id)
+            else:
+                changed = False
+                if meta.room == DEFAULT_ROOM and room != DEFAULT_ROOM:
+                    self._rooms.get(meta.room, set()).discard(device_id)
+                    meta.room = room
+                    self._rooms.setdefault(room, set()).add(device_id)
+                    changed = True
+                if meta.name.startswith("DormDevice-") and display_name:
+                    meta.name = display_name
+                    changed = True
+                if changed:
+                    topic_router.invalidate(device_id)
+                meta.last_seen_ts = max(meta.last_seen_ts, seen_ts)
+                meta.online = int(time.time()) - meta.last_seen_ts <= settings.online_timeout_seconds
+                meta.offline_reason = None
+                self._dirty.add(device_id)
+            self._version += 1
+            # New devices are written right away so other workers can resolve them.
+            due = bool(self._new) or time.monotonic() - self._last_flush >= settings.registry_flush_seconds
+        if due:
+            self.flush(session)
+        return meta
+
+    def flush(self, session: Session) -> None:
+        with self._lock:
+            new, self._new = self._new, set()
+            dirty, self._dirty = self._dirty - new, set()
+            self._last_flush = time.monotonic()
+            added = [self._devices[d] for d in new if d in self._devices]
+            changes = [
+                {
+                    "id": meta.id,
+                    "name": meta.name,
+                    "room": meta.room,
+                    "last_seen_ts": meta.last_seen_ts,
+                    "online": meta.online,
+                }
+                for meta in (self._devices[d] for d in dirty if d in self._devices)
+            ]
+        if not added and not changes:
+            return
+
+        session.add_all(
+            Device(id=m.id, name=m.name, room=m.room, online=m.online, last_seen_ts=m.last_seen_ts) for m in added
+        )
+        if changes:
+            # ORM bulk UPDATE by primary key: one executemany for the whole batch.
+            session.execute(update(Device), changes)
+
+        def requeue(_session: Session) -> None:
+            with self._lock:
+                self._new.update(m.id for m in added)
+                self._dirty.update(c["id"] for c in changes)
+
+        event.listen(session, "after_rollback", requeue, once=True)
+
+    def _index(self, meta: DeviceMeta) -> None:
+        self._devices[meta.id] = meta
+        self._rooms.setdefault(meta.room, set()).add(meta.id)
+        self._version += 1
+
+
+device_registry = DeviceRegistry()
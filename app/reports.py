@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+from .config import settings
+from .db import get_session
+from .services import ai_report
+
+logger = logging.getLogger("reports")
+
+
+# Serves room reports from memory. Entries older than the TTL are still returned
+# while a single background thread recomputes them; only a missing or very stale
+# entry makes the caller wait for the aggregate queries.
+class ReportCache:
+    def __init__(self) -> None:
+        self._entries: dict[tuple[str, str], tuple[float, dict[str, Any]]] = {}
+        self._refreshing: set[tuple[str, str]] = set()
+        self._building: dict[tuple[str, str], threading.Event] = {}
+        self._lock = threading.Lock()
+        self._executor: ThreadPoolExecutor | None = None
+
+    def get(self, room_id: str, period: str) -> dict[str, Any]:
+        key = (room_id, period)
+        while True:
+            entry = self._entries.get(key)
+            if entry is not None:
+                age = time.monotonic() - entry[0]
+                if age < settings.report_cache_ttl_seconds:
+                    return entry[1]
+                if age < settings.report_cache_max_stale_seconds:
+                    self._schedule_refresh(key)
+                    return entry[1]
+            # Single flight: concurrent callers of a cold key wait for one build.
+            with self._lock:
+                pending = self._building.get(key)
+                if pending is None:
+                    pending = self._building[key] = threading.Event()
+                    break
+            pending.wait()
+        try:
+            return self._refresh(key)
+        finally:
+            with self._lock:
+                del self._building[key]
+            pending.set()
+
+    def invalidate(self, room_id: str | None = None) -> None:
+        with self._lock:
+            if room_id is None:
+                self._entries.clear()
+                return
+            for key in [k for k in self._entries if k[0] == room_id]:
+                self._entries.pop(key, None)
+
+    def stop(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _refresh(self, key: tuple[str, str]) -> dict[str, Any]:
+        with get_session() as session:
+            result = ai_report(session, key[0], key[1])
+        with self._lock:
+            self._entries[key] = (time.monotonic(), result)
+        return result
+
+    def _schedule_refresh(self, key: tuple[str, str]) -> None:
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="report-refresh")
+            self._executor.submit(self._refresh_background, key)
+
+    def _refresh_background(self, key: tuple[str, str]) -> None:
+        try:
+            self._refresh(key)
+        except Exception:
+            logger.exception("report refresh failed room=%s period=%s", key[0], key[1])
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+
+report_cache = ReportCache()
@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+import gzip
+import threading
+import time
+from typing import Any, Callable, Hashable
+
+import msgspec
+from fastapi import Response
+
+try:
+    import brotli  # type: ignore[import-not-found]
+except ImportError:
+    brotli = None
+
+from .config import settings
+
+# Bodies smaller than this are sent as-is; the headers would eat most of the gain.
+MIN_COMPRESS_BYTES = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def _compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+# Serialized JSON plus its compressed variants, each produced at most once.
+class EncodedBody:
+    __slots__ = ("raw", "etag", "_variants")
+
+    def __init__(self, raw: bytes, etag: str = "") -> None:
+        self.raw = raw
+        self.etag = etag
+        self._variants: dict[str, bytes] = {}
+
+    def variant(self, encoding: str) -> bytes:
+        if not encoding:
+            return self.raw
+        data = self._variants.get(encoding)
+        if data is None:
+            data = self._variants[encoding] = _compress(self.raw, encoding)
+        return data
+
+
+def negotiate_encoding(accept_encoding: str | None, size: int) -> str:
+    if not accept_encoding or size < MIN_COMPRESS_BYTES:
+        return ""
+    offered: set[str] = set()
+    for item in accept_encoding.lower().split(","):
+        name, _, params = item.strip().partition(";")
+        if params.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        offered.add(name.strip())
+    if brotli is not None and "br" in offered:
+        return "br"
+    if "gzip" in offered or "*" in offered:
+        return "gzip"
+    return ""
+
+
+def encoded_response(
+    body: EncodedBody,
+    accept_encoding: str | None,
+    headers: dict[str, str] | None = None,
+) -> Response:
+    encoding = negotiate_encoding(accept_encoding, len(body.raw))
+    out = {"Vary": "Accept-Encoding", **(headers or {})}
+    if encoding:
+        out["Content-Encoding"] = encoding
+        if body.etag:
+            # Compressed bytes differ from the identity ones, so the tag becomes weak.
+            out["ETag"] = "W/" + body.etag
+    elif body.etag:
+        out["ETag"] = body.etag
+    return Response(content=body.variant(encoding), media_type="application/json", headers=out)
+
+
+def json_response(data: Any, accept_encoding: str | None = None) -> Response:
+    # msgspec instead of FastAPI's jsonable_encoder + pydantic round trip.
+    return encoded_response(EncodedBody(msgspec.json.encode(data)), accept_encoding)
+
+
+# Bounded TTL cache of encoded bodies with single flight: concurrent misses on
+# one key wait for the first caller instead of repeating the computation.
+class ResponseCache:
+    def __init__(self, max_size: int, ttl_seconds: float) -> None:
+        self._max_size = max(max_size, 1)
+        self._ttl = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries: dict[Hashable, tuple[float, EncodedBody]] = {}
+        self._building: dict[Hashable, threading.Event] = {}
+
+    def get_or_build(self, key: Hashable, build: Callable[[], bytes]) -> EncodedBody:
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and time.monotonic() < entry[0]:
+                    return entry[1]
+                pending = self._building.get(key)
+                if pending is None:
+                    pending = self._building[key] = threading.Event()
+                    break
+            pending.wait()
+        try:
+            body = EncodedBody(build())
+            with self._lock:
+                self._entries.pop(key, None)
+                if len(self._entries) >= self._max_size:
+                    del self._entries[next(iter(self._entries))]
+                self._entries[key] = (time.monotonic() + self._ttl, body)
+            return body
+        finally:
+            with self._lock:
+                del self._building[key]
+            pending.set()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+telemetry_responses = ResponseCache(settings.telemetry_cache_size, settings.telemetry_cache_ttl_seconds)
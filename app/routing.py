@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+import re
+import sys
+import threading
+from typing import NamedTuple
+
+from .config import settings
+
+MESSAGE_TYPES = ("status", "telemetry", "ack", "event")
+# Last-will / explicit offline notices; the payload is JSON or plain text.
+OFFLINE_TYPES = ("lwt", "will", "offline")
+TOPIC_TYPES = MESSAGE_TYPES + OFFLINE_TYPES
+
+ROOM_PATTERN = re.compile(r"^[A-Za-z]-?\d{2,4}$")
+LEGACY_DEVICE_PATTERN = re.compile(r"^([A-Za-z]-?\d{2,4})[-_](.+)$")
+
+
+class Route(NamedTuple):
+    device_id: str
+    msg_type: str
+    room: str
+    name: str
+
+
+def parse_device_meta(device_id: str) -> tuple[str, str]:
+    normalized = " ".join(device_id.strip().split())
+    if not normalized:
+        return "A-302", "unknown"
+
+    chunks = normalized.split(" ", 1)
+    if len(chunks) == 2 and ROOM_PATTERN.match(chunks[0]):
+        room, name = chunks[0], chunks[1].strip()
+        return room, name or normalized
+
+    legacy_match = LEGACY_DEVICE_PATTERN.match(normalized)
+    if legacy_match:
+        room = legacy_match.group(1).strip()
+        name = legacy_match.group(2).strip()
+        return room, name or normalized
+
+    if ROOM_PATTERN.match(normalized):
+        return normalized, normalized
+
+    return "A-302", normalized
+
+
+def parse_topic(topic: str, prefix_parts: list[str]) -> tuple[str, str] | None:
+    topic_parts = [p for p in topic.strip("/").split("/") if p]
+    if len(topic_parts) < len(prefix_parts) + 2:
+        return None
+    if topic_parts[: len(prefix_parts)] != prefix_parts:
+        return None
+
+    tail = topic_parts[len(prefix_parts) :]
+    msg_type = tail[-1]
+    if msg_type not in TOPIC_TYPES:
+        return None
+
+    device_parts = [p.strip() for p in tail[:-1] if p.strip()]
+    if not device_parts:
+        return None
+
+    if len(device_parts) == 1:
+        token = " ".join(device_parts[0].split())
+        return token, msg_type
+
+    if len(device_parts) == 2:
+        room = " ".join(device_parts[0].split())
+        dev = " ".join(device_parts[1].split())
+        if room and dev:
+            return f"{room} {dev}", msg_type
+        return " ".join([x for x in (room, dev) if x]), msg_type
+
+    return " ".join(device_parts), msg_type
+
+
+# Raw topic -> Route, plus device id -> (room, name) and device id -> cmd topics.
+# Each map is bounded; when full the oldest entry is dropped (dicts keep insertion
+# order), so a stream of bogus topics cannot grow memory.
+class TopicRouter:
+    def __init__(self, max_size: int) -> None:
+        self._max_size = max(max_size, 1)
+        self._lock = threading.Lock()
+        self._prefix = ""
+        self._prefix_parts: list[str] = []
+        self._routes: dict[str, Route | None] = {}
+        self._meta: dict[str, tuple[str, str]] = {}
+        self._cmd_topics: dict[str, tuple[str, ...]] = {}
+        self.set_prefix(settings.mqtt_topic_prefix)
+
+    @property
+    def prefix(self) -> str:
+        return self._prefix
+
+    def set_prefix(self, prefix: str) -> None:
+        with self._lock:
+            self._prefix = prefix.strip("/")
+            self._prefix_parts = [p for p in self._prefix.split("/") if p]
+            self._routes.clear()
+            self._cmd_topics.clear()
+
+    def invalidate(self, device_id: str | None = None) -> None:
+        with self._lock:
+            if device_id is None:
+                self._routes.clear()
+                self._meta.clear()
+                self._cmd_topics.clear()
+                return
+            self._meta.pop(device_id, None)
+            self._cmd_topics.pop(device_id, None)
+            for topic in [t for t, r in self._routes.items() if r is not None and r.device_id == device_id]:
+                del self._routes[topic]
+
+    def route(self, topic: str) -> Route | None:
+        try:
+            return self._routes[topic]
+        except KeyError:
+            pass
+        parsed = parse_topic(topic, self._prefix_parts)
+        route = None
+        if parsed is not None:
+            device_id = sys.intern(parsed[0])
+            room, name = self.device_meta(device_id)
+            route = Route(device_id, parsed[1], room, name)
+        with self._lock:
+            self._put(self._routes, topic, route)
+        return route
+
+    def device_meta(self, device_id: str) -> tuple[str, str]:
+        meta = self._meta.get(device_id)
+        if meta is None:
+            meta = parse_device_meta(device_id)
+            with self._lock:
+                self._put(self._meta, device_id, meta)
+        return meta
+
+    def cmd_topics(self, device_id: str) -> tuple[str, ...]:
+        topics = self._cmd_topics.get(device_id)
+        if topics is None:
+            candidates = [f"{self._prefix}/{device_id}/cmd"]
+            chunks = [x for x in device_id.split(" ", 1) if x]
+            if len(chunks) == 2:
+                candidates.append(f"{self._prefix}/{chunks[0]}/{chunks[1]}/cmd")
+            topics = tuple(dict.fromkeys(candidates))
+            with self._lock:
+                self._put(self._cmd_topics, device_id, topics)
+        return topics
+
+    def _put(self, cache: dict, key: str, value: object) -> None:
+        if key not in cache and len(cache) >= self._max_size:
+            del cache[next(iter(cache))]
+        cache[key] = value
+
+
+topic_router = TopicRouter(settings.route_cache_size)
@@ -0,0 +1,288 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import json
+import logging
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any
+
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session
+
+from .commands import CmdRejected, announce_unpublished, submit_cmd
+from .config import settings
+from .db import get_session
+from .models import CommandSchedule
+from .schemas import CmdRequest, ScheduleRequest
+
+logger = logging.getLogger("scheduler")
+
+MAX_SLEEP_SECONDS = 60.0
+MAX_SCHEDULES_PER_DEVICE = 32
+
+
+def next_daily(time_of_day: str, after: int) -> int:
+    # Next HH:MM in server local time strictly after `after`.
+    hour, minute = (int(x) for x in time_of_day.split(":"))
+    run = datetime.fromtimestamp(after).replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if run.timestamp() <= after:
+        run += timedelta(days=1)
+    return int(run.timestamp())
+
+
+def next_run_after(row: CommandSchedule, due: int, now: int) -> int | None:
+    if row.repeat == "daily":
+        return next_daily(row.time_of_day, max(due, now))
+    if row.repeat == "interval":
+        # Occurrences missed while the backend was down are skipped, not replayed.
+        return due + row.interval_seconds * ((max(now - due, 0) // row.interval_seconds) + 1)
+    return None
+
+
+def create_schedule(session: Session, device_id: str, req: ScheduleRequest) -> CommandSchedule:
+    now = int(time.time())
+    if req.daily is not None:
+        if req.runAt is not None or req.intervalSeconds is not None:
+            raise ValueError("daily cannot be combined with runAt or intervalSeconds")
+        repeat, next_run = "daily", next_daily(req.daily, now)
+    elif req.intervalSeconds is not None:
+        repeat, next_run = "interval", req.runAt if req.runAt is not None else now + req.intervalSeconds
+    elif req.runAt is not None:
+        repeat, next_run = "once", req.runAt
+    else:
+        raise ValueError("one of runAt, daily or intervalSeconds is required")
+    if next_run <= now:
+        raise ValueError("runAt must be in the future")
+    existing = session.scalar(select(func.count()).select_from(CommandSchedule).where(CommandSchedule.device_id == device_id))
+    if (existing or 0) >= MAX_SCHEDULES_PER_DEVICE:
+        raise ValueError(f"at most {MAX_SCHEDULES_PER_DEVICE} schedules per device")
+
+    cmd = CmdRequest(socket=req.socket, action=req.action, mode=req.mode, duration=req.duration, payload=req.payload)
+    row = CommandSchedule(
+        id=f"sch_{now}_{uuid.uuid4().hex[:8]}",
+        device_id=device_id,
+        socket=req.socket,
+        action=req.action,
+        payload_json=json.dumps(cmd.model_dump(), ensure_ascii=False),
+        repeat=repeat,
+        time_of_day=req.daily or "",
+        interval_seconds=req.intervalSeconds or 0,
+        enabled=True,
+        next_run_at=next_run,
+        created_at=now,
+        updated_at=now,
+    )
+    session.add(row)
+    return row
+
+
+def list_schedules(session: Session, device_id: str) -> list[CommandSchedule]:
+    return list(
+        session.scalars(
+            select(CommandSchedule)
+            .where(CommandSchedule.device_id == device_id)
+            .order_by(CommandSchedule.created_at.asc())
+        ).all()
+    )
+
+
+def schedule_out(row: CommandSchedule) -> dict[str, Any]:
+    cmd = json.loads(row.payload_json)
+    return {
+        "id": row.id,
+        "deviceId": row.device_id,
+        "socket": row.socket,
+        "action": row.action,
+        "mode": cmd.get("mode"),
+        "duration": cmd.get("duration"),
+        "payload": cmd.get("payload") or {},
+        "repeat": row.repeat,
+        "daily": row.time_of_day or None,
+        "intervalSeconds": row.interval_seconds or None,
+        "enabled": row.enabled,
+        "nextRunAt": row.next_run_at,
+        "lastRunAt": row.last_run_at,
+        "lastCmdId": row.last_cmd_id or None,
+        "lastResult": row.last_result or None,
+        "createdAt": row.created_at,
+    }
+
+
+# Fires scheduled commands through submit_cmd. The heap holds one live entry per
+# enabled schedule, keyed by its next run time; deletions and reschedules only
+# change the _next dict and stale entries are dropped when they surface, so idle
+# schedules cost nothing between firings. Runs in the ingest worker; schedules
+# written or deleted by other workers are merged every SCHEDULER_SYNC_SECONDS. Each
+# occurrence is claimed with a conditional UPDATE on next_run_at, so several
+# instances never fire it twice.
+class CommandScheduler:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._heap: list[tuple[int, str]] = []
+        self._next: dict[str, int] = {}
+        self._synced_at = 0.0
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._wake: asyncio.Event | None = None
+        self._task: asyncio.Task[None] | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    @property
+    def scheduled(self) -> int:
+        with self._lock:
+            return len(self._next)
+
+    def start(self, loop: asyncio.AbstractEventLoop) -> None:
+        if self._task is not None:
+            return
+        self._loop = loop
+        self._wake = asyncio.Event()
+        self._task = loop.create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def add(self, schedule_id: str, next_run_at: int | None) -> None:
+        # Other workers leave new rows to the ingest worker's next _sync.
+        if self._task is None:
+            return
+        with self._lock:
+            if next_run_at is None:
+                self._next.pop(schedule_id, None)
+            else:
+                self._push(schedule_id, next_run_at)
+        self._wakeup()
+
+    def discard(self, schedule_id: str) -> None:
+        with self._lock:
+            self._next.pop(schedule_id, None)
+
+    def _wakeup(self) -> None:
+        if self._loop is not None and self._wake is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    def _push(self, schedule_id: str, run_at: int) -> None:
+        if self._next.get(schedule_id) == run_at:
+            return
+        self._next[schedule_id] = run_at
+        heapq.heappush(self._heap, (run_at, schedule_id))
+
+    def _due(self, now: int) -> list[tuple[str, int]]:
+        due: list[tuple[str, int]] = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                run_at, schedule_id = heapq.heappop(self._heap)
+                if self._next.get(schedule_id) != run_at:
+                    continue
+                del self._next[schedule_id]
+                due.append((schedule_id, run_at))
+        return due
+
+    def _sleep_seconds(self, now: float) -> float:
+        until_sync = self._synced_at + settings.scheduler_sync_seconds - now
+        with self._lock:
+            until_due = self._heap[0][0] - now if self._heap else MAX_SLEEP_SECONDS
+        return min(max(min(until_due, until_sync), 0.0), MAX_SLEEP_SECONDS)
+
+    def _sync(self) -> None:
+        # Reads every schedule's (enabled, next_run_at): schedules created, changed
+        # or deleted by other workers all show up, with no timestamp window to
+        # miss. Ids tracked before the read and now gone were deleted elsewhere.
+        with self._lock:
+            known = set(self._next)
+        with get_session() as session:
+            rows = session.execute(
+                select(CommandSchedule.id, CommandSchedule.enabled, CommandSchedule.next_run_at)
+            ).all()
+        with self._lock:
+            for schedule_id, enabled, next_run_at in rows:
+                known.discard(schedule_id)
+                if enabled and next_run_at is not None:
+                    self._push(schedule_id, next_run_at)
+                else:
+                    self._next.pop(schedule_id, None)
+            for schedule_id in known:
+                self._next.pop(schedule_id, None)
+        if not self._synced_at:
+            logger.info("command scheduler started schedules=%s", self.scheduled)
+        self._synced_at = time.time()
+
+    async def _run(self) -> None:
+        assert self._wake is not None
+        while True:
+            if time.time() - self._synced_at >= settings.scheduler_sync_seconds:
+                try:
+                    await asyncio.to_thread(self._sync)
+                except Exception:
+                    logger.exception("schedule sync failed")
+            try:
+                await asyncio.wait_for(self._wake.wait(), self._sleep_seconds(time.time()))
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            for schedule_id, run_at in self._due(int(time.time())):
+                try:
+                    await self._fire(schedule_id, run_at)
+                except Exception:
+                    logger.exception("schedule %s failed", schedule_id)
+
+    async def _fire(self, schedule_id: str, due: int) -> None:
+        fired = await asyncio.to_thread(self._claim_and_submit, schedule_id, due)
+        if fired is None:
+            return
+        cmd_id, published, next_run = fired
+        if next_run is not None:
+            with self._lock:
+                self._push(schedule_id, next_run)
+        if cmd_id and not published:
+            await announce_unpublished(cmd_id)
+
+    def _claim_and_submit(self, schedule_id: str, due: int) -> tuple[str, bool, int | None] | None:
+        now = int(time.time())
+        with get_session() as session:
+            row = session.get(CommandSchedule, schedule_id)
+            if row is None or not row.enabled or row.next_run_at != due:
+                return None
+            next_run = next_run_after(row, due, now)
+            claimed = session.execute(
+                update(CommandSchedule)
+                .where(CommandSchedule.id == schedule_id, CommandSchedule.next_run_at == due)
+                .values(next_run_at=next_run, enabled=next_run is not None, last_run_at=now, updated_at=now)
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            if not claimed:
+                return None
+            device_id = row.device_id
+            req = CmdRequest(**json.loads(row.payload_json))
+
+        # The claim is committed; from here this occurrence fires at most once.
+        cmd_id, published = "", False
+        if now - due > settings.schedule_misfire_grace_seconds:
+            result = "missed"
+        else:
+            try:
+                cmd, published = submit_cmd(device_id, req, "schedule")
+                cmd_id = cmd.cmd_id
+                result = "sent" if published else "mqtt_unavailable"
+            except CmdRejected as exc:
+                result = exc.code.lower()
+        with get_session() as session:
+            session.execute(
+                update(CommandSchedule)
+                .where(CommandSchedule.id == schedule_id)
+                .values(last_cmd_id=cmd_id, last_result=result)
+                .execution_options(synchronize_session=False)
+            )
+        logger.info("schedule %s fired device=%s result=%s", schedule_id, device_id, result)
+        return cmd_id, published, next_run
+
+
+command_scheduler = CommandScheduler()
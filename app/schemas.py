@@ -18,6 +18,7 @@ class DeviceOut(BaseModel):
     room: str
     online: bool
     lastSeen: str
+    offlineReason: str | None = None
 
 
 class StripStatusOut(BaseModel):
@@ -42,6 +43,33 @@ class CmdRequest(BaseModel):
     payload: dict[str, Any] = Field(default_factory=dict)
 
 
+class ScheduleRequest(CmdRequest):
+    # One-shot at runAt, daily at HH:MM (server local time), or every
+    # intervalSeconds starting at runAt (default: one interval from now).
+    runAt: int | None = None
+    daily: str | None = Field(None, pattern=r"^([01][0-9]|2[0-3]):[0-5][0-9]$")
+    intervalSeconds: int | None = Field(None, ge=60)
+
+
+class ScheduleOut(BaseModel):
+    id: str
+    deviceId: str
+    socket: int | None = None
+    action: str
+    mode: str | None = None
+    duration: str | None = None
+    payload: dict[str, Any] = Field(default_factory=dict)
+    repeat: Literal["once", "daily", "interval"]
+    daily: str | None = None
+    intervalSeconds: int | None = None
+    enabled: bool
+    nextRunAt: int | None = None
+    lastRunAt: int | None = None
+    lastCmdId: str | None = None
+    lastResult: str | None = None
+    createdAt: int
+
+
 class CmdSubmitOut(BaseModel):
     ok: bool
     cmdId: str
@@ -57,12 +85,66 @@ class CmdStateOut(BaseModel):
     durationMs: int | None = None
 
 
+class LoadProfilePoint(BaseModel):
+    hour: int
+    avg_power_w: float
+
+
+class DailyLoadOut(BaseModel):
+    date: str
+    avg_power_w: float
+    peak_power_w: float
+    energy_kwh: float
+
+
 class AIReportOut(BaseModel):
     room_id: str
     period: str
     summary: str
     anomalies: list[str]
     suggestions: list[str]
+    baseline_power_w: float = 0.0
+    peak_power_w: float = 0.0
+    peak_window: str = ""
+    hourly_profile: list[LoadProfilePoint] = Field(default_factory=list)
+    daily_profile: list[DailyLoadOut] = Field(default_factory=list)
+    generated_at: int = 0
+
+
+class EnergyPointOut(BaseModel):
+    ts: int
+    energy_kwh: float
+
+
+class SocketEnergyOut(BaseModel):
+    socket: int
+    energy_kwh: float
+
+
+class DeviceEnergyOut(BaseModel):
+    device_id: str
+    period: str
+    energy_kwh: float
+    sockets: list[SocketEnergyOut]
+    series: list[EnergyPointOut]
+
+
+class DeviceEnergySummaryOut(BaseModel):
+    device_id: str
+    energy_kwh: float
+
+
+class RoomEnergyOut(BaseModel):
+    room_id: str
+    period: str
+    energy_kwh: float
+    devices: list[DeviceEnergySummaryOut]
+    series: list[EnergyPointOut]
+
+
+class RoomEnergyRankOut(BaseModel):
+    room_id: str
+    energy_kwh: float
 
 
 class AuthLoginRequest(BaseModel):
@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from typing import Callable, Generic, Hashable, Iterable, TypeVar
+
+from .config import settings
+
+T = TypeVar("T")
+
+# Rows are stamped with server receive time but can commit slightly later than a
+# newer row from another session; re-reading this far behind the newest cached
+# sample picks them up.
+LATE_ROW_SECONDS = 5
+
+
+class _Entry(Generic[T]):
+    __slots__ = ("buckets", "last_ts")
+
+    def __init__(self) -> None:
+        # bucket index -> (ts, value) of the newest sample in that bucket.
+        self.buckets: dict[int, tuple[int, T]] = {}
+        self.last_ts = 0
+
+
+# Chart series aligned to the range step: one real sample (the newest) per
+# bucket. Closed buckets never change, so a cached series is brought up to date
+# by reading only the rows after its newest sample, whichever process wrote
+# them. Entries are kept in LRU order per (mode, device, range).
+class SeriesCache(Generic[T]):
+    def __init__(self, max_entries: int) -> None:
+        self._max_entries = max(max_entries, 1)
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[Hashable, _Entry[T]] = OrderedDict()
+
+    def series(
+        self,
+        key: Hashable,
+        step: int,
+        points: int,
+        now_ts: int,
+        fetch: Callable[[int, int], Iterable[tuple[int, T]]],
+    ) -> list[tuple[int, T]]:
+        first_bucket = now_ts // step - points + 1
+        start_ts = first_bucket * step
+        with self._lock:
+            entry = self._entries.get(key)
+            since = start_ts if entry is None else max(start_ts, entry.last_ts - LATE_ROW_SECONDS)
+
+        rows = fetch(since, now_ts)
+
+        with self._lock:
+            # Merge into whatever is cached now; an entry evicted or replaced
+            # meanwhile still holds the history the tail read relied on.
+            entry = self._entries.get(key) or entry or _Entry()
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            if len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+            buckets = entry.buckets
+            for ts, value in rows:
+                bucket = ts // step
+                current = buckets.get(bucket)
+                if current is None or ts >= current[0]:
+                    buckets[bucket] = (ts, value)
+                if ts > entry.last_ts:
+                    entry.last_ts = ts
+            for bucket in [b for b in buckets if b < first_bucket]:
+                del buckets[bucket]
+            return [buckets[b] for b in sorted(buckets)]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+telemetry_series: SeriesCache = SeriesCache(settings.telemetry_series_cache_size)
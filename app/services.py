@@ -1,21 +1,32 @@
 ﻿from __future__ import annotations
 
 import json
-import hashlib
-import hmac
-import re
-import secrets
+import math
+import struct
 import time
 import uuid
 from datetime import datetime, timezone
-from typing import Any
+from typing import Any, Sequence, TypeVar
 
+import msgspec
 from sqlalchemy import and_, select
 from sqlalchemy.orm import Session
 
+from .auth import hash_password, verify_password
 from .config import settings
-from .models import CommandRecord, Device, StripStatus, Telemetry, UserAccount
-from .schemas import CmdRequest, CmdStateOut, SocketStatus
+from .energy import STRIP_TOTAL, energy_meter
+from .models import CommandRecord, Device, SocketTelemetry, StripSocket, StripStatus, UserAccount
+from .payloads import SocketPayload, StatusPayload, TelemetryPayload
+from .presence import presence_monitor
+from .registry import DeviceMeta, device_registry
+from .schemas import CmdRequest, CmdStateOut
+from .series import telemetry_series
+from .tsstore import telemetry_store
+
+T = TypeVar("T")
+
+# Socket ids map to bit positions of SocketTelemetry.on_mask (a 32-bit column).
+MAX_SOCKET_ID = 31
 
 RANGE_CONFIG = {
     "60s": {"points": 60, "step": 1},
@@ -49,56 +60,46 @@ def ensure_seed_data(session: Session) -> None:
         total_power_w=0.0,
         voltage_v=220.0,
         current_a=0.0,
-        sockets_json=json.dumps(
-            [
-                {"id": 1, "on": False, "power_w": 0.0, "device": "None"},
-                {"id": 2, "on": False, "power_w": 0.0, "device": "None"},
-                {"id": 3, "on": False, "power_w": 0.0, "device": "None"},
-                {"id": 4, "on": False, "power_w": 0.0, "device": "None"},
-            ],
-            ensure_ascii=False,
-        ),
     )
     session.add(device)
     session.add(status)
+    for sid in (1, 2, 3, 4):
+        session.add(StripSocket(device_id="strip01", socket_id=sid, on=False, power_w=0.0, device="None"))
 
 
-def _hash_secret(secret: str, salt: str, iterations: int = 160_000) -> str:
-    digest = hashlib.pbkdf2_hmac("sha256", secret.encode("utf-8"), salt.encode("utf-8"), iterations)
-    return digest.hex()
-
-
-def hash_password(password: str) -> str:
-    iterations = 160_000
-    salt = secrets.token_hex(16)
-    digest = _hash_secret(password, salt, iterations)
-    return f"pbkdf2_sha256${iterations}${salt}${digest}"
-
-
-def verify_password(password: str, encoded: str) -> bool:
-    try:
-        algo, iterations_str, salt, digest = encoded.split("$", 3)
-        if algo != "pbkdf2_sha256":
-            return False
-        calc = _hash_secret(password, salt, int(iterations_str))
-        return hmac.compare_digest(calc, digest)
-    except Exception:
-        return False
-
-
-def login_user(session: Session, account: str, password: str) -> UserAccount | None:
+def migrate_legacy_sockets(session: Session) -> None:
+    # One-off copy of sockets_json blobs written by older releases into strip_sockets.
+    legacy = session.scalars(select(StripStatus).where(StripStatus.sockets_json != "[]")).all()
+    for status in legacy:
+        try:
+            items = json.loads(status.sockets_json)
+        except Exception:
+            items = []
+        if session.scalar(select(StripSocket.socket_id).where(StripSocket.device_id == status.device_id).limit(1)) is None:
+            for item in items if isinstance(items, list) else []:
+                try:
+                    socket = msgspec.convert(item, SocketPayload, strict=False)
+                except msgspec.ValidationError:
+                    continue
+                session.add(
+                    StripSocket(
+                        device_id=status.device_id,
+                        socket_id=socket.id,
+                        on=socket.on,
+                        power_w=socket.power_w,
+                        device=socket.device,
+                    )
+                )
+        status.sockets_json = "[]"
+
+
+def find_login_user(session: Session, account: str) -> UserAccount | None:
     normalized = account.strip()
     admin_username = settings.admin_username.strip() or "admin"
     admin_email = settings.admin_email.strip().lower() or "admin@dorm.local"
     if normalized not in {admin_username, admin_email}:
         return None
-    user = session.get(UserAccount, admin_username)
-    if user is None:
-        return None
-    if not verify_password(password, user.password_hash):
-        return None
-    user.updated_at = int(time.time())
-    return user
+    return session.get(UserAccount, admin_username)
 
 
 def ensure_default_admin(session: Session) -> None:
@@ -134,88 +135,21 @@ def ensure_default_admin(session: Session) -> None:
         user.updated_at = now
 
 
-ROOM_PATTERN = re.compile(r"^[A-Za-z]-?\d{2,4}$")
-LEGACY_DEVICE_PATTERN = re.compile(r"^([A-Za-z]-?\d{2,4})[-_](.+)$")
-
-
-def parse_device_meta(device_id: str) -> tuple[str, str]:
-    normalized = " ".join(device_id.strip().split())
-    if not normalized:
-        return "A-302", "unknown"
-
-    chunks = normalized.split(" ", 1)
-    if len(chunks) == 2 and ROOM_PATTERN.match(chunks[0]):
-        room, name = chunks[0], chunks[1].strip()
-        return room, name or normalized
-
-    legacy_match = LEGACY_DEVICE_PATTERN.match(normalized)
-    if legacy_match:
-        room = legacy_match.group(1).strip()
-        name = legacy_match.group(2).strip()
-        return room, name or normalized
-
-    if ROOM_PATTERN.match(normalized):
-        return normalized, normalized
-
-    return "A-302", normalized
+def upsert_device(session: Session, device_id: str, last_seen_ts: int | None = None) -> DeviceMeta:
+    device = device_registry.touch(session, device_id, last_seen_ts or int(time.time()))
+    presence_monitor.beat(device_id, device.last_seen_ts)
+    return device
 
 
-def upsert_device(session: Session, device_id: str, last_seen_ts: int | None = None) -> Device:
-    room, display_name = parse_device_meta(device_id)
-    dev = session.get(Device, device_id)
-    if dev is None:
-        for obj in session.new:
-            if isinstance(obj, Device) and obj.id == device_id:
-                dev = obj
-                break
-    now = int(time.time())
-    seen = last_seen_ts or now
-    if dev is None:
-        dev = Device(
-            id=device_id,
-            name=display_name,
-            room=room,
-            online=True,
-            last_seen_ts=seen,
-        )
-        session.add(dev)
-    else:
-        if dev.room == "A-302" and room != "A-302":
-            dev.room = room
-        if dev.name.startswith("DormDevice-") and display_name:
-            dev.name = display_name
-        dev.last_seen_ts = max(dev.last_seen_ts, seen)
-        dev.online = now - dev.last_seen_ts <= settings.online_timeout_seconds
-    return dev
+def is_online(last_seen_ts: int, now: int) -> bool:
+    return now - last_seen_ts <= settings.online_timeout_seconds
 
 
-def refresh_online_state(session: Session, device: Device) -> None:
-    _ = session
-    now = int(time.time())
-    device.online = now - device.last_seen_ts <= settings.online_timeout_seconds
-
-
-def update_status_from_payload(session: Session, device_id: str, payload: dict[str, Any]) -> None:
+def update_status_from_payload(session: Session, device_id: str, payload: StatusPayload) -> None:
     now = int(time.time())
     # Both heartbeat and status timestamp rely on server receive time.
     ts = now
     device = upsert_device(session, device_id, now)
-    refresh_online_state(session, device)
-
-    sockets = payload.get("sockets", [])
-    if not isinstance(sockets, list):
-        sockets = []
-    valid_sockets: list[dict[str, Any]] = []
-    for item in sockets:
-        if not isinstance(item, dict):
-            continue
-        if "id" not in item:
-            continue
-        try:
-            socket = SocketStatus(**item)
-        except Exception:
-            continue
-        valid_sockets.append(socket.model_dump())
 
     status = session.get(StripStatus, device_id)
     if status is None:
@@ -223,32 +157,96 @@ def update_status_from_payload(session: Session, device_id: str, payload: dict[s
         session.add(status)
 
     status.ts = ts
-    status.online = bool(payload.get("online", device.online))
-    status.total_power_w = float(payload.get("total_power_w", 0.0))
-    status.voltage_v = float(payload.get("voltage_v", 220.0))
-    status.current_a = float(payload.get("current_a", 0.0))
-    status.sockets_json = json.dumps(valid_sockets, ensure_ascii=False)
+    status.online = payload.online if payload.online is not None else device.online
+    status.total_power_w = payload.total_power_w if payload.total_power_w is not None else 0.0
+    status.voltage_v = payload.voltage_v if payload.voltage_v is not None else 220.0
+    status.current_a = payload.current_a if payload.current_a is not None else 0.0
+    # A repeated socket id keeps its last entry, as the old JSON column did.
+    sockets = list({item.id: item for item in payload.sockets}.values())
+    _store_sockets(session, device_id, sockets)
+    for item in sockets:
+        energy_meter.record(session, device_id, item.id, ts, item.power_w if item.on else 0.0)
+    powers, on_mask = pack_socket_sample(sockets)
+    if powers:
+        session.add(SocketTelemetry(device_id=device_id, ts=ts, powers=powers, on_mask=on_mask))
+
+
+def _store_sockets(session: Session, device_id: str, sockets: list[SocketPayload]) -> None:
+    existing = {
+        row.socket_id: row
+        for row in session.scalars(select(StripSocket).where(StripSocket.device_id == device_id)).all()
+    }
+    for item in sockets:
+        row = existing.pop(item.id, None)
+        if row is None:
+            session.add(
+                StripSocket(
+                    device_id=device_id,
+                    socket_id=item.id,
+                    on=item.on,
+                    power_w=item.power_w,
+                    device=item.device,
+                )
+            )
+            continue
+        # Only assign changed values so an unchanged socket produces no UPDATE.
+        if row.on != item.on:
+            row.on = item.on
+        if row.power_w != item.power_w:
+            row.power_w = item.power_w
+        if row.device != item.device:
+            row.device = item.device
+    for row in existing.values():
+        session.delete(row)
+
+
+def get_socket_states(session: Session, device_id: str) -> list[dict[str, Any]]:
+    rows = session.scalars(
+        select(StripSocket).where(StripSocket.device_id == device_id).order_by(StripSocket.socket_id.asc())
+    ).all()
+    return [{"id": r.socket_id, "on": r.on, "power_w": r.power_w, "device": r.device} for r in rows]
+
+
+def pack_socket_sample(sockets: list[SocketPayload]) -> tuple[bytes, int]:
+    ids = [item.id for item in sockets if 1 <= item.id <= MAX_SOCKET_ID]
+    if not ids:
+        return b"", 0
+    values = [math.nan] * max(ids)
+    on_mask = 0
+    for item in sockets:
+        if not 1 <= item.id <= MAX_SOCKET_ID:
+            continue
+        values[item.id - 1] = item.power_w
+        if item.on:
+            on_mask |= 1 << (item.id - 1)
+    return struct.pack(f"<{len(values)}f", *values), on_mask
+
+
+def unpack_socket_sample(powers: bytes, on_mask: int) -> dict[int, tuple[float, bool]]:
+    values = struct.unpack(f"<{len(powers) // 4}f", powers)
+    return {i + 1: (v, bool(on_mask >> i & 1)) for i, v in enumerate(values) if not math.isnan(v)}
 
 
-def save_telemetry_point(session: Session, device_id: str, payload: dict[str, Any]) -> None:
+def save_telemetry_point(session: Session, device_id: str, payload: TelemetryPayload) -> None:
     now = int(time.time())
     # Telemetry timestamp relies on server receive time.
     ts = now
     upsert_device(session, device_id, now)
-    point = Telemetry(
-        device_id=device_id,
-        ts=ts,
-        power_w=float(payload.get("power_w", payload.get("total_power_w", 0.0))),
-        voltage_v=float(payload.get("voltage_v", 220.0)),
-        current_a=float(payload.get("current_a", 0.0)),
+    power_w = payload.power
+    telemetry_store.append(
+        session,
+        device_id,
+        ts,
+        power_w,
+        payload.voltage_v if payload.voltage_v is not None else 220.0,
+        payload.current_a if payload.current_a is not None else 0.0,
     )
-    session.add(point)
+    energy_meter.record(session, device_id, STRIP_TOTAL, ts, power_w)
 
 
-def sync_status_metrics_from_telemetry(session: Session, device_id: str, payload: dict[str, Any]) -> None:
+def sync_status_metrics_from_telemetry(session: Session, device_id: str, payload: TelemetryPayload) -> None:
     now = int(time.time())
     device = upsert_device(session, device_id, now)
-    refresh_online_state(session, device)
 
     status = session.get(StripStatus, device_id)
     if status is None:
@@ -259,15 +257,17 @@ def sync_status_metrics_from_telemetry(session: Session, device_id: str, payload
             total_power_w=0.0,
             voltage_v=220.0,
             current_a=0.0,
-            sockets_json="[]",
         )
         session.add(status)
 
     status.ts = now
-    status.online = bool(payload.get("online", device.online))
-    status.total_power_w = float(payload.get("power_w", payload.get("total_power_w", status.total_power_w)))
-    status.voltage_v = float(payload.get("voltage_v", status.voltage_v))
-    status.current_a = float(payload.get("current_a", status.current_a))
+    status.online = payload.online if payload.online is not None else device.online
+    if payload.power_w is not None or payload.total_power_w is not None:
+        status.total_power_w = payload.power
+    if payload.voltage_v is not None:
+        status.voltage_v = payload.voltage_v
+    if payload.current_a is not None:
+        status.current_a = payload.current_a
 
 
 def create_cmd_record(session: Session, device_id: str, req: CmdRequest) -> CommandRecord:
@@ -347,37 +347,14 @@ def apply_command_effect_to_status(session: Session, cmd: CommandRecord) -> None
     status = session.get(StripStatus, cmd.device_id)
     if status is None:
         return
-
-    try:
-        sockets = json.loads(status.sockets_json)
-    except Exception:
-        sockets = []
-    if not isinstance(sockets, list):
-        sockets = []
-
-    changed = False
-    updated: list[dict[str, Any]] = []
-    for item in sockets:
-        if not isinstance(item, dict):
-            continue
-        sid = item.get("id")
-        if sid == cmd.socket:
-            next_item = dict(item)
-            next_item["on"] = action == "on"
-            if action == "off":
-                next_item["power_w"] = 0.0
-            changed = True
-            updated.append(next_item)
-        else:
-            updated.append(item)
-
-    if not changed:
+    socket = session.get(StripSocket, {"device_id": cmd.device_id, "socket_id": cmd.socket})
+    if socket is None:
         return
 
-    status.sockets_json = json.dumps(updated, ensure_ascii=False)
-    status.total_power_w = float(
-        sum(float(x.get("power_w", 0.0)) for x in updated if isinstance(x, dict))
-    )
+    socket.on = action == "on"
+    if action == "off":
+        status.total_power_w = max(status.total_power_w - socket.power_w, 0.0)
+        socket.power_w = 0.0
     status.ts = int(time.time())
 
 
@@ -406,11 +383,7 @@ def get_cmd_state(session: Session, cmd_id: str) -> CmdStateOut | None:
     )
 
 
-def build_telemetry_series(
-    session: Session,
-    device_id: str,
-    range_key: str,
-) -> list[dict[str, float | int]]:
+def _series_window(range_key: str) -> tuple[int, int, int, int]:
     cfg = RANGE_CONFIG.get(range_key)
     if cfg is None:
         raise ValueError("range is invalid")
@@ -419,71 +392,169 @@ def build_telemetry_series(
     step: int = cfg["step"]
     now_ts = int(time.time())
     start_ts = now_ts - (points - 1) * step
-
-    rows = session.scalars(
-        select(Telemetry)
-        .where(
-            and_(
-                Telemetry.device_id == device_id,
-                Telemetry.ts >= start_ts,
-                Telemetry.ts <= now_ts,
-            )
-        )
-        .order_by(Telemetry.ts.asc())
-    ).all()
-
-    # For long windows, return real telemetry samples (optionally down-sampled),
-    # instead of slot-filling with zeros, so the curve reflects true history.
-    if range_key != "60s":
-        if not rows:
-            return []
-        if len(rows) <= points:
-            return [{"ts": r.ts, "power_w": round(float(r.power_w), 3)} for r in rows]
-
-        sampled: list[Telemetry] = []
-        step_idx = (len(rows) - 1) / (points - 1)
-        for i in range(points):
-            idx = int(round(i * step_idx))
-            sampled.append(rows[idx])
-        return [{"ts": r.ts, "power_w": round(float(r.power_w), 3)} for r in sampled]
-
-    # For short window (60s), fill per-second slots and carry forward from the
-    # most recent point before the window start to avoid fake leading zeros.
-    prev_row = session.scalar(
-        select(Telemetry)
-        .where(
-            and_(
-                Telemetry.device_id == device_id,
-                Telemetry.ts < start_ts,
-            )
-        )
-        .order_by(Telemetry.ts.desc())
-        .limit(1)
-    )
-
-    slot_values: list[float | None] = [None] * points
-    for row in rows:
-        idx = (row.ts - start_ts) // step
+    return points, step, start_ts, now_ts
+
+
+def _fill_slots(
+    samples: Sequence[tuple[int, T]],
+    carry: T | None,
+    start_ts: int,
+    step: int,
+    points: int,
+) -> list[tuple[int, T | None]]:
+    slot_values: list[T | None] = [None] * points
+    for ts, value in samples:
+        idx = (ts - start_ts) // step
         if idx < 0:
             continue
         if idx >= points:
             idx = points - 1
-        slot_values[idx] = float(row.power_w)
+        slot_values[idx] = value
 
-    carry: float | None = float(prev_row.power_w) if prev_row is not None else None
-    result: list[dict[str, float | int]] = []
+    result: list[tuple[int, T | None]] = []
     for i in range(points):
-        slot_ts = start_ts + i * step
         value = slot_values[i]
         if value is not None:
             carry = value
-        result.append({"ts": slot_ts, "power_w": round(carry if carry is not None else 0.0, 3)})
+        result.append((start_ts + i * step, carry))
     return result
 
 
+def build_telemetry_series(
+    session: Session,
+    device_id: str,
+    range_key: str,
+) -> list[dict[str, float | int]]:
+    points, step, start_ts, now_ts = _series_window(range_key)
+
+    # For long windows, return one real sample per step bucket (the newest in
+    # it) instead of slot-filling with zeros, so the curve reflects true history.
+    # Buckets align to the step, so repeat loads only read rows newer than the
+    # cached series.
+    if range_key != "60s":
+
+        def fetch(since: int, until: int) -> list[tuple[int, float]]:
+            return [(ts, round(power, 3)) for ts, power in telemetry_store.points(session, device_id, since, until)]
+
+        samples = telemetry_series.series(("total", device_id, range_key), step, points, now_ts, fetch)
+        return [{"ts": ts, "power_w": power} for ts, power in samples]
+
+    # For short window (60s), fill per-second slots and carry forward from the
+    # most recent point before the window start to avoid fake leading zeros.
+    rows = telemetry_store.points(session, device_id, start_ts, now_ts)
+    carry = telemetry_store.last_before(session, device_id, start_ts)
+    slots = _fill_slots(rows, carry, start_ts, step, points)
+    return [{"ts": ts, "power_w": round(value if value is not None else 0.0, 3)} for ts, value in slots]
+
+
+def build_socket_telemetry_series(
+    session: Session,
+    device_id: str,
+    range_key: str,
+) -> list[dict[str, Any]]:
+    points, step, start_ts, now_ts = _series_window(range_key)
+
+    samples: list[tuple[int, dict[int, tuple[float, bool]]]]
+    if range_key != "60s":
+
+        def fetch(since: int, until: int) -> list[tuple[int, dict[int, tuple[float, bool]]]]:
+            rows = session.execute(
+                select(SocketTelemetry.ts, SocketTelemetry.powers, SocketTelemetry.on_mask)
+                .where(
+                    and_(
+                        SocketTelemetry.device_id == device_id,
+                        SocketTelemetry.ts >= since,
+                        SocketTelemetry.ts <= until,
+                    )
+                )
+                .order_by(SocketTelemetry.ts.asc())
+            ).all()
+            return [(ts, unpack_socket_sample(powers, on_mask)) for ts, powers, on_mask in rows]
+
+        samples = telemetry_series.series(("sockets", device_id, range_key), step, points, now_ts, fetch)
+    else:
+        rows = session.scalars(
+            select(SocketTelemetry)
+            .where(
+                and_(
+                    SocketTelemetry.device_id == device_id,
+                    SocketTelemetry.ts >= start_ts,
+                    SocketTelemetry.ts <= now_ts,
+                )
+            )
+            .order_by(SocketTelemetry.ts.asc())
+        ).all()
+        prev_row = session.scalar(
+            select(SocketTelemetry)
+            .where(
+                and_(
+                    SocketTelemetry.device_id == device_id,
+                    SocketTelemetry.ts < start_ts,
+                )
+            )
+            .order_by(SocketTelemetry.ts.desc())
+            .limit(1)
+        )
+        carry = unpack_socket_sample(prev_row.powers, prev_row.on_mask) if prev_row is not None else None
+        decoded = [(r.ts, unpack_socket_sample(r.powers, r.on_mask)) for r in rows]
+        samples = [(ts, value or {}) for ts, value in _fill_slots(decoded, carry, start_ts, step, points)]
+
+    socket_ids = sorted({sid for _ts, sockets in samples for sid in sockets})
+    series: dict[int, list[dict[str, Any]]] = {sid: [] for sid in socket_ids}
+    for ts, sockets in samples:
+        for sid in socket_ids:
+            if sid in sockets:
+                power, on = sockets[sid]
+            elif range_key == "60s":
+                power, on = 0.0, False
+            else:
+                continue
+            series[sid].append({"ts": ts, "power_w": round(power, 3), "on": on})
+    return [{"socket": sid, "series": series[sid]} for sid in socket_ids]
+
+
+def _percentile(sorted_values: list[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[int(round(q * (len(sorted_values) - 1)))]
+
+
+def _load_profiles(hourly: dict[int, tuple[float, float]]) -> dict[str, Any]:
+    by_hour: list[list[float]] = [[] for _ in range(24)]
+    by_day: dict[str, list[tuple[float, float]]] = {}
+    for bucket in sorted(hourly):
+        load, peak = hourly[bucket]
+        local = datetime.fromtimestamp(bucket * 3600)
+        by_hour[local.hour].append(load)
+        by_day.setdefault(local.strftime("%Y-%m-%d"), []).append((load, peak))
+
+    hourly_profile = [
+        {"hour": h, "avg_power_w": round(sum(v) / len(v), 2)} for h, v in enumerate(by_hour) if v
+    ]
+    daily_profile = [
+        {
+            "date": day,
+            "avg_power_w": round(sum(x[0] for x in items) / len(items), 2),
+            "peak_power_w": round(max(x[1] for x in items), 2),
+            # Each bucket is the mean load over one hour, so W * 1h summed gives Wh.
+            "energy_kwh": round(sum(x[0] for x in items) / 1000.0, 3),
+        }
+        for day, items in by_day.items()
+    ]
+    peak_hour = max(hourly_profile, key=lambda x: x["avg_power_w"])["hour"]
+    loads = sorted(v[0] for v in hourly.values())
+    return {
+        "hourly_profile": hourly_profile,
+        "daily_profile": daily_profile,
+        "baseline_power_w": round(_percentile(loads, 0.1), 2),
+        "avg_power_w": sum(loads) / len(loads),
+        "peak_window": f"{peak_hour:02d}:00-{(peak_hour + 1) % 24:02d}:00",
+    }
+
+
 def ai_report(session: Session, room_id: str, period: str) -> dict[str, Any]:
-    devices = session.scalars(select(Device).where(Device.room == room_id)).all()
-    device_ids = [d.id for d in devices]
+    now = int(time.time())
+    device_ids = device_registry.room_devices(session, room_id)
     if not device_ids:
         return {
             "room_id": room_id,
@@ -491,33 +562,63 @@ def ai_report(session: Session, room_id: str, period: str) -> dict[str, Any]:
             "summary": "No device data in this room yet.",
             "anomalies": ["No analyzable sample found."],
             "suggestions": ["Ensure devices upload status and telemetry periodically."],
+            "generated_at": now,
         }
 
     days = 7 if period == "7d" else 30
-    start_ts = int(time.time()) - days * 24 * 3600
-    data = session.scalars(
-        select(Telemetry)
-        .where(and_(Telemetry.device_id.in_(device_ids), Telemetry.ts >= start_ts))
-        .order_by(Telemetry.ts.asc())
-    ).all()
-    if not data:
+    start_ts = now - days * 24 * 3600
+    rows = telemetry_store.hourly_stats(session, device_ids, start_ts)
+    if not rows:
         return {
             "room_id": room_id,
             "period": period,
             "summary": "Devices are online but telemetry coverage is insufficient.",
             "anomalies": ["Not enough telemetry points in selected period."],
             "suggestions": ["Increase telemetry frequency to every 1-5 seconds."],
+            "generated_at": now,
         }
 
-    avg_power = sum(d.power_w for d in data) / max(len(data), 1)
-    peak = max(d.power_w for d in data)
+    # Room load per hour is the sum of each device's mean load in that hour.
+    hourly: dict[int, tuple[float, float]] = {}
+    for _device_id, hour_bucket, avg_w, max_w in rows:
+        load, peak = hourly.get(hour_bucket, (0.0, 0.0))
+        hourly[hour_bucket] = (load + avg_w, max(peak, max_w))
+
+    profiles = _load_profiles(hourly)
+    avg_power = profiles.pop("avg_power_w")
+    baseline = profiles["baseline_power_w"]
+    peak = max(v[1] for v in hourly.values())
+    peak_window = profiles["peak_window"]
+
+    # numpy is only needed here; keep it out of process startup.
+    from .analysis import analyze_room
+
+    events = analyze_room(session, device_ids, start_ts)
+    anomalies = [e["message"] for e in events]
+    if not anomalies:
+        anomalies = [f"No anomaly detected. Peak power reached {peak:.1f}W."]
+
+    night = [p["avg_power_w"] for p in profiles["hourly_profile"] if p["hour"] < 6]
+    suggestions: list[str] = []
+    if any(e["kind"] == "standby_drain" for e in events):
+        suggestions.append("Standby drain found at night; cut power to idle sockets before sleeping.")
+    if night and sum(night) / len(night) > max(baseline * 1.2, 5.0):
+        suggestions.append("Night load stays above baseline; enable auto off for low-priority sockets after 00:30.")
+    else:
+        suggestions.append("Enable auto off for low-priority sockets after 00:30.")
+    suggestions.append(f"Set alerts for periods above {baseline * 1.2:.1f}W (baseline + 20%).")
+    suggestions.append(f"Shift flexible loads away from the busiest hour {peak_window}.")
+
     return {
         "room_id": room_id,
         "period": period,
-        "summary": f"Average power is about {avg_power:.1f}W, peak is about {peak:.1f}W.",
-        "anomalies": [f"Peak power reached {peak:.1f}W. Check high-load periods."],
-        "suggestions": [
-            "Enable auto off for low-priority sockets after 00:30.",
-            "Set alerts for periods above baseline by 20%.",
-        ],
+        "summary": (
+            f"Average power is about {avg_power:.1f}W, peak is about {peak:.1f}W, "
+            f"baseline is about {baseline:.1f}W."
+        ),
+        "anomalies": anomalies,
+        "suggestions": suggestions,
+        "peak_power_w": round(peak, 2),
+        "generated_at": now,
+        **profiles,
     }
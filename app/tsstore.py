@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING, Any
+
+from sqlalchemy import and_, delete, func, insert, select
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .models import Telemetry
+
+if TYPE_CHECKING:
+    import asyncio
+
+    import numpy as np
+
+TELEMETRY_STORES = ("sql", "columnar")
+
+
+# Where strip-level telemetry samples (ts, power, voltage, current) live. Device
+# metadata, status, commands and energy counters stay in SQLAlchemy either way;
+# only the sample history moves. Every method takes the caller's session so the
+# SQL backend joins its transaction; other backends may ignore it. A backend
+# missing a method fails at construction, not on its first query.
+class TelemetryStore(ABC):
+    name = ""
+
+    @abstractmethod
+    def append(self, session: Session, device_id: str, ts: int, power_w: float, voltage_v: float, current_a: float) -> None:
+        ...
+
+    @abstractmethod
+    def extend(self, session: Session, rows: list[dict[str, Any]]) -> None:
+        # Bulk load of Telemetry-shaped dicts (fixtures, imports).
+        ...
+
+    @abstractmethod
+    def delete_devices(self, session: Session, device_ids: list[str]) -> None:
+        ...
+
+    def flush(self, session: Session | None = None) -> None:
+        return None
+
+    def start(self, loop: asyncio.AbstractEventLoop) -> None:
+        # Backends that buffer writes flush them periodically from here.
+        return None
+
+    def stop(self) -> None:
+        return None
+
+    @abstractmethod
+    def points(self, session: Session, device_id: str, start_ts: int, end_ts: int) -> list[tuple[int, float]]:
+        # (ts, power_w) with start_ts <= ts <= end_ts, oldest first.
+        ...
+
+    @abstractmethod
+    def last_before(self, session: Session, device_id: str, ts: int) -> float | None:
+        ...
+
+    @abstractmethod
+    def hourly_stats(self, session: Session, device_ids: list[str], start_ts: int) -> list[tuple[str, int, float, float]]:
+        # (device_id, ts // 3600, mean power, max power) per device and hour.
+        ...
+
+    @abstractmethod
+    def binned_means(self, session: Session, device_id: str, start_ts: int, bin_seconds: int) -> tuple[np.ndarray, np.ndarray]:
+        # Bin start times and mean power per non-empty bin, oldest first.
+        ...
+
+    @abstractmethod
+    def count(self, session: Session) -> int:
+        ...
+
+
+class SQLTelemetryStore(TelemetryStore):
+    name = "sql"
+
+    def append(self, session: Session, device_id: str, ts: int, power_w: float, voltage_v: float, current_a: float) -> None:
+        session.add(Telemetry(device_id=device_id, ts=ts, power_w=power_w, voltage_v=voltage_v, current_a=current_a))
+
+    def extend(self, session: Session, rows: list[dict[str, Any]]) -> None:
+        if rows:
+            session.execute(insert(Telemetry), rows)
+
+    def delete_devices(self, session: Session, device_ids: list[str]) -> None:
+        session.execute(delete(Telemetry).where(Telemetry.device_id.in_(device_ids)))
+
+    def points(self, session: Session, device_id: str, start_ts: int, end_ts: int) -> list[tuple[int, float]]:
+        rows = session.execute(
+            select(Telemetry.ts, Telemetry.power_w)
+            .where(and_(Telemetry.device_id == device_id, Telemetry.ts >= start_ts, Telemetry.ts <= end_ts))
+            .order_by(Telemetry.ts.asc())
+        ).all()
+        return [(ts, float(power)) for ts, power in rows]
+
+    def last_before(self, session: Session, device_id: str, ts: int) -> float | None:
+        power = session.scalar(
+            select(Telemetry.power_w)
+            .where(and_(Telemetry.device_id == device_id, Telemetry.ts < ts))
+            .order_by(Telemetry.ts.desc())
+            .limit(1)
+        )
+        return float(power) if power is not None else None
+
+    def hourly_stats(self, session: Session, device_ids: list[str], start_ts: int) -> list[tuple[str, int, float, float]]:
+        bucket = (Telemetry.ts // 3600).label("bucket")
+        rows = session.execute(
+            select(Telemetry.device_id, bucket, func.avg(Telemetry.power_w), func.max(Telemetry.power_w))
+            .where(and_(Telemetry.device_id.in_(device_ids), Telemetry.ts >= start_ts))
+            .group_by(Telemetry.device_id, bucket)
+        ).all()
+        return [(device_id, int(hour), float(avg_w or 0.0), float(max_w or 0.0)) for device_id, hour, avg_w, max_w in rows]
+
+    def binned_means(self, session: Session, device_id: str, start_ts: int, bin_seconds: int) -> tuple[np.ndarray, np.ndarray]:
+        import numpy as np
+
+        # Let the database collapse raw samples to one row per bin so a month of 1 Hz
+        # telemetry arrives as ~43k rows per device instead of ~2.6M.
+        bucket = (Telemetry.ts // bin_seconds).label("bucket")
+        rows = session.execute(
+            select(bucket, func.avg(Telemetry.power_w))
+            .where(and_(Telemetry.device_id == device_id, Telemetry.ts >= start_ts))
+            .group_by(bucket)
+            .order_by(bucket)
+        ).all()
+        ts = np.fromiter((r[0] * bin_seconds for r in rows), dtype=np.int64, count=len(rows))
+        power = np.fromiter((r[1] or 0.0 for r in rows), dtype=np.float64, count=len(rows))
+        return ts, power
+
+    def count(self, session: Session) -> int:
+        return int(session.scalar(select(func.count()).select_from(Telemetry)) or 0)
+
+
+def create_telemetry_store() -> TelemetryStore:
+    if settings.telemetry_store not in TELEMETRY_STORES:
+        raise ValueError(f"TELEMETRY_STORE must be one of {', '.join(TELEMETRY_STORES)}")
+    if settings.telemetry_store == "columnar":
+        # numpy is only needed by this backend; keep it out of SQL-only startups.
+        from .columnstore import ColumnarTelemetryStore
+
+        return ColumnarTelemetryStore(settings.telemetry_store_dir)
+    return SQLTelemetryStore()
+
+
+telemetry_store = create_telemetry_store()
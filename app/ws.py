@@ -17,12 +17,20 @@ class WSManager:
     def disconnect(self, ws: WebSocket) -> None:
         self._clients.discard(ws)
 
+    @property
+    def client_count(self) -> int:
+        return len(self._clients)
+
     async def broadcast(self, payload: dict[str, Any]) -> None:
         if not self._clients:
             return
-        text = json.dumps(payload, ensure_ascii=False)
+        await self.broadcast_text(json.dumps(payload, ensure_ascii=False))
+
+    async def broadcast_text(self, text: str) -> None:
+        if not self._clients:
+            return
         stale: list[WebSocket] = []
-        for ws in self._clients:
+        for ws in list(self._clients):
             try:
                 await ws.send_text(text)
             except Exception:
@@ -0,0 +1,63 @@
+from __future__ import annotations
+
+import argparse
+import json
+import time
+import tracemalloc
+
+import numpy as np
+
+from app.analysis import analyze_device, detect_socket_outliers
+
+
+def make_device_series(rng: np.random.Generator, start: int, days: int, rate_hz: float) -> tuple[np.ndarray, np.ndarray]:
+    n = int(days * 86400 * rate_hz)
+    ts = start + (np.arange(n, dtype=np.float64) / rate_hz).astype(np.int64)
+    hour = (ts // 3600) % 24
+    # Daytime load with a night standby floor, noise and a few injected spikes.
+    power = np.where((hour >= 8) & (hour < 23), 120.0, 6.0) + rng.normal(0.0, 3.0, n)
+    for start_idx in rng.choice(n - 300, size=20, replace=False):
+        power[start_idx : start_idx + int(180 * rate_hz)] += 400.0
+    return ts, np.maximum(power, 0.0)
+
+
+def run(devices: int, days: int, rate_hz: float, seed: int) -> dict[str, float | int]:
+    rng = np.random.default_rng(seed)
+    start = int(time.time()) - days * 86400
+    series = [make_device_series(rng, start, days, rate_hz) for _ in range(devices)]
+    samples = sum(int(ts.size) for ts, _ in series)
+
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    events = 0
+    for i, (ts, power) in enumerate(series):
+        events += len(analyze_device(f"bench-{i}", ts, power))
+    sockets = [(f"bench-{i}", s, "load", float(p)) for i in range(devices) for s, p in enumerate((90.0, 12.0, 8.0, 5.0))]
+    events += len(detect_socket_outliers(sockets))
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "devices": devices,
+        "days": days,
+        "rate_hz": rate_hz,
+        "samples": samples,
+        "events": events,
+        "elapsed_s": round(elapsed, 4),
+        "samples_per_s": round(samples / elapsed, 1),
+        "peak_alloc_mb": round(peak / 1024 / 1024, 2),
+    }
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark anomaly detection over raw telemetry arrays.")
+    parser.add_argument("--devices", type=int, default=4, help="Devices in the simulated room.")
+    parser.add_argument("--days", type=int, default=30, help="Days of telemetry per device.")
+    parser.add_argument("--rate-hz", type=float, default=1.0, help="Telemetry samples per second.")
+    parser.add_argument("--seed", type=int, default=7, help="Random seed.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    print(json.dumps(run(args.devices, args.days, args.rate_hz, args.seed)))
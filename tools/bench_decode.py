@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import argparse
+import json
+import time
+from typing import Any, Callable
+
+import msgspec
+
+from app.payloads import decode_payload
+from app.schemas import SocketStatus
+from tools.simulate_device import make_status
+
+
+def legacy_decode_status(data: bytes) -> Any:
+    # The pre-msgspec path: bytes -> str -> dict, then per-field float() and a
+    # pydantic SocketStatus per socket.
+    payload = json.loads(data.decode("utf-8", errors="ignore"))
+    sockets = [SocketStatus(**item).model_dump() for item in payload.get("sockets", []) if isinstance(item, dict)]
+    return (
+        float(payload.get("total_power_w", 0.0)),
+        float(payload.get("voltage_v", 220.0)),
+        float(payload.get("current_a", 0.0)),
+        sockets,
+    )
+
+
+def fast_decode_status(data: bytes) -> Any:
+    return decode_payload("status", data)
+
+
+def make_messages(count: int, malformed_every: int) -> list[bytes]:
+    messages: list[bytes] = []
+    for i in range(count):
+        if malformed_every and i % malformed_every == 0:
+            messages.append(b'{"total_power_w": "n/a", "sockets": [{"on": true}]')
+        else:
+            messages.append(json.dumps(make_status(1_772_000_000 + i, i)).encode("utf-8"))
+    return messages
+
+
+def measure(decode: Callable[[bytes], Any], messages: list[bytes], rounds: int) -> dict[str, float | int]:
+    rejects = 0
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for data in messages:
+            try:
+                decode(data)
+            except (ValueError, TypeError, msgspec.DecodeError):
+                rejects += 1
+    elapsed = time.perf_counter() - start
+    total = len(messages) * rounds
+    per_msg_us = elapsed / total * 1e6
+    return {
+        "messages": total,
+        "rejects": rejects,
+        "elapsed_s": round(elapsed, 4),
+        "msgs_per_s": round(total / elapsed, 1),
+        "us_per_msg": round(per_msg_us, 3),
+        # Share of one core spent decoding when the bridge receives 10k msgs/s.
+        "cpu_at_10k_msgs_s": round(per_msg_us * 10_000 / 1e6, 4),
+    }
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Compare legacy and msgspec status payload decoding.")
+    parser.add_argument("--messages", type=int, default=10_000, help="Distinct payloads (one second at 10k msgs/s).")
+    parser.add_argument("--rounds", type=int, default=5, help="Passes over the payload set.")
+    parser.add_argument("--malformed-every", type=int, default=100, help="Every Nth payload is malformed (0 = none).")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    messages = make_messages(args.messages, args.malformed_every)
+    print(
+        json.dumps(
+            {
+                "legacy": measure(legacy_decode_status, messages, args.rounds),
+                "msgspec": measure(fast_decode_status, messages, args.rounds),
+            }
+        )
+    )
@@ -0,0 +1,466 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from typing import Any, Callable
+
+# The suite seeds large fixtures and drives the MQTT bridge against an in-process
+# stub broker, so the app settings are pinned before any app module is imported.
+os.environ["DATABASE_URL"] = os.getenv("BENCH_DATABASE_URL", "sqlite:///./bench.db")
+os.environ["TELEMETRY_STORE_DIR"] = os.getenv("BENCH_TELEMETRY_STORE_DIR", "./bench-tsdata")
+os.environ["MQTT_ENABLED"] = "1"
+os.environ["MQTT_HOST"] = "127.0.0.1"
+os.environ["MQTT_PORT"] = os.getenv("BENCH_MQTT_PORT", "18830")
+os.environ["MQTT_SHARED_GROUP"] = ""
+os.environ["MQTT_PARTITION_COUNT"] = "1"
+os.environ["FANOUT_DIR"] = ""
+# post_cmd drives the API from one client address; measure the handler, not the limiter.
+os.environ["RATE_LIMIT_ENABLED"] = "0"
+
+import httpx  # noqa: E402
+import msgspec  # noqa: E402
+import paho.mqtt.client as mqtt  # noqa: E402
+from sqlalchemy import delete  # noqa: E402
+
+from app.bootstrap import run_bootstrap  # noqa: E402
+from app.config import settings  # noqa: E402
+from app.db import engine, get_session  # noqa: E402
+from app.energy import energy_meter  # noqa: E402
+from app.main import app  # noqa: E402
+from app.metrics import mqtt_messages  # noqa: E402
+from app.models import AppMeta, CommandRecord, Device  # noqa: E402
+from app.mqtt_bridge import mqtt_bridge  # noqa: E402
+from app.registry import device_registry  # noqa: E402
+from app.routing import topic_router  # noqa: E402
+from app.series import telemetry_series  # noqa: E402
+from app.services import RANGE_CONFIG, ai_report, build_telemetry_series  # noqa: E402
+from app.tsstore import telemetry_store  # noqa: E402
+from app.ws import WSManager  # noqa: E402
+from tools.simulate_device import make_status  # noqa: E402
+from tools.stub_broker import BrokerThread  # noqa: E402
+
+CASES = ("ingest", "ingest_broker", "telemetry_series", "ai_report", "ws_broadcast", "post_cmd")
+FIXTURE_KEY = "bench_fixture"
+FIXTURE_ROOM = "BENCH"
+FIXTURE_DAYS = 30
+FIXTURE_MAX_AGE_SECONDS = 86400
+SEED_BATCH_ROWS = 50_000
+DAY = 86400
+
+_broker: BrokerThread | None = None
+
+
+def summarize(samples: list[float]) -> dict[str, float | int]:
+    if not samples:
+        return {"runs": 0}
+    ordered = sorted(samples)
+
+    def pick(q: float) -> float:
+        return round(ordered[min(int(q * len(ordered)), len(ordered) - 1)] * 1000.0, 4)
+
+    return {
+        "runs": len(ordered),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000.0, 4),
+        "p50_ms": pick(0.50),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+        "max_ms": round(ordered[-1] * 1000.0, 4),
+    }
+
+
+def wait_until(check: Callable[[], bool], timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if check():
+            return True
+        time.sleep(0.005)
+    return check()
+
+
+def reload_registry() -> None:
+    with get_session() as session:
+        device_registry.load(session)
+
+
+def ensure_broker() -> BrokerThread:
+    # One stub broker and one bridge connection are shared by every case that needs them.
+    global _broker
+    if _broker is None:
+        _broker = BrokerThread(settings.mqtt_host, settings.mqtt_port)
+        _broker.start()
+        mqtt_bridge.start()
+        subscribed = wait_until(
+            lambda: mqtt_bridge.connected and any(s.filters for s in _broker.broker.sessions), 10.0
+        )
+        if not subscribed:
+            raise RuntimeError(f"bridge did not subscribe on stub broker port {_broker.port}")
+    return _broker
+
+
+def stop_broker() -> None:
+    global _broker
+    if _broker is not None:
+        mqtt_bridge.stop()
+        _broker.stop()
+        _broker = None
+
+
+def fixture_devices(count: int) -> list[str]:
+    return [f"bench-{i:03d}" for i in range(count)]
+
+
+def seed_fixture(rows: int, devices: int, reseed: bool) -> dict[str, Any]:
+    # FIXTURE_DAYS of telemetry ending now, spread evenly over the bench devices.
+    device_ids = fixture_devices(devices)
+    spec = f"{rows}:{devices}:{telemetry_store.name}"
+    with get_session() as session:
+        meta = session.get(AppMeta, FIXTURE_KEY)
+    if meta is not None and not reseed:
+        stored, _, anchor = meta.value.rpartition(":")
+        age = int(time.time()) - int(anchor)
+        if stored == spec and age < FIXTURE_MAX_AGE_SECONDS:
+            return {"rows": rows, "devices": devices, "seeded": False, "age_s": age}
+
+    started = time.perf_counter()
+    anchor = int(time.time())
+    per_device = rows // devices
+    step = FIXTURE_DAYS * DAY / per_device
+    with get_session() as session:
+        telemetry_store.delete_devices(session, device_ids)
+        session.execute(delete(Device).where(Device.id.in_(device_ids)))
+        session.add_all(
+            Device(id=d, name=d, room=FIXTURE_ROOM, online=True, last_seen_ts=anchor) for d in device_ids
+        )
+    rng = random.Random(7)
+    batch: list[dict[str, Any]] = []
+    for device_id in device_ids:
+        for n in range(per_device):
+            ts = anchor - int((per_device - 1 - n) * step)
+            hour = ts // 3600 % 24
+            power = max((120.0 if 8 <= hour < 23 else 6.0) + rng.gauss(0.0, 3.0), 0.0)
+            batch.append(
+                {"device_id": device_id, "ts": ts, "power_w": power, "voltage_v": 220.0, "current_a": power / 220.0}
+            )
+            if len(batch) >= SEED_BATCH_ROWS:
+                with get_session() as session:
+                    telemetry_store.extend(session, batch)
+                batch = []
+    if batch:
+        with get_session() as session:
+            telemetry_store.extend(session, batch)
+    with get_session() as session:
+        session.merge(AppMeta(key=FIXTURE_KEY, value=f"{spec}:{anchor}"))
+    reload_registry()
+    return {"rows": per_device * devices, "devices": devices, "seeded": True, "seed_s": round(time.perf_counter() - started, 2)}
+
+
+def make_message(topic: str, payload: bytes) -> mqtt.MQTTMessage:
+    msg = mqtt.MQTTMessage(topic=topic.encode("utf-8"))
+    msg.payload = payload
+    return msg
+
+
+def make_ingest_messages(count: int, devices: int, status_every: int) -> list[tuple[str, bytes]]:
+    prefix = topic_router.prefix
+    messages: list[tuple[str, bytes]] = []
+    for i in range(count):
+        status = make_status(1_772_000_000 + i, i)
+        device = f"ingest-{i % devices:04d}"
+        if status_every and i % status_every == 0:
+            messages.append((f"{prefix}/{device}/status", json.dumps(status).encode("utf-8")))
+        else:
+            payload = {"power_w": status["total_power_w"], "voltage_v": status["voltage_v"], "current_a": status["current_a"]}
+            messages.append((f"{prefix}/{device}/telemetry", json.dumps(payload).encode("utf-8")))
+    return messages
+
+
+def flush_ingest_state() -> None:
+    with get_session() as session:
+        device_registry.flush(session)
+        energy_meter.flush(session)
+        telemetry_store.flush(session)
+
+
+def bench_ingest(args: argparse.Namespace) -> dict[str, Any]:
+    # Calls the paho callback directly: routing, decode, DB writes, no socket I/O.
+    messages = [make_message(t, p) for t, p in make_ingest_messages(args.ingest_messages, args.ingest_devices, 5)]
+    samples: list[float] = []
+    started = time.perf_counter()
+    for msg in messages:
+        t0 = time.perf_counter()
+        mqtt_bridge._on_message(None, None, msg)
+        samples.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - started
+    flush_ingest_state()
+    return {
+        "messages": len(messages),
+        "devices": args.ingest_devices,
+        "elapsed_s": round(elapsed, 3),
+        "msgs_per_s": round(len(messages) / elapsed, 1),
+        "per_msg": summarize(samples),
+    }
+
+
+def bench_ingest_broker(args: argparse.Namespace) -> dict[str, Any]:
+    # End to end through a TCP broker: publisher -> stub broker -> bridge thread -> DB.
+    broker = ensure_broker()
+    messages = make_ingest_messages(args.ingest_messages, args.ingest_devices, 5)
+    handled_before = sum(mqtt_messages.value(t) for t in ("status", "telemetry"))
+    publisher = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id="bench-publisher")
+    publisher.connect(broker.host, broker.port)
+    publisher.loop_start()
+    try:
+        started = time.perf_counter()
+        for topic, payload in messages:
+            publisher.publish(topic, payload, qos=0)
+        published = time.perf_counter() - started
+        target = handled_before + len(messages)
+        done = wait_until(
+            lambda: sum(mqtt_messages.value(t) for t in ("status", "telemetry")) >= target, args.ingest_timeout
+        )
+        elapsed = time.perf_counter() - started
+    finally:
+        publisher.loop_stop()
+        publisher.disconnect()
+    handled = int(sum(mqtt_messages.value(t) for t in ("status", "telemetry")) - handled_before)
+    flush_ingest_state()
+    return {
+        "messages": len(messages),
+        "handled": handled,
+        "complete": done,
+        "publish_s": round(published, 3),
+        "elapsed_s": round(elapsed, 3),
+        "msgs_per_s": round(handled / elapsed, 1),
+    }
+
+
+def bench_telemetry_series(args: argparse.Namespace) -> dict[str, Any]:
+    device_ids = fixture_devices(args.fixture_devices)
+    out: dict[str, Any] = {}
+    for range_key in RANGE_CONFIG:
+        points, step = RANGE_CONFIG[range_key]["points"], RANGE_CONFIG[range_key]["step"]
+        with get_session() as session:
+            now = int(time.time())
+            in_window = len(telemetry_store.points(session, device_ids[0], now - points * step, now))
+        samples: list[float] = []
+        warm: list[float] = []
+        returned = 0
+        for i in range(args.series_repeats):
+            device_id = device_ids[i % len(device_ids)]
+            # Cold: the series cache is emptied first. Warm: the same call again.
+            telemetry_series.clear()
+            for bucket in (samples, warm):
+                t0 = time.perf_counter()
+                with get_session() as session:
+                    returned = len(build_telemetry_series(session, device_id, range_key))
+                bucket.append(time.perf_counter() - t0)
+        out[range_key] = {"rows_in_window": in_window, "points": returned, **summarize(samples), "warm": summarize(warm)}
+    return out
+
+
+def bench_ai_report(args: argparse.Namespace) -> dict[str, Any]:
+    out: dict[str, Any] = {}
+    for period in ("7d", "30d"):
+        samples: list[float] = []
+        anomalies = 0
+        for _ in range(args.report_repeats):
+            t0 = time.perf_counter()
+            with get_session() as session:
+                anomalies = len(ai_report(session, FIXTURE_ROOM, period)["anomalies"])
+            samples.append(time.perf_counter() - t0)
+        out[period] = {"devices": args.fixture_devices, "anomalies": anomalies, **summarize(samples)}
+    return out
+
+
+class NullSocket:
+    # Stands in for a starlette WebSocket; measures the manager loop, not the network.
+    def __init__(self) -> None:
+        self.sent = 0
+
+    async def accept(self) -> None:
+        return None
+
+    async def send_text(self, text: str) -> None:
+        self.sent += 1
+
+
+async def _broadcast_run(clients: int, events: int) -> dict[str, Any]:
+    manager = WSManager()
+    sockets = [NullSocket() for _ in range(clients)]
+    for ws in sockets:
+        await manager.connect(ws)  # type: ignore[arg-type]
+    raw = msgspec.Raw(json.dumps(make_status(1_772_000_000, 1)).encode("utf-8"))
+    text = msgspec.json.encode({"type": "DEVICE_STATUS", "deviceId": "bench-000", "payload": raw}).decode("utf-8")
+    samples: list[float] = []
+    started = time.perf_counter()
+    for _ in range(events):
+        t0 = time.perf_counter()
+        await manager.broadcast_text(text)
+        samples.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - started
+    delivered = sum(ws.sent for ws in sockets)
+    return {
+        "events": events,
+        "delivered": delivered,
+        "events_per_s": round(events / elapsed, 1),
+        "us_per_send": round(elapsed / max(delivered, 1) * 1e6, 3),
+        "per_event": summarize(samples),
+    }
+
+
+def bench_ws_broadcast(args: argparse.Namespace) -> dict[str, Any]:
+    return {str(n): asyncio.run(_broadcast_run(n, args.ws_events)) for n in args.ws_clients}
+
+
+async def _post_cmd_run(args: argparse.Namespace, targets: list[tuple[str, int]]) -> dict[str, Any]:
+    mqtt_bridge.set_loop(asyncio.get_running_loop())
+    semaphore = asyncio.Semaphore(args.cmd_concurrency)
+    samples: list[float] = []
+    statuses: dict[str, int] = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+
+        async def submit(device_id: str, socket_id: int) -> None:
+            async with semaphore:
+                t0 = time.perf_counter()
+                resp = await client.post(f"/api/strips/{device_id}/cmd", json={"socket": socket_id, "action": "on"})
+                samples.append(time.perf_counter() - t0)
+                statuses[str(resp.status_code)] = statuses.get(str(resp.status_code), 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(submit(d, s) for d, s in targets))
+        elapsed = time.perf_counter() - started
+    return {
+        "requests": len(targets),
+        "concurrency": args.cmd_concurrency,
+        "status": statuses,
+        "elapsed_s": round(elapsed, 3),
+        "requests_per_s": round(len(targets) / elapsed, 1),
+        "latency": summarize(samples),
+    }
+
+
+def bench_post_cmd(args: argparse.Namespace) -> dict[str, Any]:
+    # Commands are published to the stub broker, so each one stays pending; every
+    # request targets a distinct (device, socket) pair to avoid 409 conflicts.
+    ensure_broker()
+    device_ids = [f"cmd-{i:04d}" for i in range((args.cmd_requests + 3) // 4)]
+    now = int(time.time())
+    with get_session() as session:
+        session.execute(delete(CommandRecord).where(CommandRecord.device_id.in_(device_ids)))
+        session.execute(delete(Device).where(Device.id.in_(device_ids)))
+        session.add_all(Device(id=d, name=d, room="BENCH-CMD", online=True, last_seen_ts=now) for d in device_ids)
+    reload_registry()
+    targets = [(device_ids[i // 4], i % 4 + 1) for i in range(args.cmd_requests)]
+    return asyncio.run(_post_cmd_run(args, targets))
+
+
+def git_revision() -> str:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5)
+    except OSError:
+        return ""
+    return out.stdout.strip()
+
+
+def compare(result: Any, baseline: Any) -> Any:
+    # Ratio current / baseline for every numeric leaf present in both runs.
+    if isinstance(result, dict) and isinstance(baseline, dict):
+        out = {k: compare(v, baseline[k]) for k, v in result.items() if k in baseline}
+        return {k: v for k, v in out.items() if v is not None and v != {}}
+    if isinstance(result, (int, float)) and isinstance(baseline, (int, float)) and not isinstance(result, bool):
+        return round(result / baseline, 3) if baseline else None
+    return None
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Offline benchmark suite. Uses BENCH_DATABASE_URL (default sqlite:///./bench.db) "
+        "and an in-process stub MQTT broker on BENCH_MQTT_PORT (default 18830)."
+    )
+    parser.add_argument("--cases", default=",".join(CASES), help=f"Comma separated subset of: {', '.join(CASES)}.")
+    parser.add_argument("--output", default="", help="Also write the JSON result to this file.")
+    parser.add_argument("--baseline", default="", help="Earlier result file; adds current/baseline ratios.")
+    parser.add_argument("--fixture-rows", type=int, default=1_000_000, help="Telemetry rows seeded for queries.")
+    parser.add_argument("--fixture-devices", type=int, default=4, help="Devices sharing the seeded rows.")
+    parser.add_argument("--reseed", action="store_true", help="Rebuild the telemetry fixture even if it is current.")
+    parser.add_argument("--ingest-messages", type=int, default=20_000, help="MQTT messages per ingest case.")
+    parser.add_argument("--ingest-devices", type=int, default=200, help="Distinct devices in the ingest stream.")
+    parser.add_argument("--ingest-timeout", type=float, default=120.0, help="Seconds to wait for broker ingest.")
+    parser.add_argument("--series-repeats", type=int, default=20, help="Calls per telemetry range.")
+    parser.add_argument("--report-repeats", type=int, default=3, help="Calls per ai_report period.")
+    parser.add_argument(
+        "--ws-clients",
+        type=lambda v: [int(x) for x in v.split(",") if x],
+        default=[1, 100, 1000],
+        help="Comma separated WS client counts.",
+    )
+    parser.add_argument("--ws-events", type=int, default=1000, help="Events broadcast per client count.")
+    parser.add_argument("--cmd-requests", type=int, default=400, help="POST /cmd requests.")
+    parser.add_argument("--cmd-concurrency", type=int, default=16, help="Concurrent POST /cmd requests.")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    cases = [c.strip() for c in args.cases.split(",") if c.strip()]
+    unknown = sorted(set(cases) - set(CASES))
+    if unknown:
+        raise SystemExit(f"unknown cases: {', '.join(unknown)}")
+
+    # One INFO line per request would dominate the POST /cmd timings.
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    run_bootstrap()
+    reload_registry()
+    result: dict[str, Any] = {
+        "meta": {
+            "started_at": int(time.time()),
+            "git": git_revision(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "database": engine.dialect.name,
+            "telemetry_store": telemetry_store.name,
+            "args": {k: v for k, v in vars(args).items() if k not in {"output", "baseline"}},
+        },
+        "results": {},
+    }
+    if {"telemetry_series", "ai_report"} & set(cases):
+        result["meta"]["fixture"] = seed_fixture(args.fixture_rows, args.fixture_devices, args.reseed)
+
+    runners = {
+        "ingest": bench_ingest,
+        "ingest_broker": bench_ingest_broker,
+        "telemetry_series": bench_telemetry_series,
+        "ai_report": bench_ai_report,
+        "ws_broadcast": bench_ws_broadcast,
+        "post_cmd": bench_post_cmd,
+    }
+    try:
+        for case in cases:
+            started = time.perf_counter()
+            result["results"][case] = runners[case](args)
+            print(f"[bench] {case} done in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+    finally:
+        stop_broker()
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            result["vs_baseline"] = compare(result["results"], json.load(f).get("results", {}))
+    text = json.dumps(result, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
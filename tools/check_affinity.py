@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any
+
+# Checks that horizontally scaled ingest keeps each device on one replica: starts
+# the stub broker, N backend replicas as subprocesses (each with its own SQLite
+# DB) and one MQTT publisher per device, then counts telemetry rows per replica.
+# Exits 1 when a device landed on more than one replica or a message was lost.
+
+SETTLE_SECONDS = 1.0
+
+
+def run_replica() -> None:
+    # Child mode: ingest until the parent writes a line on stdin, then print the
+    # telemetry row count per device.
+    from sqlalchemy import func, select
+
+    from app.bootstrap import run_bootstrap
+    from app.db import get_session
+    from app.models import Telemetry
+    from app.mqtt_bridge import mqtt_bridge
+
+    run_bootstrap()
+    mqtt_bridge.start()
+    sys.stdin.readline()
+    mqtt_bridge.stop()
+    with get_session() as session:
+        rows = session.execute(select(Telemetry.device_id, func.count()).group_by(Telemetry.device_id)).all()
+    print(json.dumps({device_id: count for device_id, count in rows}))
+
+
+def replica_env(args: argparse.Namespace, port: int, index: int, workdir: str) -> dict[str, str]:
+    env = dict(os.environ)
+    env.update(
+        {
+            "DATABASE_URL": f"sqlite:///{os.path.join(workdir, f'replica{index}.db')}",
+            "TELEMETRY_STORE": "sql",
+            "MQTT_ENABLED": "1",
+            "MQTT_HOST": "127.0.0.1",
+            "MQTT_PORT": str(port),
+            "MQTT_TOPIC_PREFIX": "dorm",
+            "MQTT_INSTANCE_ID": f"r{index}",
+            "MQTT_CAPTURE_PATH": "",
+            "FANOUT_DIR": "",
+            "MQTT_SHARED_GROUP": "ingest" if args.mode == "shared" else "",
+            "MQTT_PARTITION_COUNT": str(args.replicas) if args.mode == "partition" else "1",
+            "MQTT_PARTITION_INDEX": str(index) if args.mode == "partition" else "0",
+        }
+    )
+    return env
+
+
+def wait_for(condition: Any, timeout: float, what: str) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise SystemExit(f"timed out waiting for {what}")
+        time.sleep(0.05)
+
+
+def run(args: argparse.Namespace) -> dict[str, Any]:
+    import paho.mqtt.client as mqtt
+
+    from tools.stub_broker import BrokerThread
+
+    broker = BrokerThread()
+    broker.start()
+    with tempfile.TemporaryDirectory(prefix="affinity-") as workdir:
+        replicas = [
+            subprocess.Popen(
+                [sys.executable, "-m", "tools.check_affinity", "--replica"],
+                env=replica_env(args, broker.port, i, workdir),
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                text=True,
+            )
+            for i in range(args.replicas)
+        ]
+        try:
+            wait_for(
+                lambda: sum(1 for s in list(broker.broker.sessions) if s.filters) >= args.replicas,
+                args.timeout,
+                "replicas to subscribe",
+            )
+            # One connection per device: the broker's share strategy keys on the
+            # publisher's client id, as it would for real strips.
+            devices = [f"affinity{i:03d}" for i in range(args.devices)]
+            publishers = []
+            for device_id in devices:
+                client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=device_id)
+                client.connect("127.0.0.1", broker.port)
+                client.loop_start()
+                publishers.append(client)
+            for n in range(args.messages):
+                for device_id, client in zip(devices, publishers):
+                    client.publish(f"dorm/{device_id}/telemetry", json.dumps({"power_w": n}), qos=1)
+            for client in publishers:
+                client.loop_stop()
+                client.disconnect()
+            expected = args.devices * args.messages
+            wait_for(lambda: broker.broker.published >= expected, args.timeout, "publishes")
+            time.sleep(SETTLE_SECONDS)
+            counts = []
+            for proc in replicas:
+                out, _ = proc.communicate("report\n", timeout=args.timeout)
+                counts.append(json.loads(out.strip().splitlines()[-1]))
+        finally:
+            for proc in replicas:
+                if proc.poll() is None:
+                    proc.kill()
+            broker.stop()
+
+    owners = {d: [i for i, c in enumerate(counts) if c.get(d)] for d in devices}
+    split = sorted(d for d, o in owners.items() if len(o) > 1)
+    handled = sum(c.get(d, 0) for c in counts for d in devices)
+    result: dict[str, Any] = {
+        "mode": args.mode,
+        "replicas": args.replicas,
+        "devices": args.devices,
+        "messages": expected,
+        "handled": handled,
+        "delivered": broker.broker.delivered,
+        "per_replica": [sum(c.get(d, 0) for d in devices) for c in counts],
+        "split_devices": split,
+    }
+    if args.mode == "partition":
+        from app.mqtt_bridge import device_partition
+
+        result["misplaced_devices"] = sorted(
+            d for d, o in owners.items() if o and o != [device_partition(d, args.replicas)]
+        )
+    result["ok"] = not split and handled == expected and not result.get("misplaced_devices")
+    return result
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Check that each device's MQTT messages are ingested by one replica.")
+    parser.add_argument("--mode", choices=("shared", "partition"), default="shared", help="MQTT_SHARED_GROUP or MQTT_PARTITION_COUNT.")
+    parser.add_argument("--replicas", type=int, default=2, help="Backend replicas to start.")
+    parser.add_argument("--devices", type=int, default=20, help="Simulated strips, one MQTT connection each.")
+    parser.add_argument("--messages", type=int, default=5, help="Telemetry messages per device.")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Seconds to wait for each phase.")
+    parser.add_argument("--replica", action="store_true", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.replica:
+        run_replica()
+        sys.exit(0)
+    result = run(args)
+    print(json.dumps(result, ensure_ascii=False))
+    sys.exit(0 if result["ok"] else 1)
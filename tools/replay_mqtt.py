@@ -0,0 +1,224 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import hashlib
+import json
+import time
+from typing import Any, Iterable, Iterator, TextIO
+
+from sqlalchemy import func, select
+
+from app.bootstrap import run_bootstrap
+from app.capture import read_capture
+from app.db import get_session
+from app.energy import energy_meter
+from app.models import CommandRecord, Device, EnergyCounter, SocketTelemetry
+from app.mqtt_bridge import mqtt_bridge
+from app.presence import presence_monitor
+from app.registry import device_registry
+from app.tsstore import telemetry_store
+from app.ws import ws_manager
+
+GROWTH_TABLES = {
+    "devices": Device,
+    "socket_telemetry": SocketTelemetry,
+    "energy_counters": EnergyCounter,
+    "cmd_records": CommandRecord,
+}
+WS_SETTLE_SECONDS = 0.3
+
+
+class Pacer:
+    # Re-times captured receive times to wall time: speed 2 plays twice as fast,
+    # speed 0 as fast as possible. Idle gaps longer than max_gap are cut to max_gap.
+    def __init__(self, speed: float, max_gap: float) -> None:
+        self.speed = speed
+        self.max_gap = max_gap
+        self.max_lag = 0.0
+        self.span = 0.0
+
+    def run(self, records: Iterable[tuple[float, str, bytes]]) -> Iterator[tuple[str, bytes]]:
+        started = time.monotonic()
+        first = prev = None
+        skipped = 0.0
+        for ts, topic, payload in records:
+            if first is None:
+                first = prev = ts
+            if self.max_gap and ts - prev > self.max_gap:
+                skipped += ts - prev - self.max_gap
+            prev = ts
+            self.span = ts - first
+            if self.speed > 0:
+                delay = started + (ts - first - skipped) / self.speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    self.max_lag = max(self.max_lag, -delay)
+            yield topic, payload
+
+
+class RecordingSocket:
+    # Registered with ws_manager like a browser client; counts events and keeps a
+    # digest of the device-originated part so two builds can be compared. Presence
+    # events interleave with ingest differently on every run, so the digest is
+    # taken over the sorted multiset rather than the arrival order.
+    def __init__(self, output: TextIO | None) -> None:
+        self.output = output
+        self.events = 0
+        self.bytes = 0
+        self.by_type: dict[str, int] = {}
+        self._stable: list[str] = []
+        self.last_at = time.monotonic()
+
+    async def accept(self) -> None:
+        return None
+
+    async def send_text(self, text: str) -> None:
+        self.events += 1
+        self.bytes += len(text)
+        self.last_at = time.monotonic()
+        event = json.loads(text)
+        kind = event.get("type", "")
+        self.by_type[kind] = self.by_type.get(kind, 0) + 1
+        # Server timestamps and command ids differ between runs and are left out.
+        stable = [kind, event.get("deviceId", "")]
+        if kind in {"DEVICE_STATUS", "TELEMETRY"}:
+            stable.append(json.dumps(event.get("payload"), sort_keys=True))
+        self._stable.append(json.dumps(stable))
+        if self.output is not None:
+            self.output.write(text + "\n")
+
+    def digest(self) -> str:
+        digest = hashlib.blake2b(digest_size=16)
+        for line in sorted(self._stable):
+            digest.update(line.encode("utf-8") + b"\n")
+        return digest.hexdigest()
+
+
+def table_counts() -> dict[str, int]:
+    with get_session() as session:
+        counts = {name: int(session.scalar(select(func.count()).select_from(model)) or 0) for name, model in GROWTH_TABLES.items()}
+        # Counted through the store so the columnar backend is compared like for like.
+        counts["telemetry"] = telemetry_store.count(session)
+        return counts
+
+
+def feed_bridge(records: Iterable[tuple[str, bytes]]) -> int:
+    import paho.mqtt.client as mqtt
+
+    count = 0
+    for topic, payload in records:
+        msg = mqtt.MQTTMessage(topic=topic.encode("utf-8"))
+        msg.payload = payload
+        mqtt_bridge._on_message(None, None, msg)
+        count += 1
+    return count
+
+
+async def replay_bridge(args: argparse.Namespace, pacer: Pacer) -> dict[str, Any]:
+    # Same wiring as the app lifespan for a single ingest worker, minus the MQTT
+    # client: messages go straight into the paho callback from a worker thread.
+    loop = asyncio.get_running_loop()
+    run_bootstrap()
+    with get_session() as session:
+        device_registry.load(session)
+    mqtt_bridge.set_loop(loop)
+    presence_monitor.start(loop, device_registry.snapshot())
+    output = open(args.ws_output, "w", encoding="utf-8") if args.ws_output else None
+    recorder = RecordingSocket(output)
+    await ws_manager.connect(recorder)  # type: ignore[arg-type]
+    before = table_counts()
+    try:
+        started = time.perf_counter()
+        count = await asyncio.to_thread(feed_bridge, limited(pacer.run(read_capture(args.capture)), args.limit))
+        elapsed = time.perf_counter() - started
+        while time.monotonic() - recorder.last_at < WS_SETTLE_SECONDS:
+            await asyncio.sleep(WS_SETTLE_SECONDS / 3)
+        with get_session() as session:
+            device_registry.flush(session)
+            energy_meter.flush(session)
+            telemetry_store.flush(session)
+    finally:
+        presence_monitor.stop()
+        ws_manager.disconnect(recorder)  # type: ignore[arg-type]
+        if output is not None:
+            output.close()
+    after = table_counts()
+    return {
+        "messages": count,
+        "elapsed_s": round(elapsed, 3),
+        "msgs_per_s": round(count / elapsed, 1) if elapsed else 0.0,
+        "db_growth": {name: after[name] - before[name] for name in after},
+        "ws": {
+            "events": recorder.events,
+            "bytes": recorder.bytes,
+            "by_type": recorder.by_type,
+            "digest": recorder.digest(),
+        },
+    }
+
+
+def replay_broker(args: argparse.Namespace, pacer: Pacer) -> dict[str, Any]:
+    import paho.mqtt.client as mqtt
+
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=f"replay-{int(time.time())}")
+    client.connect(args.mqtt_host, args.mqtt_port)
+    client.loop_start()
+    count = errors = 0
+    try:
+        started = time.perf_counter()
+        for topic, payload in limited(pacer.run(read_capture(args.capture)), args.limit):
+            if client.publish(topic, payload, qos=0).rc == 0:
+                count += 1
+            else:
+                errors += 1
+        elapsed = time.perf_counter() - started
+    finally:
+        client.loop_stop()
+        client.disconnect()
+    return {
+        "messages": count,
+        "publish_errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "msgs_per_s": round(count / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+def limited(records: Iterator[tuple[str, bytes]], limit: int) -> Iterator[tuple[str, bytes]]:
+    for i, record in enumerate(records):
+        if limit and i >= limit:
+            return
+        yield record
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Replay an MQTT capture (MQTT_CAPTURE_PATH) into the bridge or a broker.")
+    parser.add_argument("capture", help="Capture file written by the bridge.")
+    parser.add_argument("--target", choices=("bridge", "broker"), default="bridge", help="Where messages are fed.")
+    parser.add_argument("--speed", type=float, default=1.0, help="Time scale: 1 = real time, 10 = 10x, 0 = max speed.")
+    parser.add_argument("--max-gap", type=float, default=0.0, help="Cut idle gaps to this many seconds (0 = keep).")
+    parser.add_argument("--limit", type=int, default=0, help="Stop after this many messages (0 = all).")
+    parser.add_argument("--ws-output", default="", help="Bridge target: write every WS event to this JSONL file.")
+    parser.add_argument("--mqtt-host", default="127.0.0.1", help="Broker target host.")
+    parser.add_argument("--mqtt-port", type=int, default=1883, help="Broker target port.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    pacer = Pacer(args.speed, args.max_gap)
+    if args.target == "bridge":
+        result = asyncio.run(replay_bridge(args, pacer))
+    else:
+        result = replay_broker(args, pacer)
+    result.update(
+        {
+            "capture": args.capture,
+            "target": args.target,
+            "speed": args.speed,
+            "capture_span_s": round(pacer.span, 3),
+            "max_lag_s": round(pacer.max_lag, 3),
+        }
+    )
+    print(json.dumps(result, ensure_ascii=False))
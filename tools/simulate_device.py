@@ -1,14 +1,24 @@
 from __future__ import annotations
 
 import argparse
+import asyncio
+import json
 import math
+import random
+import socket
 import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from dataclasses import dataclass, field
 from typing import Any
 
 from sqlalchemy import and_, select
 
+from app.config import settings
 from app.db import Base, engine, get_session
 from app.models import CommandRecord
+from app.payloads import status_from_dict, telemetry_from_dict
 from app.services import ensure_seed_data, save_telemetry_point, update_cmd_state, update_status_from_payload
 
 
@@ -79,8 +89,8 @@ def run(device_id: str, interval: float, duration: float, auto_ack: bool, ack_de
             "current_a": status["current_a"],
         }
         with get_session() as session:
-            update_status_from_payload(session, device_id, status)
-            save_telemetry_point(session, device_id, telemetry)
+            update_status_from_payload(session, device_id, status_from_dict(status))
+            save_telemetry_point(session, device_id, telemetry_from_dict(telemetry))
 
         acked = auto_ack_pending(device_id, ack_delay) if auto_ack else 0
         print(
@@ -95,18 +105,427 @@ def run(device_id: str, interval: float, duration: float, auto_ack: bool, ack_de
         time.sleep(interval)
 
 
+class AsyncioMqtt:
+    # paho external-loop integration: sockets of every virtual strip are driven by one
+    # asyncio loop instead of a network thread per client.
+    def __init__(self, loop: asyncio.AbstractEventLoop) -> None:
+        self.loop = loop
+        self.clients: set[Any] = set()
+        self._misc: asyncio.Task[None] | None = None
+
+    def attach(self, client: Any) -> None:
+        client.on_socket_open = self._on_socket_open
+        client.on_socket_close = self._on_socket_close
+        client.on_socket_register_write = self._on_socket_register_write
+        client.on_socket_unregister_write = self._on_socket_unregister_write
+
+    def start(self) -> None:
+        self._misc = self.loop.create_task(self._misc_loop())
+
+    def stop(self) -> None:
+        if self._misc is not None:
+            self._misc.cancel()
+
+    def _on_socket_open(self, client: Any, userdata: Any, sock: Any) -> None:
+        self.loop.add_reader(sock, client.loop_read)
+        self.clients.add(client)
+
+    def _on_socket_close(self, client: Any, userdata: Any, sock: Any) -> None:
+        self.loop.remove_reader(sock)
+        self.loop.remove_writer(sock)
+        self.clients.discard(client)
+
+    def _on_socket_register_write(self, client: Any, userdata: Any, sock: Any) -> None:
+        self.loop.add_writer(sock, client.loop_write)
+
+    def _on_socket_unregister_write(self, client: Any, userdata: Any, sock: Any) -> None:
+        self.loop.remove_writer(sock)
+
+    async def _misc_loop(self) -> None:
+        # One keepalive/retry pass for all clients instead of a task per client.
+        while True:
+            for client in list(self.clients):
+                client.loop_misc()
+            await asyncio.sleep(1.0)
+
+
+@dataclass
+class VirtualStrip:
+    index: int
+    room: str
+    name: str
+    prefix: str
+    client: Any = None
+    connected: bool = False
+    tick: int = 0
+
+    @property
+    def device_id(self) -> str:
+        return f"{self.room} {self.name}"
+
+    def topic(self, kind: str) -> str:
+        return f"{self.prefix}/{self.room}/{self.name}/{kind}"
+
+
+def post_json(url: str, body: dict[str, Any], timeout: float = 10.0) -> tuple[int, dict[str, Any]]:
+    req = urllib.request.Request(
+        url, data=json.dumps(body).encode("utf-8"), headers={"Content-Type": "application/json"}, method="POST"
+    )
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return resp.status, json.loads(resp.read() or b"{}")
+    except urllib.error.HTTPError as exc:
+        return exc.code, {}
+    except (OSError, ValueError):
+        return 0, {}
+
+
+def percentiles(samples: list[float]) -> dict[str, float]:
+    if not samples:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0}
+    ordered = sorted(samples)
+
+    def pick(q: float) -> float:
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+    return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99), "max": ordered[-1]}
+
+
+@dataclass
+class FleetStats:
+    started: float = field(default_factory=time.monotonic)
+    sent: dict[str, int] = field(default_factory=lambda: {"status": 0, "telemetry": 0})
+    send_errors: int = 0
+    connects: int = 0
+    connect_errors: int = 0
+    drops: int = 0
+    ws_events: dict[str, int] = field(default_factory=dict)
+    lag_ms: list[float] = field(default_factory=list)
+    window_lag_ms: list[float] = field(default_factory=list)
+    cmd_submitted: int = 0
+    cmd_http: dict[str, int] = field(default_factory=dict)
+    cmd_received: int = 0
+    cmd_device_acks: dict[str, int] = field(default_factory=lambda: {"success": 0, "failed": 0, "lost": 0})
+    cmd_ws_acks: dict[str, int] = field(default_factory=dict)
+    cmd_pending: dict[str, float] = field(default_factory=dict)
+    cmd_rtt_ms: list[float] = field(default_factory=list)
+
+    def commands(self) -> dict[str, Any]:
+        return {
+            "submitted": self.cmd_submitted,
+            "http": dict(self.cmd_http),
+            "received_by_devices": self.cmd_received,
+            "device_acks": dict(self.cmd_device_acks),
+            "ws_acks": dict(self.cmd_ws_acks),
+            "unacked": sum(1 for mark in self.cmd_pending.values() if mark < 0),
+            "submit_to_ack_ms": {k: round(v, 1) for k, v in percentiles(self.cmd_rtt_ms).items()},
+        }
+
+    def summary(self, connected: int) -> dict[str, Any]:
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        ingested = self.ws_events.get("DEVICE_STATUS", 0) + self.ws_events.get("TELEMETRY", 0)
+        return {
+            "elapsed_s": round(elapsed, 1),
+            "connected": connected,
+            "sent": dict(self.sent),
+            "sent_per_s": round(sum(self.sent.values()) / elapsed, 1),
+            "send_errors": self.send_errors,
+            "connects": self.connects,
+            "connect_errors": self.connect_errors,
+            "drops": self.drops,
+            "ws_events": dict(self.ws_events),
+            "ingested_per_s": round(ingested / elapsed, 1),
+            "ingest_lag_ms": {k: round(v, 1) for k, v in percentiles(self.lag_ms).items()},
+            "commands": self.commands(),
+        }
+
+
+class Fleet:
+    def __init__(self, args: argparse.Namespace) -> None:
+        self.args = args
+        self.stats = FleetStats()
+        per_room = args.strips_per_room
+        self.strips = [
+            VirtualStrip(i, f"{args.room_prefix}-{101 + i // per_room}", f"strip{i % per_room + 1:02d}", args.prefix)
+            for i in range(args.fleet)
+        ]
+        self.rng = random.Random(args.seed)
+        self.mqtt: AsyncioMqtt | None = None
+        self.stopping = False
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        self.mqtt = AsyncioMqtt(loop)
+        self.mqtt.start()
+        tasks = [loop.create_task(self._reporter())]
+        if self.args.ws_url:
+            tasks.append(loop.create_task(self._ws_listener()))
+        if self.args.storm_every > 0:
+            tasks.append(loop.create_task(self._storms()))
+        if self.args.cmd_rate > 0:
+            tasks.append(loop.create_task(self._cmd_driver()))
+        tasks.extend(loop.create_task(self._drive(strip)) for strip in self.strips)
+        print(f"[fleet] start strips={len(self.strips)} broker={self.args.mqtt_host}:{self.args.mqtt_port}")
+        try:
+            if self.args.duration > 0:
+                await asyncio.sleep(self.args.duration)
+            else:
+                await asyncio.Event().wait()
+        finally:
+            self.stopping = True
+            summary = self.stats.summary(self._connected())
+            for task in tasks:
+                task.cancel()
+            for strip in self.strips:
+                if strip.client is not None:
+                    strip.client.disconnect()
+            await asyncio.sleep(0.2)
+            self.mqtt.stop()
+            print("[fleet] summary " + json.dumps(summary, ensure_ascii=False))
+
+    def _connected(self) -> int:
+        return sum(1 for s in self.strips if s.connected)
+
+    def _new_client(self, strip: VirtualStrip) -> Any:
+        import paho.mqtt.client as mqtt
+
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=f"sim-{strip.index}-{strip.name}", userdata=strip)
+        if self.args.mqtt_username:
+            client.username_pw_set(self.args.mqtt_username, self.args.mqtt_password)
+        # The broker publishes this when the connection drops without DISCONNECT.
+        client.will_set(strip.topic("lwt"), json.dumps({"reason": "sim_drop"}), qos=1)
+        client.on_connect = self._on_connect
+        client.on_disconnect = self._on_disconnect
+        client.on_message = self._on_cmd
+        assert self.mqtt is not None
+        self.mqtt.attach(client)
+        return client
+
+    def _on_connect(self, client: Any, strip: VirtualStrip, flags: Any, reason_code: Any, properties: Any = None) -> None:
+        strip.connected = reason_code == 0
+        if strip.connected:
+            self.stats.connects += 1
+            client.subscribe(strip.topic("cmd"), qos=1)
+
+    def _on_disconnect(self, client: Any, strip: VirtualStrip, flags: Any, reason_code: Any, properties: Any = None) -> None:
+        strip.connected = False
+
+    def _connect(self, strip: VirtualStrip) -> None:
+        try:
+            if strip.client is None:
+                strip.client = self._new_client(strip)
+                strip.client.connect(self.args.mqtt_host, self.args.mqtt_port, keepalive=60)
+            else:
+                strip.client.reconnect()
+        except OSError:
+            self.stats.connect_errors += 1
+
+    def _jittered(self, interval: float) -> float:
+        return max(interval * (1.0 + self.rng.uniform(-self.args.jitter, self.args.jitter)), 0.01)
+
+    async def _drive(self, strip: VirtualStrip) -> None:
+        await asyncio.sleep(self.rng.uniform(0.0, self.args.ramp))
+        self._connect(strip)
+        # Each strip gets its own phase so the fleet does not move in lockstep.
+        strip.tick = self.rng.randrange(0, 1000)
+        next_status = time.monotonic()
+        next_telemetry = time.monotonic() + self._jittered(self.args.telemetry_interval)
+        while not self.stopping:
+            now = time.monotonic()
+            if now >= next_status:
+                self._publish(strip, "status")
+                next_status = now + self._jittered(self.args.status_interval)
+            if now >= next_telemetry:
+                self._publish(strip, "telemetry")
+                next_telemetry = now + self._jittered(self.args.telemetry_interval)
+            await asyncio.sleep(max(min(next_status, next_telemetry) - time.monotonic(), 0.0))
+
+    def _publish(self, strip: VirtualStrip, kind: str) -> None:
+        if not strip.connected:
+            return
+        status = make_status(int(time.time()), strip.tick)
+        strip.tick += 1
+        if kind == "status":
+            payload: dict[str, Any] = status
+        else:
+            payload = {
+                "power_w": status["total_power_w"],
+                "voltage_v": status["voltage_v"],
+                "current_a": status["current_a"],
+            }
+        # Extra field ignored by the backend decoder, echoed back in the WS event.
+        payload["sim_ts"] = time.time()
+        info = strip.client.publish(strip.topic(kind), json.dumps(payload), qos=0)
+        if info.rc == 0:
+            self.stats.sent[kind] += 1
+        else:
+            self.stats.send_errors += 1
+
+    def _on_cmd(self, client: Any, strip: VirtualStrip, msg: Any) -> None:
+        # Runs inside loop_read, i.e. on the event loop, so call_later is safe here.
+        try:
+            cmd = json.loads(msg.payload)
+        except ValueError:
+            return
+        self.stats.cmd_received += 1
+        if self.rng.random() < self.args.ack_loss:
+            self.stats.cmd_device_acks["lost"] += 1
+            return
+        failed = self.rng.random() < self.args.ack_failure_rate
+        delay = self._jittered(self.args.ack_delay)
+        asyncio.get_running_loop().call_later(delay, self._send_ack, strip, cmd.get("cmdId", ""), failed, delay)
+
+    def _send_ack(self, strip: VirtualStrip, cmd_id: str, failed: bool, delay: float) -> None:
+        if not strip.connected:
+            self.stats.cmd_device_acks["lost"] += 1
+            return
+        ack = {
+            "cmdId": cmd_id,
+            "status": "failed" if failed else "success",
+            "costMs": int(delay * 1000),
+            "errorMsg": "simulated failure" if failed else "",
+        }
+        strip.client.publish(strip.topic("ack"), json.dumps(ack), qos=1)
+        self.stats.cmd_device_acks[ack["status"]] += 1
+
+    async def _cmd_driver(self) -> None:
+        interval = 1.0 / self.args.cmd_rate
+        while True:
+            await asyncio.sleep(self._jittered(interval))
+            targets = [s for s in self.strips if s.connected]
+            if targets:
+                strip = self.rng.choice(targets)
+                body = {"socket": self.rng.randint(1, 4), "action": self.rng.choice(["on", "off"])}
+                asyncio.ensure_future(self._submit_cmd(strip, body))
+
+    async def _submit_cmd(self, strip: VirtualStrip, body: dict[str, Any]) -> None:
+        url = f"{self.args.api_url.rstrip('/')}/api/strips/{urllib.parse.quote(strip.device_id)}/cmd"
+        started = time.time()
+        status, result = await asyncio.to_thread(post_json, url, body)
+        self.stats.cmd_submitted += 1
+        self.stats.cmd_http[str(status)] = self.stats.cmd_http.get(str(status), 0) + 1
+        cmd_id = result.get("cmdId") if status == 200 else None
+        if cmd_id:
+            # The WS ack can beat the HTTP response; it then parks its arrival time here.
+            acked_at = self.stats.cmd_pending.pop(cmd_id, None)
+            if acked_at is not None:
+                self.stats.cmd_rtt_ms.append((acked_at - started) * 1000.0)
+            else:
+                self.stats.cmd_pending[cmd_id] = -started
+
+    async def _storms(self) -> None:
+        while True:
+            await asyncio.sleep(self.args.storm_every)
+            victims = [s for s in self.strips if s.connected]
+            victims = self.rng.sample(victims, int(len(victims) * self.args.storm_fraction))
+            for strip in victims:
+                sock = strip.client.socket()
+                if sock is not None:
+                    # Drop the TCP connection without DISCONNECT so the broker fires the will.
+                    sock.shutdown(socket.SHUT_RDWR)
+                    self.stats.drops += 1
+            print(f"[fleet] storm dropped={len(victims)}")
+            await asyncio.sleep(self.args.storm_downtime)
+            # Everyone comes back at once: that is the storm.
+            for strip in victims:
+                if not self.stopping:
+                    self._connect(strip)
+
+    async def _ws_listener(self) -> None:
+        import websockets
+
+        while True:
+            try:
+                async with websockets.connect(self.args.ws_url, max_size=None) as ws:
+                    async for raw in ws:
+                        self._on_ws_event(json.loads(raw))
+            except (OSError, websockets.WebSocketException):
+                await asyncio.sleep(1.0)
+
+    def _on_ws_event(self, event: dict[str, Any]) -> None:
+        kind = str(event.get("type", ""))
+        self.stats.ws_events[kind] = self.stats.ws_events.get(kind, 0) + 1
+        if kind == "CMD_ACK":
+            self._on_cmd_ack(event)
+            return
+        payload = event.get("payload")
+        if isinstance(payload, dict) and "sim_ts" in payload:
+            lag = (time.time() - float(payload["sim_ts"])) * 1000.0
+            self.stats.lag_ms.append(lag)
+            self.stats.window_lag_ms.append(lag)
+
+    def _on_cmd_ack(self, event: dict[str, Any]) -> None:
+        cmd_id = str(event.get("cmdId", ""))
+        state = str(event.get("state", ""))
+        self.stats.cmd_ws_acks[state] = self.stats.cmd_ws_acks.get(state, 0) + 1
+        # Negative values are submit times; a positive one is an ack that arrived first.
+        mark = self.stats.cmd_pending.pop(cmd_id, None)
+        if mark is None:
+            self.stats.cmd_pending[cmd_id] = time.time()
+        elif mark < 0:
+            self.stats.cmd_rtt_ms.append((time.time() + mark) * 1000.0)
+
+    async def _reporter(self) -> None:
+        last_sent = 0
+        while True:
+            await asyncio.sleep(self.args.report_interval)
+            sent = sum(self.stats.sent.values())
+            lag = percentiles(self.stats.window_lag_ms)
+            self.stats.window_lag_ms = []
+            print(
+                f"[fleet] connected={self._connected()}/{len(self.strips)} "
+                f"sent/s={(sent - last_sent) / self.args.report_interval:.1f} "
+                f"lag_ms p50={lag['p50']:.1f} p95={lag['p95']:.1f} p99={lag['p99']:.1f} "
+                f"offline_events={self.stats.ws_events.get('DEVICE_OFFLINE', 0)}"
+                + (f" cmd_rtt_ms p95={percentiles(self.stats.cmd_rtt_ms)['p95']:.1f}" if self.args.cmd_rate else "")
+            )
+            last_sent = sent
+
+
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="Simulate status/telemetry without ESP device.")
     parser.add_argument("--device-id", default="strip01", help="Target device id.")
     parser.add_argument("--interval", type=float, default=1.0, help="Write interval in seconds.")
     parser.add_argument("--duration", type=float, default=0.0, help="Run duration seconds (0 means forever).")
     parser.add_argument("--auto-ack", action="store_true", help="Auto mark pending commands as success.")
-    parser.add_argument("--ack-delay", type=float, default=1.2, help="Seconds before auto ack.")
+    parser.add_argument(
+        "--ack-delay", type=float, default=1.2, help="Seconds before auto ack (DB mode) or device ack (fleet mode)."
+    )
+    fleet = parser.add_argument_group("fleet mode (virtual strips over MQTT)")
+    fleet.add_argument("--fleet", type=int, default=0, help="Number of virtual strips; 0 keeps single-device DB mode.")
+    fleet.add_argument("--mqtt-host", default=settings.mqtt_host)
+    fleet.add_argument("--mqtt-port", type=int, default=settings.mqtt_port)
+    fleet.add_argument("--mqtt-username", default=settings.mqtt_username)
+    fleet.add_argument("--mqtt-password", default=settings.mqtt_password)
+    fleet.add_argument("--prefix", default=settings.mqtt_topic_prefix, help="MQTT topic prefix.")
+    fleet.add_argument("--room-prefix", default="S", help="Rooms are named <room-prefix>-101, -102, ...")
+    fleet.add_argument("--strips-per-room", type=int, default=4)
+    fleet.add_argument("--status-interval", type=float, default=10.0, help="Seconds between status messages per strip.")
+    fleet.add_argument("--telemetry-interval", type=float, default=2.0, help="Seconds between telemetry messages per strip.")
+    fleet.add_argument("--jitter", type=float, default=0.2, help="Relative +/- jitter applied to every interval.")
+    fleet.add_argument("--ramp", type=float, default=5.0, help="Spread initial connects over this many seconds.")
+    fleet.add_argument("--storm-every", type=float, default=0.0, help="Seconds between reconnect storms (0 disables).")
+    fleet.add_argument("--storm-fraction", type=float, default=0.2, help="Fraction of strips dropped per storm.")
+    fleet.add_argument("--storm-downtime", type=float, default=5.0, help="Seconds dropped strips stay away.")
+    fleet.add_argument("--ws-url", default="", help="Backend /ws URL used to measure ingest lag, e.g. ws://127.0.0.1:8000/ws")
+    fleet.add_argument("--report-interval", type=float, default=5.0)
+    fleet.add_argument("--api-url", default="http://127.0.0.1:8000", help="Backend base URL for command submission.")
+    fleet.add_argument("--cmd-rate", type=float, default=0.0, help="Commands per second via POST /cmd (needs --ws-url).")
+    fleet.add_argument("--ack-failure-rate", type=float, default=0.0, help="Fraction of commands acked as failed.")
+    fleet.add_argument("--ack-loss", type=float, default=0.0, help="Fraction of commands never acked.")
+    fleet.add_argument("--seed", type=int, default=1)
     return parser.parse_args()
 
 
 if __name__ == "__main__":
     args = parse_args()
+    if args.fleet > 0:
+        args.strips_per_room = max(args.strips_per_room, 1)
+        try:
+            asyncio.run(Fleet(args).run())
+        except KeyboardInterrupt:
+            pass
+        raise SystemExit(0)
     run(
         device_id=args.device_id,
         interval=max(args.interval, 0.2),
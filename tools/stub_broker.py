@@ -0,0 +1,251 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+import struct
+import threading
+import zlib
+from dataclasses import dataclass, field
+
+logger = logging.getLogger("stub-broker")
+
+CONNECT, CONNACK, PUBLISH, PUBACK = 1, 2, 3, 4
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK = 8, 9, 10, 11
+PINGREQ, PINGRESP, DISCONNECT = 12, 13, 14
+
+
+def encode_length(n: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte, n = n % 128, n // 128
+        out.append(byte | (0x80 if n else 0))
+        if not n:
+            return bytes(out)
+
+
+def packet(kind: int, flags: int, body: bytes) -> bytes:
+    return bytes([(kind << 4) | flags]) + encode_length(len(body)) + body
+
+
+def decode_length(data: bytes, pos: int) -> tuple[int, int]:
+    mult, n = 1, 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        n += (byte & 0x7F) * mult
+        mult *= 128
+        if not byte & 0x80:
+            return n, pos
+
+
+def skip_properties(data: bytes, pos: int) -> int:
+    size, pos = decode_length(data, pos)
+    return pos + size
+
+
+def mqtt_str(data: bytes, pos: int) -> tuple[bytes, int]:
+    (size,) = struct.unpack_from("!H", data, pos)
+    return data[pos + 2 : pos + 2 + size], pos + 2 + size
+
+
+def split_share(pattern: str) -> tuple[str | None, str]:
+    if pattern.startswith("$share/"):
+        _, group, pattern = pattern.split("/", 2)
+        return group, pattern
+    return None, pattern
+
+
+def topic_matches(pattern: str, topic: str) -> bool:
+    p_parts, t_parts = pattern.split("/"), topic.split("/")
+    for i, part in enumerate(p_parts):
+        if part == "#":
+            return True
+        if i >= len(t_parts) or (part != "+" and part != t_parts[i]):
+            return False
+    return len(p_parts) == len(t_parts)
+
+
+@dataclass(eq=False)
+class Session:
+    writer: asyncio.StreamWriter
+    client_id: str = ""
+    v5: bool = False
+    filters: list[str] = field(default_factory=list)
+    will: tuple[str, bytes] | None = None
+
+
+class StubBroker:
+    # MQTT 3.1.1 and 5.0 subset: QoS 0 delivery (QoS 1 publishes are acked),
+    # wildcards, last-will on abrupt close, and $share groups. A shared message
+    # goes to one member of each group, picked by crc32 of the publisher's client
+    # id like EMQX's hash_clientid strategy, so one device sticks to one member.
+    # v5 properties are parsed and ignored.
+    def __init__(self) -> None:
+        self.sessions: set[Session] = set()
+        self.published = 0
+        self.delivered = 0
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        session = Session(writer)
+        clean = False
+        try:
+            while True:
+                header = await reader.readexactly(1)
+                mult, length = 1, 0
+                while True:
+                    byte = (await reader.readexactly(1))[0]
+                    length += (byte & 0x7F) * mult
+                    mult *= 128
+                    if not byte & 0x80:
+                        break
+                body = await reader.readexactly(length) if length else b""
+                kind, flags = header[0] >> 4, header[0] & 0x0F
+                if kind == CONNECT:
+                    self._on_connect(session, body)
+                elif kind == PUBLISH:
+                    self._on_publish(session, flags, body)
+                elif kind == SUBSCRIBE:
+                    self._on_subscribe(session, body)
+                elif kind == UNSUBSCRIBE:
+                    self._on_unsubscribe(session, body)
+                elif kind == PINGREQ:
+                    writer.write(packet(PINGRESP, 0, b""))
+                elif kind == DISCONNECT:
+                    clean = True
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.sessions.discard(session)
+            if not clean and session.will is not None:
+                self.route(*session.will, session.client_id)
+            writer.close()
+
+    def _on_connect(self, session: Session, body: bytes) -> None:
+        _name, pos = mqtt_str(body, 0)
+        session.v5 = body[pos] == 5
+        flags = body[pos + 1]
+        pos += 4
+        if session.v5:
+            pos = skip_properties(body, pos)
+        client_id, pos = mqtt_str(body, pos)
+        session.client_id = client_id.decode()
+        if flags & 0x04:
+            if session.v5:
+                pos = skip_properties(body, pos)
+            will_topic, pos = mqtt_str(body, pos)
+            will_msg, pos = mqtt_str(body, pos)
+            session.will = (will_topic.decode(), will_msg)
+        for other in [s for s in self.sessions if s.client_id == session.client_id]:
+            other.writer.close()
+            self.sessions.discard(other)
+        self.sessions.add(session)
+        # v5 CONNACK carries an (empty) property block after the reason code.
+        session.writer.write(packet(CONNACK, 0, b"\x00\x00\x00" if session.v5 else b"\x00\x00"))
+
+    def _on_publish(self, session: Session, flags: int, body: bytes) -> None:
+        qos = (flags >> 1) & 0x03
+        topic, pos = mqtt_str(body, 0)
+        if qos:
+            (pid,) = struct.unpack_from("!H", body, pos)
+            pos += 2
+            session.writer.write(packet(PUBACK, 0, struct.pack("!H", pid)))
+        if session.v5:
+            pos = skip_properties(body, pos)
+        self.route(topic.decode(), body[pos:], session.client_id)
+
+    def _on_subscribe(self, session: Session, body: bytes) -> None:
+        (pid,) = struct.unpack_from("!H", body, 0)
+        pos, granted = 2, bytearray()
+        if session.v5:
+            pos = skip_properties(body, pos)
+        while pos < len(body):
+            topic, pos = mqtt_str(body, pos)
+            pos += 1
+            if topic.decode() not in session.filters:
+                session.filters.append(topic.decode())
+            granted.append(0)
+        props = b"\x00" if session.v5 else b""
+        session.writer.write(packet(SUBACK, 0, struct.pack("!H", pid) + props + bytes(granted)))
+
+    def _on_unsubscribe(self, session: Session, body: bytes) -> None:
+        (pid,) = struct.unpack_from("!H", body, 0)
+        pos, codes = 2, bytearray()
+        if session.v5:
+            pos = skip_properties(body, pos)
+        while pos < len(body):
+            topic, pos = mqtt_str(body, pos)
+            if topic.decode() in session.filters:
+                session.filters.remove(topic.decode())
+            codes.append(0)
+        # v3.1.1 UNSUBACK is just the packet id.
+        tail = b"\x00" + bytes(codes) if session.v5 else b""
+        session.writer.write(packet(UNSUBACK, 0, struct.pack("!H", pid) + tail))
+
+    def route(self, topic: str, payload: bytes, publisher: str = "") -> None:
+        self.published += 1
+        targets: set[Session] = set()
+        groups: dict[str, list[Session]] = {}
+        for session in list(self.sessions):
+            for f in session.filters:
+                group, pattern = split_share(f)
+                if not topic_matches(pattern, topic):
+                    continue
+                if group is None:
+                    targets.add(session)
+                elif session not in groups.setdefault(group, []):
+                    groups[group].append(session)
+        for members in groups.values():
+            members.sort(key=lambda s: s.client_id)
+            targets.add(members[zlib.crc32(publisher.encode()) % len(members)])
+        if not targets:
+            return
+        head = struct.pack("!H", len(topic.encode())) + topic.encode()
+        v3 = packet(PUBLISH, 0, head + payload)
+        v5 = packet(PUBLISH, 0, head + b"\x00" + payload)
+        for session in targets:
+            session.writer.write(v5 if session.v5 else v3)
+            self.delivered += 1
+
+
+# Runs the broker on its own event loop thread so synchronous benchmarks can use it.
+class BrokerThread:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0) -> None:
+        self.host = host
+        self.port = port
+        self.broker = StubBroker()
+        self._loop = asyncio.new_event_loop()
+        self._server: asyncio.Server | None = None
+        self._thread = threading.Thread(target=self._loop.run_forever, name="stub-broker", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+        future = asyncio.run_coroutine_threadsafe(
+            asyncio.start_server(self.broker.handle, self.host, self.port, limit=1 << 20), self._loop
+        )
+        self._server = future.result(timeout=5)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._loop.call_soon_threadsafe(self._server.close)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+
+
+async def serve(host: str, port: int) -> None:
+    broker = StubBroker()
+    server = await asyncio.start_server(broker.handle, host, port, limit=1 << 20)
+    logger.info("stub broker on %s:%s", host, port)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Minimal local MQTT broker for simulations and benchmarks.")
+    parser.add_argument("--host", default="127.0.0.1", help="Listen address.")
+    parser.add_argument("--port", type=int, default=1883, help="Listen port.")
+    a = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(serve(a.host, a.port))